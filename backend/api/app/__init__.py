@@ -2,6 +2,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import os
+import tempfile
 
 db = SQLAlchemy()
 
@@ -10,13 +11,185 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['ATTENDANCE_SECRET_SEED'] = os.getenv('ATTENDANCE_SECRET_SEED', 'default-secret-seed-change-in-production')
+    app.config['BACKGROUND_TASKS'] = os.getenv('BACKGROUND_TASKS', 'true').lower() == 'true'
+
+    # Code lookup: 'memory' resolves codes from this process's code index (the
+    # lecturer must have polled /code on the same worker); 'table' resolves them
+    # from a precomputed per-window table shared by every worker on the node
+    app.config['CODE_LOOKUP_MODE'] = os.getenv('CODE_LOOKUP_MODE', 'memory')
+    app.config['CODE_TABLE_PATH'] = os.getenv(
+        'CODE_TABLE_PATH', os.path.join(tempfile.gettempdir(), 'registreak-codes.sqlite3')
+    )
+    app.config['CODE_TABLE_REFRESH_SECONDS'] = float(os.getenv('CODE_TABLE_REFRESH_SECONDS', '5'))
+    app.config['CODE_TOLERANCE'] = int(os.getenv('CODE_TOLERANCE', '1'))
+    # /code/stream connections end (and clients reconnect) after this long
+    app.config['CODE_STREAM_MAX_SECONDS'] = float(os.getenv('CODE_STREAM_MAX_SECONDS', '3600'))
+
+    # Check-in events for live streams: 'memory' (this process only) or
+    # 'postgres' (LISTEN/NOTIFY across workers; needs a direct connection, so
+    # set PUBSUB_DATABASE_URL if DATABASE_URL goes through PgBouncer)
+    app.config['PUBSUB_BACKEND'] = os.getenv('PUBSUB_BACKEND', 'memory')
+    app.config['PUBSUB_DATABASE_URL'] = os.getenv('PUBSUB_DATABASE_URL')
+    # /attendance/live connections end (and clients reconnect) after this long
+    app.config['LIVE_COUNTS_MAX_SECONDS'] = float(os.getenv('LIVE_COUNTS_MAX_SECONDS', '3600'))
+    # Streams (/code/stream, /attendance/live) one WSGI worker serves at once,
+    # more get 503 (see app/sse.py). Each holds a thread on gthread workers, so
+    # those serve none unless asked: run the streams on asgi.py instead
+    gevent_workers = os.getenv('GUNICORN_WORKER_CLASS', 'gthread') == 'gevent'
+    app.config['WSGI_STREAM_LIMIT'] = int(os.getenv(
+        'WSGI_STREAM_LIMIT',
+        str(int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500')) // 2) if gevent_workers else '0',
+    ))
+
+    # Lecture close-out: wakes when the next lecture ends, or at least this often
+    app.config['LECTURE_CLOSEOUT_SECONDS'] = float(os.getenv('LECTURE_CLOSEOUT_SECONDS', '60'))
+    app.config['LECTURE_CLOSEOUT_BATCH'] = int(os.getenv('LECTURE_CLOSEOUT_BATCH', '500'))
+
+    # Check-in writes: 'direct' commits each /verify; 'buffered' appends it to a
+    # local durable log that one process per node flushes in batches (see
+    # app/attendance_log.py). Close-out then trails lecture ends by a delay so
+    # buffered check-ins are applied before missed-lecture streak resets.
+    app.config['ATTENDANCE_WRITE_MODE'] = os.getenv('ATTENDANCE_WRITE_MODE', 'direct')
+    app.config['ATTENDANCE_LOG_PATH'] = os.getenv(
+        'ATTENDANCE_LOG_PATH', os.path.join(tempfile.gettempdir(), 'registreak-attendance.sqlite3')
+    )
+    app.config['ATTENDANCE_FLUSH_SECONDS'] = float(os.getenv('ATTENDANCE_FLUSH_SECONDS', '0.25'))
+    app.config['ATTENDANCE_FLUSH_BATCH'] = int(os.getenv('ATTENDANCE_FLUSH_BATCH', '5000'))
+    app.config['LECTURE_CLOSEOUT_DELAY_SECONDS'] = float(os.getenv(
+        'LECTURE_CLOSEOUT_DELAY_SECONDS', '30' if app.config['ATTENDANCE_WRITE_MODE'] == 'buffered' else '0'
+    ))
+
+    # How far /attendance sync cursors trail the clock, to cover in-flight commits
+    app.config['ATTENDANCE_SYNC_LAG_SECONDS'] = float(os.getenv('ATTENDANCE_SYNC_LAG_SECONDS', '30'))
+
+    # Response cache for read endpoints (per worker process, invalidated on every
+    # worker through the event bus)
+    app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    app.config['RESPONSE_CACHE_TTL_SECONDS'] = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '60'))
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
+
+    # In-process cache of courses, modules and today's lectures (per worker process)
+    app.config['REFDATA_REFRESH_SECONDS'] = float(os.getenv('REFDATA_REFRESH_SECONDS', '5'))
+    app.config['REFDATA_MAX_AGE_SECONDS'] = float(os.getenv('REFDATA_MAX_AGE_SECONDS', '300'))
+    app.config['REFDATA_MAX_LECTURES'] = int(os.getenv('REFDATA_MAX_LECTURES', '50000'))
+
+    # Verified-token cache and revocation filter (per worker process)
+    app.config['AUTH_TOKEN_CACHE_SIZE'] = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '10000'))
+    app.config['AUTH_REVOCATION_CAPACITY'] = int(os.getenv('AUTH_REVOCATION_CAPACITY', '100000'))
+    app.config['AUTH_REVOCATION_REFRESH_SECONDS'] = float(os.getenv('AUTH_REVOCATION_REFRESH_SECONDS', '5'))
+    app.config['AUTH_REVOCATION_REBUILD_SECONDS'] = float(os.getenv('AUTH_REVOCATION_REBUILD_SECONDS', '3600'))
+
+    # Password hashing process pool: concurrent hashes, waiting hashes beyond
+    # those (more get 503 + Retry-After) and how long a caller waits for one
+    app.config['HASH_POOL_WORKERS'] = int(os.getenv('HASH_POOL_WORKERS', '2'))
+    app.config['HASH_QUEUE_DEPTH'] = int(os.getenv('HASH_QUEUE_DEPTH', '32'))
+    app.config['HASH_TIMEOUT_SECONDS'] = float(os.getenv('HASH_TIMEOUT_SECONDS', '10'))
+    app.config['HASH_RETRY_AFTER_SECONDS'] = int(os.getenv('HASH_RETRY_AFTER_SECONDS', '2'))
+
+    # Database connection pool, per process (see app/pool.py). DB_PGBOUNCER=true
+    # when DATABASE_URL points at PgBouncer in transaction pooling mode
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', '5'))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+    app.config['DB_PGBOUNCER'] = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+    from .pool import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+    # Connection pool of the asyncio check-in path (asgi.py), per process
+    app.config['ASYNC_DB_POOL_SIZE'] = int(os.getenv('ASYNC_DB_POOL_SIZE', '10'))
+    app.config['ASYNC_DB_MAX_OVERFLOW'] = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '10'))
+
+    # Prometheus metrics at /metrics (see app/metrics.py). METRICS_DIR, shared by
+    # the workers on a host, makes /metrics report all of them; METRICS_TOKEN,
+    # if set, is required as a bearer token. Metrics are off unless a token is
+    # set or METRICS_ENABLED=true asks for them without one (private networks)
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+    app.config['METRICS_ENABLED'] = os.getenv(
+        'METRICS_ENABLED', 'true' if app.config['METRICS_TOKEN'] else 'false'
+    ).lower() == 'true'
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', '')
+    app.config['METRICS_SNAPSHOT_SECONDS'] = float(os.getenv('METRICS_SNAPSHOT_SECONDS', '5'))
+
+    # Query budgets and N+1 detection (see app/query_budget.py): off, log or raise
+    app.config['QUERY_BUDGET_MODE'] = os.getenv('QUERY_BUDGET_MODE', 'off')
+    app.config['QUERY_BUDGET_DEFAULT'] = int(os.getenv('QUERY_BUDGET_DEFAULT', '0'))
+    app.config['QUERY_REPEAT_LIMIT'] = int(os.getenv('QUERY_REPEAT_LIMIT', '1'))
 
     # Enable CORS for all routes
     CORS(app)
 
     db.init_app(app)
 
+    from .pool import install_statement_timeout
+    from .metrics import Metrics, install_query_hooks
+    app.extensions['metrics'] = Metrics()
+    with app.app_context():
+        install_statement_timeout(db.engine, app.config)
+        if app.config['METRICS_ENABLED'] or app.config['QUERY_BUDGET_MODE'] != 'off':
+            install_query_hooks(db.engine, app.extensions['metrics'])
+
+    from .cache import ResponseCache
+    app.extensions['response_cache'] = ResponseCache(
+        app.config['RESPONSE_CACHE_MAX_ENTRIES'], app.config['RESPONSE_CACHE_TTL_SECONDS']
+    )
+
+    from .refdata import ReferenceData
+    app.extensions['reference_data'] = ReferenceData(
+        app.config['REFDATA_MAX_LECTURES'], app.config['REFDATA_MAX_AGE_SECONDS']
+    )
+
+    from .auth import TokenVerifier
+    app.extensions['token_verifier'] = TokenVerifier(
+        app.config['ATTENDANCE_SECRET_SEED'],
+        app.config['AUTH_TOKEN_CACHE_SIZE'],
+        app.config['AUTH_REVOCATION_CAPACITY'],
+        app.config['AUTH_REVOCATION_REBUILD_SECONDS'],
+    )
+
+    from .hashing import PasswordHasher
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['HASH_POOL_WORKERS'],
+        app.config['HASH_QUEUE_DEPTH'],
+        app.config['HASH_TIMEOUT_SECONDS'],
+        app.config['HASH_RETRY_AFTER_SECONDS'],
+    )
+
+    from .pubsub import create_event_bus
+    app.extensions['event_bus'] = create_event_bus(app.config)
+
+    from .sse import StreamSlots
+    app.extensions['stream_slots'] = StreamSlots(app.config['WSGI_STREAM_LIMIT'])
+
     from .routes import main
     app.register_blueprint(main)
 
+    from .commands import register_commands
+    register_commands(app)
+
+    from .tasks import register_task, start_background_tasks
+    from .streaks import close_ended_lectures
+    from .refdata import refresh_reference_data
+    from .auth import refresh_revocations
+    register_task(app, 'lecture-closeout', close_ended_lectures, app.config['LECTURE_CLOSEOUT_SECONDS'])
+    register_task(app, 'reference-data', refresh_reference_data, app.config['REFDATA_REFRESH_SECONDS'])
+    register_task(app, 'token-revocations', refresh_revocations, app.config['AUTH_REVOCATION_REFRESH_SECONDS'])
+
+    if app.config['ATTENDANCE_WRITE_MODE'] == 'buffered':
+        from .attendance_log import flush_attendance_log
+        register_task(app, 'attendance-flush', flush_attendance_log, app.config['ATTENDANCE_FLUSH_SECONDS'])
+
+    if app.config['METRICS_ENABLED'] and app.config['METRICS_DIR']:
+        from .metrics import write_metrics_snapshot
+        register_task(app, 'metrics-snapshot', write_metrics_snapshot, app.config['METRICS_SNAPSHOT_SECONDS'])
+
+    if app.config['CODE_LOOKUP_MODE'] == 'table':
+        from .code_table import refresh_code_table
+        register_task(app, 'code-table', refresh_code_table, app.config['CODE_TABLE_REFRESH_SECONDS'])
+
+    app.before_request(lambda: start_background_tasks(app))
+
     return app
@@ -0,0 +1,287 @@
+"""
+Asyncio variant of the check-in path: POST /verify, GET /code and the
+Server-Sent Events streams GET /code/stream and GET /attendance/live.
+
+The check-in surge is nearly all waiting on Postgres. Under the WSGI app each
+in-flight request holds a worker thread; here it is a coroutine waiting on
+SQLAlchemy's asyncio engine (asyncpg), so one process can hold thousands of
+concurrent check-ins on a pool of ASYNC_DB_POOL_SIZE connections.
+
+Request handling is shared with the sync controllers: the same validation and
+code lookup (prepare_check_in), the same VERIFY_ATTENDANCE statement (or
+CHECK_IN_STATUS and the attendance log in buffered mode) and the same response
+building (finish_check_in, current_lectures_body). Only the database round
+trips are awaited. Reference data is read from memory on the event loop;
+when it lacks something a handler needs, it is reloaded in a worker thread
+first. The Flask app is still created and used for config, the in-process
+caches and the background tasks.
+
+Long-lived streaming connections cost a coroutine here rather than a worker
+thread. Serve it next to the WSGI app and route those paths to it:
+    uvicorn asgi:app --port 5001 --workers 4
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from .attendance_log import buffer_check_in, get_attendance_log
+from .auth import REVOCATION_QUERY, get_token_verifier
+from .code_stream import code_stream, code_stream_query
+from .controllers import current_lectures_body, current_lectures_query, finish_check_in, prepare_check_in
+from .live_counts import (
+    COALESCE_SECONDS, KEEPALIVE, KEEPALIVE_SECONDS, LECTURE_ENROLMENTS, LiveCounts, live_counts_deadline,
+)
+from .pool import engine_options, install_statement_timeout
+from .pubsub import AsyncSubscription, lecture_topic
+from .queries import CHECK_IN_STATUS, VERIFY_ATTENDANCE
+from .refdata import get_reference_data, serve_from_memory
+from .sse import SSE_HEADERS
+from .tasks import start_background_tasks, stop_background_tasks
+
+
+def async_database_url(url: str) -> URL:
+    """The asyncpg form of a postgresql:// DATABASE_URL."""
+    return make_url(url).set(drivername='postgresql+asyncpg')
+
+
+def create_asgi_app(flask_app) -> Starlette:
+    """Build the ASGI app serving /verify and /code for an app from create_app()."""
+    config = flask_app.config
+    engine = create_async_engine(
+        async_database_url(config['SQLALCHEMY_DATABASE_URI']),
+        **engine_options(config, config['ASYNC_DB_POOL_SIZE'], config['ASYNC_DB_MAX_OVERFLOW'], driver='asyncpg'),
+    )
+    install_statement_timeout(engine, config)
+    flask_app.extensions['async_engine'] = engine
+    # VERIFY_ATTENDANCE is one atomic statement; skip BEGIN/COMMIT round trips
+    autocommit_engine = engine.execution_options(isolation_level='AUTOCOMMIT')
+
+    def warm_up():
+        with flask_app.app_context():
+            get_token_verifier().refresh()
+            get_reference_data().snapshot()
+
+    @contextmanager
+    def loop_context():
+        """The Flask app context for code on the event loop."""
+        with flask_app.app_context():
+            # Never reload reference data here; see load_reference_data()
+            serve_from_memory()
+            yield
+
+    def reload_reference_data():
+        with flask_app.app_context():
+            get_reference_data().refresh(min_interval=1)
+
+    async def load_reference_data(module_ids=()):
+        """
+        Load the reference data in a worker thread if it is not loaded yet or
+        lacks one of these modules, so the lookups that follow on the event
+        loop are answered from memory.
+        """
+        if get_reference_data().needs_reload(module_ids):
+            await run_in_threadpool(reload_reference_data)
+
+    async def authenticate(request) -> dict | None:
+        """Async counterpart of routes.verify_token()."""
+        parts = request.headers.get('Authorization', '').split()
+        if len(parts) != 2 or parts[0].lower() != 'bearer':
+            return None
+
+        verifier = get_token_verifier()
+        found = verifier.lookup(parts[1])
+        if found is None:
+            return None
+        digest, entry = found
+        keys, generation = verifier.revocation_suspects(digest, entry)
+        if keys:
+            async with autocommit_engine.connect() as conn:
+                rows = (await conn.execute(REVOCATION_QUERY, {'keys': keys})).all()
+            if verifier.settle_revocation(entry, generation, rows):
+                return None
+        return entry[0]
+
+    async def get_code(request):
+        """Async GET /code: the lecturer's current lectures with their codes."""
+        with loop_context():
+            user = await authenticate(request)
+            if not user:
+                return JSONResponse({"error": "Unauthorized"}, 401)
+            try:
+                if not user.get('is_staff', False):
+                    return JSONResponse({"error": "Only lecturers can access this endpoint"}, 403)
+
+                now = datetime.now(timezone.utc)
+                current_lectures = get_reference_data().running_lectures(user.get('student_id'), now)
+                if current_lectures is None:
+                    async with autocommit_engine.connect() as conn:
+                        result = await conn.execute(current_lectures_query(user.get('student_id'), now))
+                        current_lectures = result.all()
+                await load_reference_data(lecture.module_id for lecture in current_lectures)
+                body, status = current_lectures_body(current_lectures)
+                return JSONResponse(body, status)
+            except Exception as e:
+                return JSONResponse({"error": str(e)}, 500)
+
+    async def stream_code(request):
+        """Async GET /code/stream: the lecturer's codes pushed at each rotation."""
+        with loop_context():
+            user = await authenticate(request)
+            if not user:
+                return JSONResponse({"error": "Unauthorized"}, 401)
+            try:
+                if not user.get('is_staff', False):
+                    return JSONResponse({"error": "Only lecturers can access this endpoint"}, 403)
+
+                started = time.time()
+                max_seconds = config['CODE_STREAM_MAX_SECONDS']
+                query = code_stream_query(user.get('student_id'), datetime.now(timezone.utc), max_seconds)
+                async with autocommit_engine.connect() as conn:
+                    lectures = (await conn.execute(query)).all()
+                await load_reference_data(lecture.module_id for lecture in lectures)
+            except Exception as e:
+                return JSONResponse({"error": str(e)}, 500)
+
+        if not lectures:
+            return JSONResponse({
+                'success': False,
+                'message': 'No current lectures found for this lecturer'
+            }, 404)
+
+        async def events():
+            stream = code_stream(lectures, started + max_seconds)
+            while True:
+                with loop_context():
+                    item = next(stream, None)
+                if item is None:
+                    return
+                event, wait = item
+                yield event
+                if wait is not None:
+                    await asyncio.sleep(wait)
+
+        return StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    async def stream_live_counts(request):
+        """Async GET /attendance/live: check-in counts of the lecturer's current lectures."""
+        bus = flask_app.extensions['event_bus']
+        subscription = AsyncSubscription()
+        topics = []
+        with loop_context():
+            user = await authenticate(request)
+            if not user:
+                return JSONResponse({"error": "Unauthorized"}, 401)
+            try:
+                if not user.get('is_staff', False):
+                    return JSONResponse({"error": "Only lecturers can access this endpoint"}, 403)
+
+                now = datetime.now(timezone.utc)
+                async with autocommit_engine.connect() as conn:
+                    lectures = get_reference_data().running_lectures(user.get('student_id'), now)
+                    if lectures is None:
+                        lectures = (await conn.execute(current_lectures_query(user.get('student_id'), now))).all()
+                    if not lectures:
+                        return JSONResponse({
+                            'success': False,
+                            'message': 'No current lectures found for this lecturer'
+                        }, 404)
+
+                    # Subscribe first so no check-in lands between the baseline and the feed
+                    topics = [lecture_topic(lecture.id) for lecture in lectures]
+                    bus.subscribe(subscription, *topics)
+                    lecture_ids = [lecture.id for lecture in lectures]
+                    rows = (await conn.execute(LECTURE_ENROLMENTS, {'lecture_ids': lecture_ids})).all()
+                await load_reference_data(lecture.module_id for lecture in lectures)
+                counts = LiveCounts(lectures, rows)
+            except Exception as e:
+                bus.unsubscribe(subscription, *topics)
+                return JSONResponse({"error": str(e)}, 500)
+
+        deadline = live_counts_deadline(lectures, config['LIVE_COUNTS_MAX_SECONDS'], time.time())
+
+        async def events():
+            # Same loop as live_counts.live_counts_stream(), awaiting the subscription
+            try:
+                with loop_context():
+                    yield counts.event(retry_ms=1000)
+                while time.time() < deadline:
+                    item = await subscription.get(min(KEEPALIVE_SECONDS, max(0.0, deadline - time.time())))
+                    if item is None:
+                        yield KEEPALIVE
+                        continue
+                    changed = counts.apply(item[1])
+                    burst_end = time.time() + COALESCE_SECONDS
+                    while (remaining := burst_end - time.time()) > 0:
+                        item = await subscription.get(remaining)
+                        if item is None:
+                            break
+                        changed = counts.apply(item[1]) or changed
+                    if changed:
+                        with loop_context():
+                            yield counts.event()
+            finally:
+                bus.unsubscribe(subscription, *topics)
+
+        return StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    async def verify(request):
+        """Async POST /verify: check in with a code, body { "code": str }."""
+        with loop_context():
+            user = await authenticate(request)
+            if not user:
+                return JSONResponse({"error": "Unauthorized"}, 401)
+            try:
+                data = await request.json()
+                # Add student_id from auth context to request data
+                if data:
+                    data['student_id'] = user.get('student_id')
+
+                check_in, reply = prepare_check_in(data)
+                if reply is not None:
+                    return JSONResponse(*reply)
+
+                buffered = config['ATTENDANCE_WRITE_MODE'] == 'buffered'
+                async with autocommit_engine.connect() as conn:
+                    statement = CHECK_IN_STATUS if buffered else VERIFY_ATTENDANCE
+                    result = (await conn.execute(statement, check_in.params())).one()
+                if buffered:
+                    # The log append waits on an fsync; keep it off the event loop
+                    result = await run_in_threadpool(
+                        buffer_check_in, get_attendance_log(), check_in.student_id, result
+                    )
+                body, status = finish_check_in(check_in, result)
+                return JSONResponse(body, status)
+            except Exception as e:
+                return JSONResponse({"error": str(e)}, 400)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        start_background_tasks(flask_app)
+        await run_in_threadpool(warm_up)
+        yield
+        stop_background_tasks(flask_app, timeout=5)
+        await engine.dispose()
+
+    return Starlette(
+        routes=[
+            Route('/code', get_code, methods=['GET']),
+            Route('/code/stream', stream_code, methods=['GET']),
+            Route('/attendance/live', stream_live_counts, methods=['GET']),
+            Route('/verify', verify, methods=['POST']),
+        ],
+        middleware=[
+            # Same as CORS(app) on the WSGI side
+            Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        ],
+        lifespan=lifespan,
+    )
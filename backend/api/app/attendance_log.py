@@ -0,0 +1,246 @@
+"""
+Write-behind buffer for check-ins (ATTENDANCE_WRITE_MODE=buffered).
+
+At the start of a lecture hundreds of /verify calls land in the same second,
+each committing its own small transaction against the same lecture's rows.
+In buffered mode /verify only reads: CHECK_IN_STATUS resolves the code and
+the student's enrolment, and an accepted check-in is appended to a local
+SQLite log (WAL, fsync on commit) and acknowledged at once. A flusher applies
+the log to Postgres every ATTENDANCE_FLUSH_SECONDS in one multi-row statement
+(FLUSH_CHECK_INS) and one commit, then drops the applied entries. Applied
+entries are remembered for a few minutes, so a check-in whose status was read
+just before a flush committed is still answered as a duplicate.
+
+The log is shared by every worker on the node and one process at a time is
+the flusher, holding an exclusive lock on a sidecar lock file, as with the
+code table. Entries survive a crash or restart and are replayed by the next
+flusher; replaying an entry that was already applied is a no-op. Keep
+ATTENDANCE_LOG_PATH on persistent storage.
+
+Until a check-in is flushed the student's own reads (/attendance, streaks,
+leaderboards) do not show it yet. The lecture close-out job runs
+LECTURE_CLOSEOUT_DELAY_SECONDS behind in this mode so it never resets a
+streak for a check-in that is still in the log.
+"""
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from flask import current_app
+
+from .cache import invalidate_courses, invalidate_users
+from .queries import FLUSH_CHECK_INS
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# How long applied check-ins are remembered after they leave the log; far
+# longer than a /verify takes from its CHECK_IN_STATUS read to its append
+APPLIED_RETENTION_SECONDS = 300
+
+
+class CheckInResult(NamedTuple):
+    """The VERIFY_ATTENDANCE row shape, for finish_check_in()."""
+    active_lectures: int
+    lecture_id: int | None
+    module_name: str | None
+    course_code: str | None
+    already_attended: bool
+    current_streak: int | None
+    longest_streak: int | None
+    affected_courses: list[str]
+
+
+class AttendanceLog:
+    """Durable SQLite log of accepted check-ins not yet applied to Postgres."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock_file = None
+        self._init_lock = threading.Lock()
+        self.flushed = 0
+        self.batches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL: a check-in is only acknowledged once it is on disk
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending_check_ins ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' student_id TEXT NOT NULL,'
+                ' lecture_id INTEGER NOT NULL,'
+                ' checked_in_at REAL NOT NULL,'
+                ' UNIQUE (student_id, lecture_id)'
+                ')'
+            )
+            # Recently applied entries: a check-in whose status was read before
+            # the flush committed must still be seen as a duplicate
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS applied_check_ins ('
+                ' student_id TEXT NOT NULL,'
+                ' lecture_id INTEGER NOT NULL,'
+                ' applied_at REAL NOT NULL,'
+                ' PRIMARY KEY (student_id, lecture_id)'
+                ')'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def try_acquire_flush_lock(self) -> bool:
+        """Become this node's flusher if no other process currently is."""
+        with self._init_lock:
+            if self._lock_file is not None and self._lock_file[1] == os.getpid():
+                return True
+            lock_file = open(f'{self.path}.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = (lock_file, os.getpid())
+            return True
+
+    def append(self, student_id: str, lecture_id: int) -> int:
+        """
+        Record a check-in durably.
+
+        Returns:
+            The student's pending check-ins including this one, or 0 if this
+            lecture was already pending or recently applied for them
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            applied = conn.execute(
+                'SELECT 1 FROM applied_check_ins WHERE student_id = ? AND lecture_id = ?', (student_id, lecture_id)
+            ).fetchone()
+            if applied:
+                conn.execute('COMMIT')
+                return 0
+            inserted = conn.execute(
+                'INSERT OR IGNORE INTO pending_check_ins (student_id, lecture_id, checked_in_at) VALUES (?, ?, ?)',
+                (student_id, lecture_id, time.time()),
+            ).rowcount
+            pending = conn.execute(
+                'SELECT count(*) FROM pending_check_ins WHERE student_id = ?', (student_id,)
+            ).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return pending if inserted else 0
+
+    def pending(self, limit: int) -> list[tuple[int, str, int]]:
+        """The oldest (id, student_id, lecture_id) entries, up to limit."""
+        return self._connect().execute(
+            'SELECT id, student_id, lecture_id FROM pending_check_ins ORDER BY id LIMIT ?', (limit,)
+        ).fetchall()
+
+    def discard(self, last_id: int) -> None:
+        """
+        Drop entries up to and including last_id once they are applied,
+        remembering them for APPLIED_RETENTION_SECONDS.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO applied_check_ins (student_id, lecture_id, applied_at)'
+                ' SELECT student_id, lecture_id, ? FROM pending_check_ins WHERE id <= ?',
+                (now, last_id),
+            )
+            conn.execute('DELETE FROM pending_check_ins WHERE id <= ?', (last_id,))
+            conn.execute('DELETE FROM applied_check_ins WHERE applied_at < ?', (now - APPLIED_RETENTION_SECONDS,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._connect().execute('SELECT count(*) FROM pending_check_ins').fetchone()[0],
+            'flushed': self.flushed,
+            'batches': self.batches,
+        }
+
+
+def get_attendance_log() -> AttendanceLog:
+    """Return the app's check-in log."""
+    app = current_app._get_current_object()
+    log = app.extensions.get('attendance_log')
+    if log is None:
+        log = app.extensions['attendance_log'] = AttendanceLog(app.config['ATTENDANCE_LOG_PATH'])
+    return log
+
+
+def buffer_check_in(log: AttendanceLog, student_id: str, status) -> CheckInResult:
+    """
+    Append a check-in that CHECK_IN_STATUS accepted to the log.
+
+    Args:
+        log: The node's AttendanceLog
+        student_id: The student checking in
+        status: The CHECK_IN_STATUS row
+
+    Returns:
+        The row finish_check_in() expects. The streak is what it will be once
+        the student's pending check-ins are flushed.
+    """
+    result = CheckInResult(*status)
+    if result.lecture_id is None or result.already_attended:
+        return result
+
+    pending = log.append(student_id, result.lecture_id)
+    if not pending:
+        return result._replace(already_attended=True)
+    current_streak = (result.current_streak or 0) + pending
+    return result._replace(
+        current_streak=current_streak,
+        longest_streak=max(result.longest_streak or 0, current_streak),
+    )
+
+
+def flush_attendance_log() -> None:
+    """
+    Background task body: apply the logged check-ins in batches.
+
+    Only the node's flusher process does anything. Each batch of up to
+    ATTENDANCE_FLUSH_BATCH entries is one statement and one commit; entries
+    are dropped from the log only after the commit.
+    """
+    log = get_attendance_log()
+    if not log.try_acquire_flush_lock():
+        return None
+
+    batch_size = current_app.config['ATTENDANCE_FLUSH_BATCH']
+    while True:
+        entries = log.pending(batch_size)
+        if not entries:
+            break
+        result = db.session.execute(FLUSH_CHECK_INS, {
+            'student_ids': [student_id for _, student_id, _ in entries],
+            'lecture_ids': [lecture_id for _, _, lecture_id in entries],
+        }).one()
+        db.session.commit()
+        log.discard(entries[-1][0])
+        log.flushed += len(entries)
+        log.batches += 1
+
+        if result.marked:
+            invalidate_users(*result.affected_users)
+            invalidate_courses(*result.affected_courses)
+        logger.debug('Flushed %d check-ins (%d marked)', len(entries), result.marked)
+        if len(entries) < batch_size:
+            break
+    return None
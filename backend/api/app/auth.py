@@ -0,0 +1,283 @@
+"""
+JWT issuing and verification with server-side revocation.
+
+Verification fast path: tokens that passed a full jwt.decode() are kept in a
+bounded LRU keyed by the token's SHA-256 digest, until they expire. Repeat
+requests with the same token skip the base64/JSON/HMAC work.
+
+Revocation: logout revokes one token (by digest) and account deletion revokes
+every token a user was issued up to that moment. Revocations are rows in
+revoked_tokens. Each worker keeps a Bloom filter of the revoked keys, rebuilt
+from that table by a background task, so the common case (token not revoked)
+is answered from memory. Only a filter hit goes to the database to confirm.
+Revocations made by this worker apply immediately; those made by other
+workers within AUTH_REVOCATION_REFRESH_SECONDS.
+"""
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+import jwt
+from flask import current_app
+from sqlalchemy import text
+
+from . import db
+from .query_budget import exempt_from_budget
+
+# How long an issued token stays valid
+TOKEN_LIFETIME = timedelta(days=7)
+
+# Confirms filter hits; user-wide revocations only cover tokens issued before
+REVOCATION_QUERY = text("""
+SELECT key, max(revoked_at) AS revoked_at
+FROM revoked_tokens
+WHERE key = ANY(:keys)
+GROUP BY key
+""")
+
+# Revocations are re-read with this much overlap so rows from transactions
+# that committed late are not missed
+REVOCATION_LAG = timedelta(seconds=30)
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def token_key(digest: bytes) -> str:
+    """revoked_tokens.key for a single token."""
+    return 'token:' + digest.hex()
+
+
+def user_key(student_id: str) -> str:
+    """revoked_tokens.key for every token issued to a user before revoked_at."""
+    return 'user:' + student_id
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: no false negatives, roughly
+    `error_rate` false positives at `capacity` entries.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        # Standard sizing: m = -n ln p / (ln 2)^2 bits, k = m/n ln 2 hashes
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class TokenVerifier:
+    """Verifies bearer tokens, caching successes and consulting the revocation filter."""
+
+    def __init__(self, secret: str, cache_size: int = 10000, revocation_capacity: int = 100000,
+                 rebuild_interval: float = 3600):
+        """
+        Args:
+            secret: The HS256 signing secret
+            cache_size: Maximum number of verified tokens kept
+            revocation_capacity: Revocations the filter is sized for (it grows
+                                 on rebuild if the table holds more)
+            rebuild_interval: Seconds between full filter rebuilds
+        """
+        self.secret = secret
+        self.cache_size = cache_size
+        self.revocation_capacity = revocation_capacity
+        self.rebuild_interval = rebuild_interval
+        # digest -> [payload, exp, filter generation it was last confirmed against]
+        self._cache: OrderedDict[bytes, list] = OrderedDict()
+        self._lock = Lock()
+        self._filter = BloomFilter(revocation_capacity)
+        self._generation = 0
+        self._synced_until: datetime | None = None
+        self._rebuilt_at = float('-inf')
+        self.hits = self.misses = self.filter_checks = 0
+
+    def verify(self, token: str) -> dict | None:
+        """Return the token's payload, or None if it is invalid, expired or revoked."""
+        found = self.lookup(token)
+        if found is None:
+            return None
+        digest, entry = found
+        if not self.synced:
+            # A one-off load shared by every later request, not this one's cost
+            with exempt_from_budget():
+                self.refresh()
+
+        keys, generation = self.revocation_suspects(digest, entry)
+        if keys:
+            rows = db.session.execute(REVOCATION_QUERY, {'keys': keys}).all()
+            if self.settle_revocation(entry, generation, rows):
+                return None
+        return entry[0]
+
+    @property
+    def synced(self) -> bool:
+        """Whether the filter has been loaded from the table at least once."""
+        return self._synced_until is not None
+
+    def lookup(self, token: str) -> tuple[bytes, list] | None:
+        """
+        The token's cache entry, decoding and caching it on a miss.
+
+        Signature and expiry only; revocation is checked separately so the
+        async path can run that query on its own engine.
+
+        Returns:
+            (digest, entry) or None if the token is invalid or expired
+        """
+        digest = token_digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(digest)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return digest, entry
+            self._cache.pop(digest, None)
+            self.misses += 1
+
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        entry = [payload, payload.get('exp', 0), -1]
+        with self._lock:
+            self._cache[digest] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return digest, entry
+
+    def revocation_suspects(self, digest: bytes, entry: list) -> tuple[list[str], int]:
+        """
+        Revocation keys of this token that the filter reports, unless they were
+        already cleared against the current filter.
+
+        Returns:
+            (keys to confirm with REVOCATION_QUERY, filter generation to pass to
+            settle_revocation); no keys means not revoked
+        """
+        generation = self._generation
+        keys = [key for key in (token_key(digest), user_key(entry[0].get('student_id', '')))
+                if key in self._filter]
+        if keys and entry[2] == generation:
+            keys = []
+        return keys, generation
+
+    def settle_revocation(self, entry: list, generation: int, rows) -> bool:
+        """Decide from REVOCATION_QUERY rows whether the token is revoked."""
+        self.filter_checks += 1
+        issued_at = datetime.fromtimestamp(entry[0].get('iat', 0), timezone.utc)
+        for row in rows:
+            if row.key.startswith('token:') or issued_at <= row.revoked_at:
+                return True
+        # Not revoked: skip the query until the filter changes again
+        entry[2] = generation
+        return False
+
+    def revoke(self, key: str, expires_at: datetime) -> None:
+        """Record a revocation in the table and apply it to this worker at once."""
+        db.session.execute(
+            text('INSERT INTO revoked_tokens (key, expires_at) VALUES (:key, :expires_at)'),
+            {'key': key, 'expires_at': expires_at},
+        )
+        db.session.commit()
+        with self._lock:
+            self._filter.add(key)
+            self._generation += 1
+
+    def refresh(self) -> None:
+        """
+        Pull revocations from the table into the filter.
+
+        Normally only rows newer than the last refresh are read. Every
+        rebuild_interval seconds a full rebuild purges expired rows and starts
+        a new filter sized to what is left, as a Bloom filter cannot forget
+        entries.
+        """
+        started = datetime.now(timezone.utc)
+        if self._synced_until is None or time.monotonic() - self._rebuilt_at >= self.rebuild_interval:
+            self._rebuilt_at = time.monotonic()
+            db.session.execute(text('DELETE FROM revoked_tokens WHERE expires_at < now()'))
+            keys = db.session.execute(text('SELECT key FROM revoked_tokens')).scalars().all()
+            db.session.commit()
+            bloom = BloomFilter(max(self.revocation_capacity, 2 * len(keys)))
+            for key in keys:
+                bloom.add(key)
+            with self._lock:
+                self._filter = bloom
+                self._generation += 1
+        else:
+            keys = db.session.execute(
+                text('SELECT key FROM revoked_tokens WHERE revoked_at > :since'),
+                {'since': self._synced_until - REVOCATION_LAG},
+            ).scalars().all()
+            db.session.commit()
+            new_keys = [key for key in keys if key not in self._filter]
+            if new_keys:
+                with self._lock:
+                    for key in new_keys:
+                        self._filter.add(key)
+                    self._generation += 1
+        self._synced_until = started
+
+    def stats(self) -> dict:
+        return {
+            'cached_tokens': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'revocation_filter_entries': self._filter.count,
+            'revocation_checks': self.filter_checks,
+        }
+
+
+def get_token_verifier() -> TokenVerifier:
+    return current_app.extensions['token_verifier']
+
+
+def issue_token(user) -> str:
+    """Create a signed JWT for a Users row."""
+    now = datetime.now(timezone.utc)
+    payload = {
+        'student_id': user.student_id,
+        'username': user.username,
+        'is_staff': user.is_staff,
+        'iat': now,
+        'exp': now + TOKEN_LIFETIME,
+    }
+    return jwt.encode(payload, current_app.config['ATTENDANCE_SECRET_SEED'], algorithm='HS256')
+
+
+def revoke_token(token: str, payload: dict) -> None:
+    """Revoke a single token (logout)."""
+    expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+    get_token_verifier().revoke(token_key(token_digest(token)), expires_at)
+
+
+def revoke_user_tokens(student_id: str) -> None:
+    """Revoke every token issued to a user so far (account deletion)."""
+    get_token_verifier().revoke(user_key(student_id), datetime.now(timezone.utc) + TOKEN_LIFETIME)
+
+
+def refresh_revocations() -> None:
+    """Background task body: pull new revocations into the filter."""
+    get_token_verifier().refresh()
@@ -0,0 +1,192 @@
+"""
+Per-user / per-course response cache with strong ETags.
+
+Read endpoints (/attendance, /courses, /user/<id>, /leaderboard/<course>) only
+change when a check-in commits or a lecture ends, so their serialised bodies
+are cached and revalidated with If-None-Match.
+
+Entries are tagged with the users and courses they depend on. Each tag has a
+version number; invalidating a tag bumps its version, which makes every entry
+stored under an older version a miss. That makes invalidation O(1) no matter
+how many keys (query strings, callers) a tag covers.
+
+The cache lives in the worker process. Invalidations apply to it at once and
+are published on the event bus (app/pubsub.py, CACHE_TOPIC) so every other
+worker bumps the same tag versions. With more than one worker that needs
+PUBSUB_BACKEND=postgres; the memory bus only reaches this process. Delivery
+is at-most-once, so a worker whose listener reconnects drops its entries, and
+entries expire after RESPONSE_CACHE_TTL_SECONDS as a last safety net.
+"""
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import Response, current_app, make_response, request
+
+from .pubsub import BUS_CONNECTED, get_event_bus
+
+# Event bus topic of invalidated tags
+CACHE_TOPIC = 'cache:invalidate'
+
+
+class ResponseCache:
+    """Bounded LRU of serialised response bodies keyed by request, tagged for invalidation."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._versions: dict[tuple, int] = {}
+        self._lock = Lock()
+        self._listening_pid = None
+        self.origin = None
+        self.hits = self.misses = 0
+
+    def versions(self, tags) -> tuple:
+        """Snapshot the current version of each tag (take it before rendering)."""
+        return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def get(self, key, tags):
+        """Return (body, etag) if a fresh entry exists for key, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, etag, versions, stored_at = entry
+                if versions == self.versions(tags) and time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body, etag
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, body: bytes, versions: tuple) -> str:
+        """Store a body under the versions captured before it was rendered; returns its ETag."""
+        etag = make_etag(body)
+        with self._lock:
+            self._entries[key] = (body, etag, versions, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def invalidate(self, *tags) -> None:
+        """Make every entry tagged with any of these tags stale."""
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def listen(self, bus) -> None:
+        """Apply invalidations published by other processes (once per process)."""
+        # A subscription inherited through fork would carry the parent's origin
+        if self._listening_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listening_pid == os.getpid():
+                return
+            self.origin = uuid.uuid4().hex
+            self._listening_pid = os.getpid()
+        bus.subscribe(self, CACHE_TOPIC, BUS_CONNECTED)
+
+    def deliver(self, topic: str, message: dict) -> None:
+        """Event bus callback."""
+        if topic == BUS_CONNECTED:
+            # Invalidations may have been missed while disconnected
+            with self._lock:
+                self._entries.clear()
+        elif message['origin'] != self.origin:
+            self.invalidate(*(tuple(tag) for tag in message['tags']))
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def get_response_cache() -> ResponseCache:
+    cache = current_app.extensions['response_cache']
+    cache.listen(get_event_bus())
+    return cache
+
+
+def user_tag(student_id: str) -> tuple:
+    return ('user', student_id)
+
+
+def course_tag(course_code: str) -> tuple:
+    return ('course', course_code)
+
+
+def _invalidate(tags: list[tuple]) -> None:
+    """Invalidate tags in this process and publish them to every other one."""
+    if not tags:
+        return
+    cache = get_response_cache()
+    cache.invalidate(*tags)
+    if current_app.config['RESPONSE_CACHE_ENABLED']:
+        get_event_bus().publish(CACHE_TOPIC, {'origin': cache.origin, 'tags': tags})
+
+
+def invalidate_users(*student_ids) -> None:
+    """Drop cached responses that depend on these users' attendance or streaks."""
+    _invalidate([user_tag(sid) for sid in student_ids])
+
+
+def invalidate_courses(*course_codes) -> None:
+    """Drop cached responses that depend on these courses' leaderboards."""
+    _invalidate([course_tag(code) for code in course_codes])
+
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cached_response(tags):
+    """
+    Cache a GET view's 200 responses and answer If-None-Match with 304.
+
+    Must sit below @token_required. The cache key is the path, the query
+    string and the caller, so per-caller bodies never leak between users.
+
+    Args:
+        tags: Callable taking the view's kwargs and returning the tags the
+              response depends on, e.g. lambda **kw: [user_tag(get_student_id())]
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not current_app.config['RESPONSE_CACHE_ENABLED']:
+                return f(*args, **kwargs)
+
+            cache = get_response_cache()
+            entry_tags = tags(**kwargs)
+            caller = request.user.get('student_id') if hasattr(request, 'user') else None
+            key = (request.path, request.query_string, caller)
+
+            cached = cache.get(key, entry_tags)
+            if cached is not None:
+                body, etag = cached
+                if request.if_none_match.contains(etag):
+                    return _not_modified(etag)
+                response = Response(body, mimetype='application/json')
+            else:
+                versions = cache.versions(entry_tags)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                etag = cache.put(key, response.get_data(), versions)
+                if request.if_none_match.contains(etag):
+                    return _not_modified(etag)
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated
+    return decorator
@@ -0,0 +1,84 @@
+"""
+Server push of a lecturer's rotating codes (GET /code/stream).
+
+Polling /code re-runs the current-lectures query and regenerates the codes on
+every call. A stream queries the lecturer's lectures once, for the next
+CODE_STREAM_MAX_SECONDS, and then pushes a `code` event exactly when the TOTP
+window rolls over (and when one of those lectures starts or ends), each with
+its `valid_until`. The payload is the /code body plus `valid_until`.
+
+The stream ends after the last of those lectures ends, or after
+CODE_STREAM_MAX_SECONDS; EventSource then reconnects, which picks up lectures
+added or moved in the meantime.
+
+code_stream() only yields events and how long to wait before the next, so the
+WSGI route and the asyncio app can each sleep in their own way.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from .controllers import current_lectures_body
+from .models import Lecture
+from .sse import sse_event
+from .utils import CODE_INTERVAL, current_window
+
+# Wake this long after a window boundary so current_window() has moved on
+BOUNDARY_SLACK = 0.005
+
+# EventSource reconnection delay sent to clients, in milliseconds
+RECONNECT_MS = 1000
+
+
+def code_stream_query(lecturer_id: str, now: datetime, seconds: float):
+    """SELECT of a lecturer's lectures running at any point in the next `seconds`."""
+    return (
+        select(Lecture.id, Lecture.module_id, Lecture.start_time, Lecture.end_time)
+        .where(
+            Lecture.lecturer_id == lecturer_id,
+            Lecture.start_time <= now + timedelta(seconds=seconds),
+            Lecture.end_time >= now
+        )
+    )
+
+
+def code_stream_event(lectures, now: float, retry_ms: int | None = None) -> tuple[str, float]:
+    """
+    The `code` event for the lectures running at `now`.
+
+    Returns:
+        (event, unix time the next event is due): the next window boundary,
+        or sooner if a lecture starts or ends before it
+    """
+    moment = datetime.fromtimestamp(now, timezone.utc)
+    running = [lecture for lecture in lectures if lecture.start_time <= moment <= lecture.end_time]
+    body, _ = current_lectures_body(running)
+
+    valid_until = (current_window(now) + 1) * CODE_INTERVAL
+    body['valid_until'] = datetime.fromtimestamp(valid_until, timezone.utc).isoformat()
+
+    changes = [
+        at.timestamp()
+        for lecture in lectures
+        for at in (lecture.start_time, lecture.end_time)
+        if at.timestamp() > now
+    ]
+    return sse_event(body, event='code', retry_ms=retry_ms), min([valid_until, *changes])
+
+
+def code_stream(lectures, deadline: float):
+    """
+    Yield (event, seconds to wait before the next) until the lectures are
+    over or the deadline passes. The first event carries the retry delay.
+    """
+    retry_ms = RECONNECT_MS
+    while True:
+        now = time.time()
+        event, due = code_stream_event(lectures, now, retry_ms)
+        retry_ms = None
+        finished = not any(lecture.end_time.timestamp() > now for lecture in lectures)
+        if finished or due >= deadline:
+            yield event, None
+            return
+        yield event, max(0.0, due - time.time()) + BOUNDARY_SLACK
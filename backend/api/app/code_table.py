@@ -0,0 +1,147 @@
+"""
+Precomputed per-window code table shared by every worker on a node.
+
+In 'table' lookup mode a background task computes the codes of every lecture
+active around the current TOTP window and writes them to a local SQLite file.
+Any worker process can then resolve a code with one indexed read, whether or
+not it (or any other worker) served that lecturer's /code call.
+
+Only one process per node refreshes the table at a time: the refresher holds
+an exclusive lock on a sidecar lock file. If that process dies the lock is
+released and the next worker to tick takes over.
+"""
+import fcntl
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from .models import Lecture
+from .utils import CODE_INTERVAL, batch_lecture_codes, current_window
+
+
+class CodeTable:
+    """SQLite-backed {window: {code: {lecture_id, ...}}} table."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock_file = None
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS lecture_codes ('
+                ' time_window INTEGER NOT NULL,'
+                ' code TEXT NOT NULL,'
+                ' lecture_id INTEGER NOT NULL,'
+                ' PRIMARY KEY (code, time_window, lecture_id)'
+                ') WITHOUT ROWID'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def try_acquire_refresh_lock(self) -> bool:
+        """Become this node's refresher if no other process currently is."""
+        with self._init_lock:
+            if self._lock_file is not None and self._lock_file[1] == os.getpid():
+                return True
+            lock_file = open(f'{self.path}.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = (lock_file, os.getpid())
+            return True
+
+    def store(self, rows: list[tuple[int, str, int]], oldest_window: int) -> None:
+        """
+        Insert (window, code, lecture_id) rows and drop windows before oldest_window.
+
+        Runs in one transaction so readers never see a half-written window.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO lecture_codes (time_window, code, lecture_id) VALUES (?, ?, ?)',
+                rows,
+            )
+            conn.execute('DELETE FROM lecture_codes WHERE time_window < ?', (oldest_window,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def find(self, code: str, window: int, tolerance: int = 1) -> frozenset[int]:
+        """
+        Find every lecture whose code matches within ±tolerance windows.
+
+        Mirrors verify_lecture_code(): tolerance=1 accepts the previous,
+        current and next window's code.
+        """
+        rows = self._connect().execute(
+            'SELECT lecture_id FROM lecture_codes WHERE code = ? AND time_window BETWEEN ? AND ?',
+            (code, window - tolerance, window + tolerance),
+        ).fetchall()
+        return frozenset(row[0] for row in rows)
+
+
+def get_code_table() -> CodeTable:
+    """Return the app's shared code table."""
+    app = current_app._get_current_object()
+    table = app.extensions.get('code_table')
+    if table is None:
+        table = app.extensions['code_table'] = CodeTable(app.config['CODE_TABLE_PATH'])
+    return table
+
+
+def refresh_code_table() -> float | None:
+    """
+    Compute codes for every lecture active in the current and adjacent windows.
+
+    Writes windows [w - tolerance, w + tolerance + 1] so the table already holds
+    the next window when the clock crosses a boundary between refreshes.
+
+    Returns:
+        Seconds until the next window boundary, so the task wakes up in time
+        to extend the table, or None if another process is the refresher.
+    """
+    table = get_code_table()
+    if not table.try_acquire_refresh_lock():
+        return None
+
+    seed = current_app.config['ATTENDANCE_SECRET_SEED']
+    tolerance = current_app.config['CODE_TOLERANCE']
+    now = datetime.now(timezone.utc).timestamp()
+    window = current_window(now)
+    first, last = window - tolerance, window + tolerance + 1
+
+    range_start = datetime.fromtimestamp(first * CODE_INTERVAL, timezone.utc)
+    range_end = datetime.fromtimestamp((last + 1) * CODE_INTERVAL, timezone.utc)
+    lecture_ids = [
+        row.id for row in
+        Lecture.query
+        .with_entities(Lecture.id)
+        .filter(Lecture.start_time < range_end, Lecture.end_time >= range_start)
+        .all()
+    ]
+
+    windows = range(first, last + 1)
+    rows = [
+        (w, code, lecture_id)
+        for lecture_id, codes in batch_lecture_codes(lecture_ids, seed, windows).items()
+        for w, code in zip(windows, codes)
+    ]
+    table.store(rows, oldest_window=first)
+
+    return (window + 1) * CODE_INTERVAL - now
@@ -0,0 +1,91 @@
+"""
+Flask CLI commands for operating the API.
+
+Run from backend/api, e.g. `flask --app wsgi rebuild-leaderboard`.
+"""
+from pathlib import Path
+
+import click
+
+# The canonical schema, also mounted into the Postgres container
+INIT_SQL = Path(__file__).resolve().parents[2] / 'db' / 'init.sql'
+
+
+@click.command('init-db')
+@click.option('--sql', 'sql_path', type=click.Path(dir_okay=False, path_type=Path), default=INIT_SQL,
+              show_default=True, help='Schema script to run')
+def init_db_command(sql_path):
+    """Create the database schema (idempotent)."""
+    from . import db
+
+    if not sql_path.exists():
+        # The SQL script also creates triggers and functions; the models alone do not
+        raise click.ClickException(f'{sql_path} not found')
+
+    conn = db.engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql_path.read_text())
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f'Schema applied from {sql_path}.')
+
+
+@click.command('rebuild-leaderboard')
+def rebuild_leaderboard_command():
+    """Rebuild the precomputed course leaderboard tables."""
+    from .leaderboard import rebuild_course_leaderboard
+
+    counts = rebuild_course_leaderboard()
+    click.echo(
+        f"Leaderboard rebuilt: {counts['rows_written']} rows written, "
+        f"{counts['rows_removed']} stale rows removed, {counts['courses']} course totals."
+    )
+
+
+@click.command('flush-attendance')
+def flush_attendance_command():
+    """Apply check-ins left in the attendance log (buffered write mode)."""
+    from .attendance_log import flush_attendance_log, get_attendance_log
+
+    log = get_attendance_log()
+    if not log.try_acquire_flush_lock():
+        raise click.ClickException('Another process is flushing the attendance log')
+    flush_attendance_log()
+    click.echo(f"Flushed {log.flushed} check-ins, {log.stats()['pending']} pending.")
+
+
+@click.command('generate-data')
+@click.option('--students', type=int, default=20_000, show_default=True)
+@click.option('--courses', type=int, default=10, show_default=True)
+@click.option('--modules', type=int, default=4, show_default=True, help='Modules per course')
+@click.option('--weeks', type=int, default=12, show_default=True, help='Weeks of past lectures')
+@click.option('--lectures-per-day', type=int, default=4, show_default=True,
+              help='Lectures per course per weekday')
+@click.option('--attendance-rate', type=float, default=0.8, show_default=True,
+              help='Share of past lectures attended')
+@click.option('--seed', type=int, default=1, show_default=True, help='Random seed')
+@click.option('--password', default='password123', show_default=True, help='Password of every account')
+@click.option('--yes', is_flag=True, help='Do not ask before replacing the data')
+def generate_data_command(password, yes, **scale):
+    """Replace all data with a generated dataset (see app/datagen.py)."""
+    from . import db
+    from .datagen import Scale, generate
+
+    if not yes:
+        click.confirm(f'Replace every user, course and lecture in {db.engine.url.render_as_string()}?',
+                      abort=True)
+    conn = db.engine.raw_connection()
+    try:
+        generate(conn, Scale(**scale), password, log=click.echo)
+    finally:
+        conn.close()
+
+
+def register_commands(app) -> None:
+    """Attach the CLI commands to the app."""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_leaderboard_command)
+    app.cli.add_command(flush_attendance_command)
+    app.cli.add_command(generate_data_command)
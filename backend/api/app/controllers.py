@@ -1,219 +1,298 @@
 """
 Controllers for handling attendance verification business logic.
 """
+import base64
+import binascii
 from flask import jsonify, current_app
-from datetime import datetime, timezone
-from .models import Lecture, LectureAttendance, Users, Module, Course
-from .utils import generate_lecture_code, find_lecture_by_code
+from datetime import date, datetime, time, timedelta, timezone
+from typing import NamedTuple
+from sqlalchemy import select
+from .models import Lecture, LectureAttendance, Module, Course, CourseStats
+from .utils import issue_lecture_codes, find_lectures_by_code, current_window
+from .code_table import get_code_table
+from .refdata import get_reference_data
+from .cache import invalidate_courses, invalidate_users
+from .pubsub import get_event_bus, lecture_topic
+from .attendance_log import buffer_check_in, get_attendance_log
+from .queries import CHECK_IN_STATUS, VERIFY_ATTENDANCE, LEADERBOARD_PAGE
 from . import db
 
 
-def get_previous_attendance(user_id: str, current_lecture: Lecture) -> LectureAttendance | None:
+def find_code_candidates(code: str) -> frozenset[int]:
     """
-    Find the student's most recent enrolled lecture before the current one.
+    Resolve a code to its candidate lecture IDs using the configured lookup mode.
 
-    Uses the index on lectures(start_time DESC, id) for efficient lookup.
-    With LIMIT 1 and ORDER BY DESC, PostgreSQL stops at the first match.
+    In 'table' mode the precomputed code table answers for every lecture active
+    around now, so any worker can verify a code without the lecturer having
+    polled it there. Otherwise the in-process code index is used.
+    """
+    if current_app.config['CODE_LOOKUP_MODE'] == 'table':
+        return get_code_table().find(code, current_window(), current_app.config['CODE_TOLERANCE'])
+    return find_lectures_by_code(code)
 
-    Args:
-        user_id: The student's ID
-        current_lecture: The lecture being attended now
 
-    Returns:
-        The LectureAttendance record for the previous lecture, or None if this is the first.
+def current_lectures_query(lecturer_id: str, now: datetime):
+    """
+    SELECT of a lecturer's lectures running at `now` (shared by the sync and
+    async paths). The fallback when ReferenceData.running_lectures() cannot
+    answer; served by idx_lectures_lecturer_time.
     """
     return (
-        LectureAttendance.query
-        .join(Lecture)
-        .filter(LectureAttendance.user_id == user_id)
-        .filter(Lecture.start_time < current_lecture.start_time)
-        .order_by(Lecture.start_time.desc())
-        .first()
+        select(Lecture.id, Lecture.module_id, Lecture.start_time, Lecture.end_time)
+        .where(
+            Lecture.lecturer_id == lecturer_id,
+            Lecture.start_time <= now,
+            Lecture.end_time >= now
+        )
     )
 
 
-def update_streak(user: Users, previous_attendance: LectureAttendance | None) -> None:
-    """
-    Update the user's streak based on their previous lecture attendance.
-
-    Logic:
-    - If no previous lecture (first ever) or previous was attended → increment streak
-    - If previous was not attended → streak broken → reset to 1
-    - Always update longest_streak if current exceeds it
-
-    Args:
-        user: The Users model instance to update
-        previous_attendance: The previous LectureAttendance record, or None
+def current_lectures_body(current_lectures) -> tuple[dict, int]:
     """
-    if previous_attendance is None or previous_attendance.is_attended:
-        # First lecture ever, or previous was attended → continue streak
-        user.current_streak += 1
-    else:
-        # Previous lecture was missed → streak broken
-        user.current_streak = 1
-
-    # Update longest streak if we've exceeded it
-    if user.current_streak > user.longest_streak:
-        user.longest_streak = user.current_streak
+    Issue codes for a lecturer's current lectures and build the /code response.
 
-
-def get_lecturer_current_lectures(lecturer_id):
+    Module names come from the reference data cache rather than a lazy load
+    per lecture.
     """
-    Get all currently active lectures for a specific lecturer.
-    Returns lecture details with time-based verification codes.
-    """
-    # Get current UTC time
-    now = datetime.now(timezone.utc)
-
-    # Query all lectures assigned to this lecturer that are currently active
-    current_lectures = Lecture.query.filter(
-        Lecture.lecturer_id == lecturer_id,
-        Lecture.start_time <= now,
-        Lecture.end_time >= now
-    ).all()
-
     if not current_lectures:
-        return jsonify({
+        return {
             'success': False,
             'message': 'No current lectures found for this lecturer'
-        }), 404
+        }, 404
 
     # Get the secret seed from config
     seed = current_app.config['ATTENDANCE_SECRET_SEED']
 
+    # Generate the time-based codes for every lecture in one batch
+    codes = issue_lecture_codes([lecture.id for lecture in current_lectures], seed)
+
     # Build response with all current lectures
+    refdata = get_reference_data()
     lectures_data = []
     for lecture in current_lectures:
-        # Generate time-based code for this lecture
-        code = generate_lecture_code(lecture.id, seed)
+        module = refdata.module(lecture.module_id)
 
         lectures_data.append({
             'lecture_id': lecture.id,
             'module_id': lecture.module_id,
-            'module_name': lecture.module.name if lecture.module else None,
+            'module_name': module.name if module else None,
             'start_time': lecture.start_time.isoformat(),
             'end_time': lecture.end_time.isoformat(),
-            'code': code
+            'code': codes[lecture.id]
         })
 
-    return jsonify({
+    return {
         'success': True,
         'lectures': lectures_data
-    }), 200
+    }, 200
 
 
-def verify_student_attendance(data):
+def get_lecturer_current_lectures(lecturer_id):
     """
-    Verify a student's attendance code and mark them as attended.
-    Expected data: {student_id, code}
+    Get all currently active lectures for a specific lecturer.
+    Returns lecture details with time-based verification codes.
+    """
+    now = datetime.now(timezone.utc)
+    current_lectures = get_reference_data().running_lectures(lecturer_id, now)
+    if current_lectures is None:
+        current_lectures = db.session.execute(current_lectures_query(lecturer_id, now)).all()
+    body, status = current_lectures_body(current_lectures)
+    return jsonify(body), status
+
+
+class CheckIn(NamedTuple):
+    """A validated /verify request whose code resolved to candidate lectures."""
+    student_id: str
+    candidate_ids: frozenset[int]
+    now: datetime
+
+    def params(self) -> dict:
+        """Bind parameters for queries.VERIFY_ATTENDANCE."""
+        return {
+            'lecture_ids': list(self.candidate_ids),
+            'student_id': self.student_id,
+            'now': self.now,
+        }
+
+
+def prepare_check_in(data) -> tuple[CheckIn | None, tuple[dict, int] | None]:
+    """
+    Validate a /verify body and resolve its code to candidate lectures.
 
-    The system uses an in-memory cache to quickly find which lecture
-    matches the provided code.
+    Everything up to the database statement, shared by the sync and async
+    paths.
+
+    Returns:
+        (CheckIn, None) to go ahead, or (None, (body, status)) to reply at once
     """
     if not data:
-        return jsonify({
+        return None, ({
             'success': False,
             'message': 'No data provided'
-        }), 400
+        }, 400)
 
     student_id = data.get('student_id')
     code = data.get('code')
 
     # Validate required fields
     if not all([student_id, code]):
-        return jsonify({
+        return None, ({
             'success': False,
             'message': 'Missing required fields: student_id and code are required'
-        }), 400
+        }, 400)
 
     # Validate code format (must be 4 digits)
-    if not code.isdigit() or len(code) != 4:
-        return jsonify({
+    if not isinstance(code, str) or not code.isdigit() or len(code) != 4:
+        return None, ({
             'success': False,
             'message': 'Invalid code format. Code must be 4 digits.'
-        }), 400
+        }, 400)
 
-    # Look up lecture_id from code cache
-    lecture_id = find_lecture_by_code(code)
+    # Look up candidate lectures for this code
+    candidate_ids = find_code_candidates(code)
 
-    if not lecture_id:
-        return jsonify({
+    if not candidate_ids:
+        return None, ({
             'success': False,
             'message': 'Invalid or expired code'
-        }), 400
+        }, 400)
 
-    # Get the lecture to verify it's still active
+    # Codes stay resolvable for a couple of minutes after a lecture ends. If the
+    # reference data cache knows every candidate, drop those not running and
+    # answer without touching the database if none is.
     now = datetime.now(timezone.utc)
-    lecture = Lecture.query.filter_by(id=lecture_id).first()
+    refdata = get_reference_data()
+    known = [refdata.lecture(lecture_id) for lecture_id in candidate_ids]
+    if all(known):
+        candidate_ids = frozenset(lecture.id for lecture in known if lecture.is_active(now))
+        if not candidate_ids:
+            return None, ({
+                'success': False,
+                'message': 'Lecture is not currently active'
+            }, 400)
 
-    if not lecture:
-        return jsonify({
-            'success': False,
-            'message': 'Lecture not found'
-        }), 404
+    return CheckIn(student_id, candidate_ids, now), None
 
-    # Verify lecture is currently active
-    if not (lecture.start_time <= now <= lecture.end_time):
-        return jsonify({
+
+def finish_check_in(check_in: CheckIn, result) -> tuple[dict, int]:
+    """
+    Turn the VERIFY_ATTENDANCE row into the /verify response. On success,
+    invalidates cached responses and publishes the check-in to the event bus.
+    """
+    # Verify at least one candidate lecture is currently active
+    if not result.active_lectures:
+        return {
             'success': False,
             'message': 'Lecture is not currently active'
-        }), 400
+        }, 400
 
-    # Find the attendance record for this student and lecture
-    attendance = LectureAttendance.query.filter_by(
-        user_id=student_id,
-        lecture_id=lecture_id
-    ).first()
-
-    if not attendance:
-        return jsonify({
+    if result.lecture_id is None:
+        return {
             'success': False,
             'message': 'Student is not enrolled in this lecture'
-        }), 404
+        }, 404
 
     # Check if already attended
-    if attendance.is_attended:
-        return jsonify({
+    if result.already_attended:
+        return {
             'success': True,
             'message': 'Attendance already marked',
-            'lecture_id': lecture.id,
-            'module_name': lecture.module.name if lecture.module else None,
+            'lecture_id': result.lecture_id,
+            'module_name': result.module_name,
             'already_attended': True
-        }), 200
+        }, 200
+
+    # This check-in changed the student's attendance, streak and the
+    # leaderboard rows of every course they are on
+    invalidate_users(check_in.student_id)
+    invalidate_courses(*result.affected_courses)
+    get_event_bus().publish(lecture_topic(result.lecture_id), {
+        'lecture_id': result.lecture_id,
+        'student_id': check_in.student_id,
+    })
+
+    return {
+        'success': True,
+        'message': 'Attendance marked successfully',
+        'lecture_id': result.lecture_id,
+        'module_name': result.module_name,
+        'already_attended': False,
+        'current_streak': result.current_streak or 0,
+        'longest_streak': result.longest_streak or 0
+    }, 200
 
-    # Mark attendance as true
-    attendance.is_attended = True
 
-    # Update streak: check if previous lecture was attended
-    user = Users.query.filter_by(student_id=student_id).first()
-    if user:
-        previous_attendance = get_previous_attendance(student_id, lecture)
-        update_streak(user, previous_attendance)
+def verify_student_attendance(data):
+    """
+    Verify a student's attendance code and mark them as attended.
+    Expected data: {student_id, code}
 
-    db.session.commit()
+    The system uses the code index (or the shared code table in 'table'
+    mode) to find the candidate lectures for the provided code. Codes can
+    collide between concurrent lectures, so the candidates are settled by
+    enrolment in the same statement that marks attendance and updates the
+    streak (see queries.VERIFY_ATTENDANCE) — one database round trip.
+    """
+    check_in, reply = prepare_check_in(data)
+    if reply is not None:
+        body, status = reply
+        return jsonify(body), status
+
+    # Resolve the candidate, mark attendance and update the streak in a single
+    # statement. Run it in autocommit mode: one statement is already atomic, so
+    # this skips the separate BEGIN/COMMIT round trips. In buffered mode the
+    # statement only reads and the write goes to the attendance log.
+    buffered = current_app.config['ATTENDANCE_WRITE_MODE'] == 'buffered'
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        result = conn.execute(CHECK_IN_STATUS if buffered else VERIFY_ATTENDANCE, check_in.params()).one()
+    if buffered:
+        result = buffer_check_in(get_attendance_log(), check_in.student_id, result)
+
+    body, status = finish_check_in(check_in, result)
+    return jsonify(body), status
 
-    return jsonify({
-        'success': True,
-        'message': 'Attendance marked successfully',
-        'lecture_id': lecture.id,
-        'module_name': lecture.module.name if lecture.module else None,
-        'already_attended': False,
-        'current_streak': user.current_streak if user else 0,
-        'longest_streak': user.longest_streak if user else 0
-    }), 200
 
+def encode_sync_cursor(moment: datetime) -> str:
+    """Encode an attendance sync position (epoch milliseconds, URL-safe)."""
+    return str(int(moment.timestamp() * 1000))
 
-def get_student_attendance(student_id: str):
+
+def decode_sync_cursor(cursor: str) -> datetime:
+    """
+    Decode a cursor from encode_sync_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    return datetime.fromtimestamp(int(cursor) / 1000, timezone.utc)
+
+
+def get_student_attendance(student_id: str, date_from: date | None = None, date_to: date | None = None,
+                           since: datetime | None = None):
     """
-    Get all lecture attendance for a student, grouped by date.
+    Get lecture attendance for a student, grouped by date.
     Returns data shaped for the streaks/calendar view.
 
+    Optional filters:
+      - date_from / date_to: only lectures starting on those days (inclusive)
+      - since: only rows changed after that sync cursor, for incremental sync
+
+    Every response carries a `cursor`. A client keeps its own copy of the
+    calendar, passes the cursor back as `since` and merges the (usually tiny)
+    delta by lecture id. The cursor trails the server clock by
+    ATTENDANCE_SYNC_LAG_SECONDS so rows committed by slower concurrent
+    transactions are not skipped; a row may therefore be sent twice.
+    Lectures going from future to past are not row changes: a cached
+    `attended: null` whose endTime has passed means not attended.
+
     Single query with explicit column selection — no N+1 or lazy loading.
-    Query path: lecture_attendance PK(user_id, lecture_id) → lectures PK → modules PK → courses PK.
+    Query path: lecture_attendance PK(user_id, lecture_id) → lectures PK → modules PK → courses PK,
+    or lecture_attendance(user_id, updated_at) for delta sync.
     """
     now = datetime.now(timezone.utc)
+    cursor = now - timedelta(seconds=current_app.config['ATTENDANCE_SYNC_LAG_SECONDS'])
 
-    rows = (
+    query = (
         db.session.query(
             Lecture.id,
             Lecture.start_time,
@@ -226,9 +305,15 @@ def get_student_attendance(student_id: str):
         .join(Lecture, LectureAttendance.lecture_id == Lecture.id)
         .join(Module, Lecture.module_id == Module.id)
         .filter(LectureAttendance.user_id == student_id)
-        .order_by(Lecture.start_time)
-        .all()
     )
+    if date_from is not None:
+        query = query.filter(Lecture.start_time >= datetime.combine(date_from, time.min, timezone.utc))
+    if date_to is not None:
+        query = query.filter(Lecture.start_time < datetime.combine(date_to + timedelta(days=1), time.min, timezone.utc))
+    if since is not None:
+        query = query.filter(LectureAttendance.updated_at > since)
+
+    rows = query.order_by(Lecture.start_time).all()
 
     attendance: dict[str, dict] = {}
     for row in rows:
@@ -249,75 +334,92 @@ def get_student_attendance(student_id: str):
             'code': row.course_code,
         })
 
-    return jsonify({'attendance': attendance}), 200
+    return jsonify({'attendance': attendance, 'cursor': encode_sync_cursor(cursor)}), 200
+
 
+def encode_leaderboard_cursor(streak: int, student_id: str) -> str:
+    """Encode a leaderboard keyset position as an opaque cursor string."""
+    return base64.urlsafe_b64encode(f'{streak}:{student_id}'.encode()).decode()
 
-def get_course_leaderboard(course_code: str, current_user_id: str):
+
+def decode_leaderboard_cursor(cursor: str) -> tuple[int, str]:
     """
-    Get leaderboard for a course — enrolled students ranked by streak.
+    Decode a cursor from encode_leaderboard_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        streak, student_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':', 1)
+        return int(streak), student_id
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
 
-    Single aggregate query joining modules → lectures → attendance → users.
-    Filters by course_code, groups per student, orders by streak DESC.
 
-    Relies on:
-      - modules(course_code) index for course filtering
-      - lectures(module_id) index for module→lecture join
-      - lecture_attendance(lecture_id) index for attendance lookup
+def get_course_leaderboard(course_code: str, current_user_id: str, limit: int = 10, cursor: str | None = None):
     """
-    course = Course.query.filter_by(code=course_code).first()
-    if not course:
-        return jsonify({'error': 'Course not found'}), 404
+    Get leaderboard for a course — enrolled students ranked by streak.
 
-    now = datetime.now(timezone.utc)
+    Returns the top `limit` students (or the page after `cursor`) plus the
+    caller's own row and rank, so the payload stays the same size however
+    large the cohort is. Ranks come from a window function in SQL.
 
-    # Total past lectures for this course (only count ended lectures)
-    total_lectures = (
-        db.session.query(db.func.count(Lecture.id))
-        .join(Module, Lecture.module_id == Module.id)
-        .filter(Module.course_code == course_code)
-        .filter(Lecture.end_time <= now)
-        .scalar()
-    ) or 0
+    Reads the precomputed course_leaderboard table, which /verify and the
+    lecture close-out job keep up to date, so the cost does not grow with
+    the number of lectures in the semester.
 
-    # Aggregate attendance per student
-    student_stats = (
-        db.session.query(
-            Users.student_id,
-            Users.first_name,
-            Users.last_name,
-            Users.current_streak,
-            db.func.sum(
-                db.case(
-                    (LectureAttendance.is_attended == True, 1),
-                    else_=0
-                )
-            ).label('attended')
-        )
-        .select_from(LectureAttendance)
-        .join(Lecture, LectureAttendance.lecture_id == Lecture.id)
-        .join(Module, Lecture.module_id == Module.id)
-        .join(Users, LectureAttendance.user_id == Users.student_id)
-        .filter(Module.course_code == course_code)
-        .filter(Users.is_staff == False)
-        .group_by(Users.student_id, Users.first_name, Users.last_name, Users.current_streak)
-        .order_by(Users.current_streak.desc())
-        .all()
-    )
+    The course name comes from the reference data cache and the lecture total
+    rides along with the page, so this is a single query.
 
-    students = [{
-        'id': s.student_id,
-        'name': f'{s.first_name} {s.last_name}',
-        'attended': int(s.attended or 0),
-        'streak': s.current_streak,
-    } for s in student_stats]
+    Relies on:
+      - course_leaderboard(course_code, streak DESC, student_id) index, read in order
+      - users primary key for names
+    """
+    try:
+        after_streak, after_student_id = decode_leaderboard_cursor(cursor) if cursor else (None, None)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    course_name = get_reference_data().course_name(course_code)
+    if course_name is None:
+        return jsonify({'error': 'Course not found'}), 404
+
+    rows = db.session.execute(LEADERBOARD_PAGE, {
+        'course_code': course_code,
+        'current_user_id': current_user_id,
+        'after_streak': after_streak,
+        'after_student_id': after_student_id,
+        'limit': limit,
+    }).all()
+
+    def serialise(row):
+        return {
+            'id': row.student_id,
+            'name': f'{row.first_name} {row.last_name}',
+            'attended': row.attended,
+            'streak': row.streak,
+            'rank': row.rank,
+        }
+
+    page = [row for row in rows if not row.is_caller]
+    caller = next((row for row in rows if row.is_caller), None)
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    if rows:
+        total_lectures = rows[0].total_lectures
+    else:
+        total_lectures = db.session.query(CourseStats.total_lectures).filter_by(course_code=course_code).scalar()
 
     return jsonify({
         'courseCode': course_code,
-        'courseName': course.name,
-        'totalLectures': total_lectures,
+        'courseName': course_name,
+        'totalLectures': total_lectures or 0,
         'currentUserId': current_user_id,
-        'showTop': 10,
-        'students': students,
+        'currentUser': serialise(caller) if caller else None,
+        'showTop': limit,
+        'students': [serialise(row) for row in page],
+        'nextCursor': encode_leaderboard_cursor(page[-1].streak, page[-1].student_id) if has_more else None,
     }), 200
 
 
@@ -0,0 +1,325 @@
+"""
+Bulk generation of synthetic data: users, courses, modules, lectures and
+lecture_attendance at production scale (`flask --app wsgi generate-data`).
+
+Rows are streamed into Postgres with COPY rather than added through the ORM:
+lecture and module ids are assigned here instead of flushed one at a time,
+every account shares one precomputed password hash, and attendance patterns
+and their streaks are computed in memory and written with the rows. The
+foreign keys and secondary indexes of lecture_attendance are dropped for the
+load and restored after it (load_mode), which is much faster than checking
+and maintaining them row by row.
+
+fake.py (the demo dataset) and bench/seed.py (the load benchmark) build on
+the helpers here.
+"""
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, time as dtime, timedelta, timezone
+from pathlib import Path
+
+from werkzeug.security import generate_password_hash
+
+from .queries import REBUILD_LEADERBOARD
+
+INIT_SQL = Path(__file__).resolve().parents[2] / 'db' / 'init.sql'
+
+# Tables generate() replaces, children first
+TABLES = (
+    'revoked_tokens', 'course_leaderboard', 'course_stats', 'lecture_attendance',
+    'lectures', 'modules', 'courses', 'users',
+)
+
+USER_COLUMNS = ('student_id', 'username', 'password', 'first_name', 'last_name', '"isStaff"',
+                'current_streak', 'longest_streak')
+LECTURE_COLUMNS = ('id', 'module_id', 'lecturer_id', 'start_time', 'end_time', 'closed_at')
+
+# Bytes handed to COPY per read
+COPY_CHUNK = 1 << 20
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value) -> str:
+    """A value in COPY text format."""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class _CopyStream:
+    """File-like reader over an iterator of COPY text chunks, for cursor.copy_expert."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def read(self, size: int = -1) -> bytes:
+        parts, length = [self._pending], len(self._pending)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            data = chunk.encode()
+            parts.append(data)
+            length += len(data)
+        data = b''.join(parts)
+        if size < 0:
+            self._pending = b''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def copy_text(cur, table: str, columns, chunks) -> None:
+    """COPY pre-formatted text (lines of tab-separated copy_value()s) into a table."""
+    cur.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', _CopyStream(chunks), size=COPY_CHUNK)
+
+
+def copy_rows(cur, table: str, columns, rows) -> None:
+    """COPY an iterable of tuples into a table."""
+    copy_text(cur, table, columns, ('\t'.join(map(copy_value, row)) + '\n' for row in rows))
+
+
+@contextmanager
+def load_mode(cur, table: str):
+    """
+    Drop a table's foreign keys and secondary indexes while bulk loading it,
+    and put them back on exit: checking and indexing once at the end is far
+    cheaper than per row. Re-adding a foreign key still validates every row.
+    """
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+    """, (table,))
+    foreign_keys = cur.fetchall()
+    cur.execute("""
+        SELECT i.indexname, i.indexdef
+        FROM pg_indexes i
+        WHERE i.schemaname = current_schema() AND i.tablename = %s
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+    """, (table,))
+    indexes = cur.fetchall()
+    for name, _ in foreign_keys:
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX {name}')
+    yield
+    for _, definition in indexes:
+        cur.execute(definition)
+    for name, definition in foreign_keys:
+        cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+
+def reset_database(cur) -> None:
+    """Apply db/init.sql and empty every table generate() fills."""
+    cur.execute(INIT_SQL.read_text())
+    cur.execute(f'TRUNCATE {", ".join(TABLES)} RESTART IDENTITY CASCADE')
+
+
+def set_sequences(cur) -> None:
+    """Move the serial ids past the ids assigned here."""
+    for table in ('modules', 'lectures'):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)")
+
+
+def finish_database(cur) -> None:
+    """Fill the leaderboard tables from the loaded rows and refresh planner statistics."""
+    cur.execute(REBUILD_LEADERBOARD.text)
+    cur.execute('ANALYZE')
+
+
+def streaks(pattern) -> tuple[int, int]:
+    """(current, longest) run of attended lectures in a pattern, in lecture order."""
+    current = longest = 0
+    for attended in pattern:
+        current = current + 1 if attended else 0
+        longest = max(longest, current)
+    return current, longest
+
+
+def random_pattern(rng: random.Random, n: int, rate: float, max_run: int | None = None) -> list[bool]:
+    """n lectures each attended with probability `rate`, with no run longer than max_run."""
+    result = []
+    run = 0
+    for _ in range(n):
+        attended = (max_run is None or run < max_run) and rng.random() < rate
+        result.append(attended)
+        run = run + 1 if attended else 0
+    return result
+
+
+def streak_pattern(rng: random.Random, n: int, current: int, longest: int, rate: float = 0.7) -> list[bool]:
+    """
+    n lectures whose trailing run is `current` and whose longest run is
+    `longest` (clamped to fit n), random at `rate` before those runs.
+    """
+    if n == 0:
+        return []
+    current = min(current, n)
+    longest = max(min(longest, n), current)
+
+    # Index of the miss that ends the run before the current streak
+    break_idx = n - current - 1
+    if break_idx < 0:
+        return [True] * n
+
+    if longest == current:
+        return random_pattern(rng, break_idx, rate, longest - 1) + [False] + [True] * current
+
+    # Put the longest run just before the break, shrinking it to fit
+    run_start = break_idx - longest
+    if run_start < 0:
+        run_start, longest = 0, break_idx
+    pre = random_pattern(rng, run_start - 1, rate, longest - 1) + [False] if run_start > 0 else []
+    return pre + [True] * longest + [False] + [True] * current
+
+
+@dataclass
+class Scale:
+    students: int = 20_000
+    courses: int = 10
+    modules: int = 4
+    weeks: int = 12
+    lectures_per_day: int = 4
+    attendance_rate: float = 0.8
+    # Add one lecture per course running at generation time, for check-ins
+    running_now: bool = True
+    seed: int = 1
+
+
+@dataclass
+class Generated:
+    """What generate() wrote, for callers that drive the data afterwards."""
+    students: dict[str, str] = field(default_factory=dict)      # student_id -> course code
+    lecturers: list[str] = field(default_factory=list)
+    running: dict[int, tuple[str, str]] = field(default_factory=dict)  # lecture_id -> (lecturer, course)
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+def student_id(i: int) -> str:
+    return f'gen_s{i:06d}'
+
+
+def lecturer_id(course: int, module: int) -> str:
+    return f'gen_l{course:03d}_{module}'
+
+
+def course_code(course: int) -> str:
+    return f'G{course:03d}'
+
+
+def course_timetable(scale: Scale, course: int, now: datetime) -> list[tuple[int, datetime, datetime, bool]]:
+    """
+    (module index, start, end, is the added running lecture) of a course's
+    lectures by start time: `lectures_per_day` hourly lectures from 09:00 UTC
+    on weekdays, from `weeks` weeks ago to tomorrow.
+    """
+    first_day = now.date() - timedelta(weeks=scale.weeks)
+    lectures = []
+    for offset in range((now.date() - first_day).days + 2):
+        day = first_day + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for slot in range(scale.lectures_per_day):
+            start = datetime.combine(day, dtime(9 + slot), timezone.utc)
+            lectures.append(((offset * scale.lectures_per_day + slot) % scale.modules,
+                             start, start + timedelta(hours=1), False))
+    if scale.running_now:
+        start = now.replace(second=0, microsecond=0) - timedelta(minutes=10)
+        lectures.append((course % scale.modules, start, start + timedelta(hours=1), True))
+    lectures.sort(key=lambda lecture: lecture[1])
+    return lectures
+
+
+def generate(conn, scale: Scale, password: str = 'password123', log=print) -> Generated:
+    """
+    Replace the data behind a psycopg2 connection with a synthetic dataset:
+    `courses` courses of `modules` modules, one lecturer per module, and
+    `students` students spread evenly over the courses and enrolled in every
+    lecture of their course. Past lectures are closed and attended at
+    `attendance_rate`; streaks and the leaderboard match.
+    """
+    if not 1 <= scale.lectures_per_day <= 14:
+        raise ValueError('lectures_per_day must be between 1 and 14')
+    now = datetime.now(timezone.utc)
+    password_hash = generate_password_hash(password)
+    rng = random.Random(scale.seed)
+    result = Generated()
+    started = time.perf_counter()
+
+    courses, modules, lectures, users = [], [], [], []
+    # Per course: the lecture ids, in order, and which have ended
+    timetables: list[tuple[list[int], list[bool]]] = []
+    for c in range(scale.courses):
+        courses.append((course_code(c), f'Course {c}'))
+        first_module = len(modules) + 1
+        for m in range(scale.modules):
+            modules.append((len(modules) + 1, f'Module {c}.{m}', course_code(c)))
+            users.append((lecturer_id(c, m), lecturer_id(c, m), password_hash, '', '', True, 0, 0))
+            result.lecturers.append(lecturer_id(c, m))
+
+        ids, ended = [], []
+        for module, start, end, running in course_timetable(scale, c, now):
+            lecture_id = len(lectures) + 1
+            lectures.append((lecture_id, first_module + module, lecturer_id(c, module), start, end,
+                             end if end < now else None))
+            ids.append(lecture_id)
+            ended.append(end < now)
+            if running:
+                result.running[lecture_id] = (lecturer_id(c, module), course_code(c))
+        timetables.append((ids, ended))
+
+    # Attendance patterns first: the users rows carry their streaks
+    patterns: list[bytes] = []
+    for i in range(scale.students):
+        c = i % scale.courses
+        _, ended = timetables[c]
+        past = random_pattern(rng, sum(ended), scale.attendance_rate)
+        current, longest = streaks(past)
+        patterns.append(bytes(past))
+        users.append((student_id(i), student_id(i), password_hash, '', '', False, current, longest))
+        result.students[student_id(i)] = course_code(c)
+
+    def attendance_chunks():
+        lines = [[f'\t{lecture_id}\t' for lecture_id in ids] for ids, _ in timetables]
+        for i, past in enumerate(patterns):
+            prefix, course_lines = student_id(i), lines[i % scale.courses]
+            flags = ['t' if attended else 'f' for attended in past]
+            flags += ['f'] * (len(course_lines) - len(flags))
+            yield ''.join(f'{prefix}{line}{flag}\n' for line, flag in zip(course_lines, flags))
+
+    with conn.cursor() as cur:
+        reset_database(cur)
+        copy_rows(cur, 'users', USER_COLUMNS, users)
+        copy_rows(cur, 'courses', ('code', 'name'), courses)
+        copy_rows(cur, 'modules', ('id', 'name', 'course_code'), modules)
+        copy_rows(cur, 'lectures', LECTURE_COLUMNS, lectures)
+        set_sequences(cur)
+        log(f'{len(users)} users and {len(lectures)} lectures written, loading attendance...')
+        with load_mode(cur, 'lecture_attendance'):
+            copy_text(cur, 'lecture_attendance', ('user_id', 'lecture_id', 'is_attended'), attendance_chunks())
+        log('rebuilding leaderboard...')
+        finish_database(cur)
+    conn.commit()
+
+    result.counts = {
+        'users': len(users),
+        'courses': len(courses),
+        'modules': len(modules),
+        'lectures': len(lectures),
+        'attendance': sum(len(timetables[i % scale.courses][0]) for i in range(scale.students)),
+    }
+    log(f"generated {result.counts['users']} users, {result.counts['lectures']} lectures and "
+        f"{result.counts['attendance']} attendance rows in {time.perf_counter() - started:.1f}s")
+    return result
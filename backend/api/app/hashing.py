@@ -0,0 +1,149 @@
+"""
+Password hashing off the request threads.
+
+werkzeug's password hashes are deliberately slow KDFs (scrypt by default).
+Run inline they hold a request worker, and much of the time the GIL, for the
+whole computation, so a burst of logins at the start of a lecture starves
+/verify. Hashing runs instead in a small process pool with admission control:
+at most HASH_POOL_WORKERS hashes run at once and HASH_QUEUE_DEPTH more may
+wait. Beyond that, callers get HashingBusy straight away and the route answers
+503 with Retry-After rather than queueing without bound.
+"""
+import atexit
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """The hashing pool is at capacity (or a hash timed out); retry later."""
+
+    def __init__(self, retry_after: int):
+        super().__init__('Password hashing is busy')
+        self.retry_after = retry_after
+
+
+def _timed(func, *args):
+    """Run in the pool: returns (result, time the worker picked the job up)."""
+    started = time.time()
+    return func(*args), started
+
+
+class _Timing:
+    """Count, total and maximum of a duration, in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 2),
+        }
+
+
+class PasswordHasher:
+    """Bounded process pool for password hashing and checking."""
+
+    def __init__(self, workers: int = 2, queue_depth: int = 32, timeout: float = 10, retry_after: int = 2):
+        """
+        Args:
+            workers: Hashing processes; 0 hashes inline on the calling thread
+            queue_depth: Hashes allowed to wait for a free process
+            timeout: Seconds a caller waits for its result before giving up
+            retry_after: Retry-After sent with 503 responses, in seconds
+        """
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = BoundedSemaphore(workers + queue_depth) if workers else None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.latency = _Timing()
+        self.queue_wait = _Timing()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # One pool per process: a pool inherited through fork has no workers
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    # spawn, not fork: forking a threaded server process is unsafe
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                    self._pool_pid = os.getpid()
+                    atexit.register(self._pool.shutdown, wait=False, cancel_futures=True)
+        return self._pool
+
+    def _run(self, func, *args):
+        submitted = time.time()
+        if not self.workers:
+            result = func(*args)
+            self.latency.observe(time.time() - submitted)
+            return result
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy(self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_pool().submit(_timed, func, *args)
+        except Exception:
+            self._release()
+            raise
+        # Free the slot when the hash finishes, even if the caller gave up
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            result, started = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self.timeouts += 1
+            raise HashingBusy(self.retry_after)
+        self.queue_wait.observe(max(0.0, started - submitted))
+        self.latency.observe(time.time() - submitted)
+        return result
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def check(self, pw_hash: str, password: str) -> bool:
+        """check_password_hash in the pool. Raises HashingBusy when saturated."""
+        return self._run(check_password_hash, pw_hash, password)
+
+    def generate(self, password: str) -> str:
+        """generate_password_hash in the pool. Raises HashingBusy when saturated."""
+        return self._run(generate_password_hash, password)
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'latency': self.latency.as_dict(),
+            'queue_wait': self.queue_wait.as_dict(),
+        }
+
+
+def get_password_hasher() -> PasswordHasher:
+    return current_app.extensions['password_hasher']
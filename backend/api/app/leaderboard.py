@@ -0,0 +1,25 @@
+"""
+Maintenance for the precomputed course leaderboard.
+
+course_leaderboard and course_stats are kept current incrementally by the
+verify statement and the lecture close-out job (see queries.py). This module
+rebuilds them from scratch, for new databases, imports and data fixes.
+"""
+from .queries import REBUILD_LEADERBOARD
+from . import db
+
+
+def rebuild_course_leaderboard() -> dict:
+    """
+    Recompute every course's leaderboard rows and lecture totals.
+
+    Returns:
+        Counts of rows written, stale rows removed and courses totalled.
+    """
+    result = db.session.execute(REBUILD_LEADERBOARD).one()
+    db.session.commit()
+    return {
+        'rows_written': result.rows_written,
+        'rows_removed': result.rows_removed,
+        'courses': result.courses,
+    }
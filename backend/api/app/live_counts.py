@@ -0,0 +1,111 @@
+"""
+Live check-in counts for the lecturer's screen (GET /attendance/live).
+
+A stream loads its lectures' enrolments once, then keeps each lecture's set of
+checked-in students up to date from check-in events on the event bus
+(app/pubsub.py) instead of re-running aggregate queries. Counting distinct
+students rather than events makes duplicates harmless: an event for a
+check-in already in the baseline, or delivered twice, changes nothing. The
+counts can be checked against RECOUNT_ATTENDANCE at any time.
+
+The stream subscribes before loading the baseline so no check-in falls in
+between. It pushes a `counts` event on connect and after each burst of
+check-ins (coalesced over COALESCE_SECONDS), with a keepalive comment when
+idle, until the last lecture ends or LIVE_COUNTS_MAX_SECONDS pass.
+
+In buffered write mode, check-ins still in the attendance log when a stream
+connects are missing from its baseline until they are flushed.
+"""
+import time
+
+from sqlalchemy import text
+
+from .refdata import get_reference_data
+from .sse import sse_event
+
+# Enrolments of a set of lectures, for the baseline
+LECTURE_ENROLMENTS = text("""
+SELECT lecture_id, user_id, is_attended
+FROM lecture_attendance
+WHERE lecture_id = ANY(:lecture_ids)
+""")
+
+# The aggregate the live counts stand in for
+RECOUNT_ATTENDANCE = text("""
+SELECT lecture_id, count(*) FILTER (WHERE is_attended) AS attended, count(*) AS enrolled
+FROM lecture_attendance
+WHERE lecture_id = ANY(:lecture_ids)
+GROUP BY lecture_id
+""")
+
+# Wait this long after a check-in for others before pushing
+COALESCE_SECONDS = 0.25
+
+# Send a comment line after this long without events
+KEEPALIVE_SECONDS = 15
+
+KEEPALIVE = ': keepalive\n\n'
+
+
+class LiveCounts:
+    """Enrolled and checked-in students per lecture."""
+
+    def __init__(self, lectures, enrolment_rows):
+        """
+        Args:
+            lectures: The running lectures (rows or LectureInfo: id, module_id, end_time)
+            enrolment_rows: LECTURE_ENROLMENTS rows for those lectures
+        """
+        self.lectures = lectures
+        self.enrolled = {lecture.id: 0 for lecture in lectures}
+        self.attended: dict[int, set[str]] = {lecture.id: set() for lecture in lectures}
+        for row in enrolment_rows:
+            self.enrolled[row.lecture_id] += 1
+            if row.is_attended:
+                self.attended[row.lecture_id].add(row.user_id)
+
+    def apply(self, message: dict) -> bool:
+        """Apply a check-in event; returns whether a count changed."""
+        students = self.attended.get(message.get('lecture_id'))
+        if students is None or message.get('student_id') in students:
+            return False
+        students.add(message['student_id'])
+        return True
+
+    def event(self, retry_ms: int | None = None) -> str:
+        """The `counts` SSE event."""
+        refdata = get_reference_data()
+        lectures = []
+        for lecture in self.lectures:
+            module = refdata.module(lecture.module_id)
+            lectures.append({
+                'lecture_id': lecture.id,
+                'module_name': module.name if module else None,
+                'attended': len(self.attended[lecture.id]),
+                'enrolled': self.enrolled[lecture.id],
+            })
+        return sse_event({'lectures': lectures}, event='counts', retry_ms=retry_ms)
+
+
+def live_counts_deadline(lectures, max_seconds: float, now: float) -> float:
+    """When a stream ends: as its last lecture ends, or after max_seconds."""
+    return min(now + max_seconds, max(lecture.end_time.timestamp() for lecture in lectures))
+
+
+def live_counts_stream(counts: LiveCounts, subscription, deadline: float):
+    """The WSGI stream: yields SSE text until the deadline (see aio.py for the async one)."""
+    yield counts.event(retry_ms=1000)
+    while time.time() < deadline:
+        item = subscription.get(timeout=min(KEEPALIVE_SECONDS, max(0.0, deadline - time.time())))
+        if item is None:
+            yield KEEPALIVE
+            continue
+        changed = counts.apply(item[1])
+        burst_end = time.time() + COALESCE_SECONDS
+        while (remaining := burst_end - time.time()) > 0:
+            item = subscription.get(timeout=remaining)
+            if item is None:
+                break
+            changed = counts.apply(item[1]) or changed
+        if changed:
+            yield counts.event()
@@ -0,0 +1,351 @@
+"""
+Prometheus metrics for the API (GET /metrics, text exposition format).
+
+Hooks on the main blueprint time each request and count it by status, and
+SQLAlchemy engine events count and time every SQL statement. Statements run
+while a request is being handled are also charged to it, which gives the
+queries and database time per request. The code index counters (app/utils.py)
+and the database pool state are read when a snapshot is taken.
+
+Recording costs a couple of dict updates under one lock per request and per
+statement, so it can stay on wherever /metrics is scraped. It is off unless
+METRICS_TOKEN is set, which turns it on and requires that token as a bearer
+token on /metrics; METRICS_ENABLED=true serves it without one (private
+networks only).
+
+Metrics are kept per worker process. With several gunicorn workers, set
+METRICS_DIR to a directory on the host that they share: each worker writes a
+snapshot there every METRICS_SNAPSHOT_SECONDS, and /metrics, whichever worker
+serves it, adds them all up. Snapshots of workers that have exited are folded
+into one archive file so the totals never go backwards; pool gauges are
+reported per live worker (pid label).
+
+Streaming responses (/code/stream, /attendance/live) are timed to the start of
+the stream; queries they run later only count towards the totals.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from flask import current_app, g, request
+from sqlalchemy import event
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'registreak_http_requests_total':
+        ('counter', 'Requests handled, by route, method and status.', None),
+    'registreak_http_request_duration_seconds':
+        ('histogram', 'Time to produce a response, by route and method.', LATENCY_BUCKETS),
+    'registreak_db_queries_per_request':
+        ('histogram', 'SQL statements run while handling a request, by route.', QUERY_COUNT_BUCKETS),
+    'registreak_db_seconds_per_request':
+        ('histogram', 'Time spent in SQL statements while handling a request, by route.', DB_TIME_BUCKETS),
+    'registreak_db_queries_total':
+        ('counter', 'SQL statements run, including background tasks and streams.', None),
+    'registreak_db_query_seconds_total':
+        ('counter', 'Time spent in SQL statements, including background tasks and streams.', None),
+    'registreak_code_index_hits_total':
+        ('counter', 'Code lookups that found a lecture in the code index.', None),
+    'registreak_code_index_misses_total':
+        ('counter', 'Code lookups that found nothing in the code index.', None),
+    'registreak_code_index_evictions_total':
+        ('counter', 'Issued codes dropped from the code index as they expired.', None),
+    'registreak_db_pool_checkouts_total':
+        ('counter', 'Connections checked out of the database pool.', None),
+    'registreak_db_pool_waits_total':
+        ('counter', 'Checkouts that had to wait for a free connection.', None),
+    'registreak_db_pool_wait_seconds_total':
+        ('counter', 'Time spent waiting for a free connection.', None),
+    'registreak_db_pool_timeouts_total':
+        ('counter', 'Checkouts that gave up waiting (pool timeout).', None),
+    'registreak_db_pool_size':
+        ('gauge', 'Configured size of the database pool.', None),
+    'registreak_db_pool_checked_out':
+        ('gauge', 'Connections currently in use.', None),
+    'registreak_db_pool_checked_in':
+        ('gauge', 'Idle connections in the pool.', None),
+    'registreak_db_pool_overflow':
+        ('gauge', 'Connections open beyond the pool size.', None),
+}
+
+# The QueryRecorder of the request being handled in this thread/greenlet, if any
+_recorder: ContextVar['QueryRecorder | None'] = ContextVar('query_recorder', default=None)
+
+
+_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+
+def _labels(**labels) -> str:
+    """A label set in exposition format, also the series key."""
+    return ','.join(f'{name}="{str(value).translate(_LABEL_ESCAPES)}"' for name, value in labels.items())
+
+
+class QueryRecorder:
+    """SQL statements run while handling one request."""
+
+    __slots__ = ('queries', 'seconds', 'statements', 'exempt')
+
+    def __init__(self, track_statements: bool = False):
+        """
+        Args:
+            track_statements: Also count each distinct statement, for the
+                              query budget checks (app/query_budget.py)
+        """
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements: dict[str, int] | None = {} if track_statements else None
+        # Depth of exempt_from_budget() blocks being run
+        self.exempt = 0
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.seconds += seconds
+        if self.statements is not None and not self.exempt:
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+
+
+def current_recorder() -> QueryRecorder | None:
+    """The QueryRecorder of the request being handled, or None outside one."""
+    return _recorder.get()
+
+
+class Metrics:
+    """Counters and histograms of one worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[str, float]] = {}
+        # series key -> bucket counts (the last is +Inf), then the sum
+        self.histograms: dict[str, dict[str, list[float]]] = {}
+
+    def _inc(self, name: str, labels: str, value: float = 1) -> None:
+        series = self.counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def _observe(self, name: str, labels: str, value: float) -> None:
+        buckets = METRICS[name][2]
+        series = self.histograms.setdefault(name, {})
+        counts = series.get(labels)
+        if counts is None:
+            counts = series[labels] = [0] * (len(buckets) + 2)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float,
+                        recorder: QueryRecorder) -> None:
+        route_labels = _labels(route=route, method=method)
+        with self._lock:
+            self._inc('registreak_http_requests_total', _labels(route=route, method=method, status=status))
+            self._observe('registreak_http_request_duration_seconds', route_labels, seconds)
+            self._observe('registreak_db_queries_per_request', route_labels, recorder.queries)
+            self._observe('registreak_db_seconds_per_request', route_labels, recorder.seconds)
+
+    def observe_query(self, seconds: float) -> None:
+        with self._lock:
+            self._inc('registreak_db_queries_total', '')
+            self._inc('registreak_db_query_seconds_total', '', seconds)
+
+    def snapshot(self, code_index: dict, pool: dict) -> dict:
+        """This process's metrics as plain data, with the code index and pool stats read now."""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self.histograms.items()}
+        for key in ('hits', 'misses', 'evictions'):
+            counters[f'registreak_code_index_{key}_total'] = {'': code_index[key]}
+        gauges = {}
+        if 'checkouts' in pool:
+            counters['registreak_db_pool_checkouts_total'] = {'': pool['checkouts']}
+            counters['registreak_db_pool_waits_total'] = {'': pool['waits']}
+            counters['registreak_db_pool_wait_seconds_total'] = {'': pool['wait_total_ms'] / 1000}
+            counters['registreak_db_pool_timeouts_total'] = {'': pool['timeouts']}
+            for key in ('size', 'checked_out', 'checked_in', 'overflow'):
+                gauges[f'registreak_db_pool_{key}'] = {'': pool[key]}
+        return {'pid': os.getpid(), 'time': time.time(), 'counters': counters,
+                'histograms': histograms, 'gauges': gauges}
+
+
+def merge(snapshots: list[dict], fresh_after: float) -> dict:
+    """
+    Add up counters and histograms of several snapshots; gauges are kept per
+    pid, from snapshots taken after `fresh_after` only.
+    """
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        for name, series in snapshot['counters'].items():
+            target = merged['counters'].setdefault(name, {})
+            for labels, value in series.items():
+                target[labels] = target.get(labels, 0) + value
+        for name, series in snapshot['histograms'].items():
+            target = merged['histograms'].setdefault(name, {})
+            for labels, counts in series.items():
+                if labels in target:
+                    target[labels] = [a + b for a, b in zip(target[labels], counts)]
+                else:
+                    target[labels] = list(counts)
+        if snapshot.get('time', 0) >= fresh_after:
+            pid = _labels(pid=snapshot['pid'])
+            for name, series in snapshot.get('gauges', {}).items():
+                target = merged['gauges'].setdefault(name, {})
+                for labels, value in series.items():
+                    target[f'{labels},{pid}' if labels else pid] = value
+    return merged
+
+
+def render(merged: dict) -> str:
+    """Merged snapshots in Prometheus text format."""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = merged[{'counter': 'counters', 'gauge': 'gauges', 'histogram': 'histograms'}[kind]].get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series.items()):
+            if kind != 'histogram':
+                lines.append(f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}')
+                continue
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative:g}')
+            lines.append(f'{name}_sum{{{labels}}} {value[-1]:g}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative:g}')
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotDir:
+    """Per-worker snapshot files in METRICS_DIR, and the archive of exited workers."""
+
+    ARCHIVE = 'archive.json'
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def write(self, snapshot: dict) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self.path / f'{snapshot["pid"]}.json'
+        temporary = target.with_suffix('.tmp')
+        temporary.write_text(json.dumps(snapshot, separators=(',', ':')))
+        os.replace(temporary, target)
+
+    def read_all(self) -> list[dict]:
+        """Every worker's latest snapshot plus the archive, folding in exited workers' first."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self.path / self.ARCHIVE
+            archive = json.loads(archive_path.read_text()) if archive_path.exists() else None
+            live, exited = [], []
+            for path in self.path.glob('[0-9]*.json'):
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                (live if _alive(snapshot['pid']) else exited).append((path, snapshot))
+            if exited:
+                folded = [snapshot for _, snapshot in exited]
+                if archive is not None:
+                    folded.append(archive)
+                archive = {**merge(folded, float('inf')), 'pid': 0, 'time': 0}
+                archive_path.write_text(json.dumps(archive, separators=(',', ':')))
+                for path, _ in exited:
+                    path.unlink(missing_ok=True)
+        return [s for _, s in live] + ([archive] if archive is not None else [])
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_metrics() -> Metrics:
+    return current_app.extensions['metrics']
+
+
+def take_snapshot() -> dict:
+    """This worker's snapshot (needs an app context)."""
+    from . import db
+    from .pool import pool_stats
+    from .utils import code_cache_stats
+
+    return get_metrics().snapshot(code_cache_stats(), pool_stats(db.engine))
+
+
+def write_metrics_snapshot() -> None:
+    """Background task: publish this worker's snapshot to METRICS_DIR."""
+    SnapshotDir(current_app.config['METRICS_DIR']).write(take_snapshot())
+
+
+def render_metrics() -> str:
+    """The /metrics body: this worker's metrics, or every worker's with METRICS_DIR."""
+    snapshot = take_snapshot()
+    directory = current_app.config['METRICS_DIR']
+    if not directory:
+        return render(merge([snapshot], 0))
+    store = SnapshotDir(directory)
+    store.write(snapshot)
+    fresh_after = time.time() - 3 * current_app.config['METRICS_SNAPSHOT_SECONDS']
+    return render(merge(store.read_all(), fresh_after))
+
+
+def install_query_hooks(engine, metrics: Metrics) -> None:
+    """Count and time every statement an engine runs, and charge it to the current request."""
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_metrics_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        metrics.observe_query(seconds)
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.record(statement, seconds)
+
+
+def start_request_metrics() -> None:
+    """before_request hook of the main blueprint."""
+    track_statements = current_app.config['QUERY_BUDGET_MODE'] != 'off'
+    if not (current_app.config['METRICS_ENABLED'] or track_statements):
+        return
+    g.query_recorder = QueryRecorder(track_statements)
+    _recorder.set(g.query_recorder)
+    g.metrics_started = time.perf_counter()
+
+
+def finish_request_metrics(response):
+    """after_request hook of the main blueprint."""
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    _recorder.set(None)
+    if current_app.config['METRICS_ENABLED']:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        get_metrics().observe_request(route, request.method, response.status_code, seconds, g.query_recorder)
+    return response
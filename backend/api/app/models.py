@@ -50,12 +50,18 @@ class Module(db.Model):
 
 class Lecture(db.Model):
     __tablename__ = 'lectures'
+    __table_args__ = (
+        db.Index('idx_lectures_open_end', 'end_time', postgresql_where=db.text('closed_at IS NULL')),
+        db.Index('idx_lectures_lecturer_time', 'lecturer_id', 'start_time', 'end_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     module_id = db.Column(db.Integer, db.ForeignKey('modules.id'), nullable=False)
     lecturer_id = db.Column(db.Text, db.ForeignKey('users.student_id'))
     start_time = db.Column(db.DateTime(timezone=True), nullable=False)
     end_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    # Set by the close-out job once missed-lecture streak resets were applied
+    closed_at = db.Column(db.DateTime(timezone=True))
 
     # Relationships
     module = db.relationship('Module', back_populates='lectures')
@@ -68,10 +74,15 @@ class Lecture(db.Model):
 
 class LectureAttendance(db.Model):
     __tablename__ = 'lecture_attendance'
+    __table_args__ = (
+        db.Index('idx_attendance_user_updated', 'user_id', 'updated_at'),
+    )
 
     user_id = db.Column(db.Text, db.ForeignKey('users.student_id'), primary_key=True)
     lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), primary_key=True)
     is_attended = db.Column(db.Boolean, default=False, nullable=False)
+    # Bumped whenever the row changes, for incremental /attendance sync
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
 
     # Relationships
     user = db.relationship('Users', back_populates='attendances')
@@ -80,3 +91,54 @@ class LectureAttendance(db.Model):
     def __repr__(self):
         return f'<LectureAttendance user={self.user_id} lecture={self.lecture_id}>'
 
+
+class CourseLeaderboard(db.Model):
+    """Precomputed leaderboard row per (course, student), kept up to date incrementally"""
+    __tablename__ = 'course_leaderboard'
+
+    course_code = db.Column(db.Text, db.ForeignKey('courses.code', ondelete='CASCADE'), primary_key=True)
+    student_id = db.Column(db.Text, db.ForeignKey('users.student_id', ondelete='CASCADE'), primary_key=True)
+    attended = db.Column(db.Integer, default=0, nullable=False)
+    streak = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_course_leaderboard_rank', course_code, streak.desc(), student_id),
+    )
+
+    def __repr__(self):
+        return f'<CourseLeaderboard course={self.course_code} student={self.student_id}>'
+
+
+class CourseStats(db.Model):
+    """Per-course counters maintained by the lecture close-out job"""
+    __tablename__ = 'course_stats'
+
+    course_code = db.Column(db.Text, db.ForeignKey('courses.code', ondelete='CASCADE'), primary_key=True)
+    total_lectures = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<CourseStats {self.course_code}>'
+
+
+class ReferenceVersion(db.Model):
+    """Change counter per reference table, bumped by triggers (see db/init.sql)"""
+    __tablename__ = 'reference_versions'
+
+    name = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<ReferenceVersion {self.name}={self.version}>'
+
+
+class RevokedToken(db.Model):
+    """Server-side JWT revocation: one token ('token:<digest>') or all of a user's ('user:<id>')"""
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    key = db.Column(db.Text, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f'<RevokedToken {self.key}>'
@@ -0,0 +1,144 @@
+"""
+Database engine and connection pool settings.
+
+Everything is driven by DB_* config (see create_app) so pools can be sized
+per worker without code changes:
+
+  DB_POOL_SIZE / DB_MAX_OVERFLOW   persistent connections / extra ones under load
+  DB_POOL_TIMEOUT                  seconds to wait for a free connection
+  DB_POOL_RECYCLE                  replace connections older than this (seconds)
+  DB_POOL_PRE_PING                 test connections on checkout
+  DB_STATEMENT_TIMEOUT_MS          server-side statement_timeout, 0 = off
+  DB_PGBOUNCER                     PgBouncer transaction pooling mode
+
+Behind PgBouncer in transaction mode a server connection is shared between
+clients from one transaction to the next, so nothing may be set per session:
+the statement timeout is applied with SET LOCAL at the start of each
+transaction instead of as a startup option, and asyncpg's server-side
+prepared statements are turned off. Statements run in autocommit mode (the
+check-in path) get no statement timeout there; use PgBouncer's query_timeout.
+
+Pools are TimedQueuePool, which records how long checkouts wait, for
+pool_stats() and the /admin/stats endpoint.
+"""
+import time
+from threading import Lock
+from uuid import uuid4
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class _TimedPoolMixin:
+    """Counts checkouts and the time spent waiting for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        # Only time checkouts that find the pool exhausted; the others are a
+        # queue pop (or opening an overflow connection) and never wait
+        exhausted = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                if exhausted:
+                    self.waits += 1
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(0, self.overflow()),
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_avg_ms': round(self.wait_total / self.waits * 1000, 2) if self.waits else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 2),
+            'wait_total_ms': round(self.wait_total * 1000, 2),
+            'timeouts': self.timeouts,
+        }
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(config, pool_size: int | None = None, max_overflow: int | None = None,
+                   driver: str = 'psycopg2') -> dict:
+    """
+    create_engine() keyword arguments from DB_* config.
+
+    Args:
+        config: The Flask app config
+        pool_size, max_overflow: Override DB_POOL_SIZE / DB_MAX_OVERFLOW
+        driver: 'psycopg2' (sync engine) or 'asyncpg' (app/aio.py)
+    """
+    options = {
+        'poolclass': TimedAsyncQueuePool if driver == 'asyncpg' else TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'] if pool_size is None else pool_size,
+        'max_overflow': config['DB_MAX_OVERFLOW'] if max_overflow is None else max_overflow,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+    connect_args = {}
+    if config['DB_PGBOUNCER']:
+        if driver == 'asyncpg':
+            connect_args.update({
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                # Unnamed-per-connection names collide across PgBouncer clients
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__',
+            })
+    elif timeout_ms:
+        if driver == 'asyncpg':
+            connect_args['server_settings'] = {'statement_timeout': str(timeout_ms)}
+        else:
+            connect_args['options'] = f'-c statement_timeout={timeout_ms}'
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def install_statement_timeout(engine, config) -> None:
+    """In PgBouncer mode, SET LOCAL the statement timeout in every transaction."""
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+    if not (config['DB_PGBOUNCER'] and timeout_ms):
+        return
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'begin')
+    def set_local_timeout(conn):
+        if conn.get_isolation_level() != 'AUTOCOMMIT':
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout_ms)}')
+
+
+def pool_stats(engine) -> dict:
+    """Checked-out connections, overflow and wait times of an engine's pool."""
+    pool = getattr(engine, 'sync_engine', engine).pool
+    if isinstance(pool, _TimedPoolMixin):
+        return pool.stats()
+    return {'status': pool.status()}
@@ -0,0 +1,224 @@
+"""
+Publish/subscribe of application events (check-ins) to streaming endpoints.
+
+PUBSUB_BACKEND=memory (default) delivers events to subscribers in the same
+process only. That is exact with one worker; with several, each sees only the
+check-ins its own process handled.
+
+PUBSUB_BACKEND=postgres fans events out to every worker through PostgreSQL
+LISTEN/NOTIFY. publish() never blocks the request: messages are queued and a
+sender thread sends them in batches, one NOTIFY per message in a single
+transaction. A listener thread per process holds a dedicated connection
+LISTENing on the channel and hands notifications to local subscribers, its
+own process's included. LISTEN needs a session, so PUBSUB_DATABASE_URL must
+point at PostgreSQL directly, not at PgBouncer in transaction mode.
+
+Delivery is at-most-once (a listener reconnecting misses what was sent in
+between), so consumers should be idempotent and able to reload from the
+database. Each time the listener (re)connects it delivers BUS_CONNECTED to
+this process's subscribers, so state kept from events can be dropped then.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from flask import current_app
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY channel shared by every worker
+CHANNEL = 'registreak_events'
+
+# Local topic: the listener has (re)connected and may have missed events
+BUS_CONNECTED = 'bus:connected'
+
+
+def lecture_topic(lecture_id: int) -> str:
+    """Topic of check-ins to one lecture."""
+    return f'lecture:{lecture_id}'
+
+
+class Subscription:
+    """Messages for a thread, e.g. a WSGI streaming response."""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def deliver(self, topic: str, message: dict) -> None:
+        self._queue.put((topic, message))
+
+    def get(self, timeout: float | None = None) -> tuple[str, dict] | None:
+        """The next (topic, message), or None after timeout seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """Messages for a coroutine; deliver() may be called from any thread."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def deliver(self, topic: str, message: dict) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (topic, message))
+
+    async def get(self, timeout: float | None = None) -> tuple[str, dict] | None:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """In-process bus: publish() delivers straight to this process's subscribers."""
+
+    def __init__(self):
+        self._subscribers: dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, subscription, *topics: str) -> None:
+        with self._lock:
+            for topic in topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+
+    def unsubscribe(self, subscription, *topics: str) -> None:
+        with self._lock:
+            for topic in topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def publish(self, topic: str, message: dict) -> None:
+        self.published += 1
+        self._deliver(topic, message)
+
+    def _deliver(self, topic: str, message: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(topic, message)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'topics': len(self._subscribers),
+                'subscriptions': sum(len(s) for s in self._subscribers.values()),
+                'published': self.published,
+            }
+
+
+class PostgresEventBus(EventBus):
+    """Bus shared by every worker through LISTEN/NOTIFY on CHANNEL."""
+
+    # Seconds between reconnection attempts of the listener and sender
+    RETRY_SECONDS = 1.0
+
+    def __init__(self, dsn: str, batch_size: int = 500):
+        super().__init__()
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self._outbox = queue.SimpleQueue()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self.received = 0
+        self.dropped = 0
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive a fork: start them once per process
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._outbox = queue.SimpleQueue()
+            for target, name in ((self._listen, 'pubsub-listener'), (self._send, 'pubsub-sender')):
+                threading.Thread(target=target, name=name, daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def subscribe(self, subscription, *topics: str) -> None:
+        self._ensure_started()
+        super().subscribe(subscription, *topics)
+
+    def publish(self, topic: str, message: dict) -> None:
+        self._ensure_started()
+        self.published += 1
+        self._outbox.put(json.dumps({'topic': topic, 'message': message}, separators=(',', ':')))
+
+    def _send(self) -> None:
+        conn = None
+        while True:
+            payloads = [self._outbox.get()]
+            while len(payloads) < self.batch_size:
+                try:
+                    payloads.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(self.dsn)
+                with conn.cursor() as cur:
+                    cur.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload',
+                                (CHANNEL, payloads))
+                conn.commit()
+            except psycopg2.Error:
+                logger.exception('Could not publish %d events', len(payloads))
+                self.dropped += len(payloads)
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(self.RETRY_SECONDS)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANNEL}')
+                self._deliver(BUS_CONNECTED, {})
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.received += 1
+                        event = json.loads(notify.payload)
+                        self._deliver(event['topic'], event['message'])
+            except Exception:
+                logger.exception('Event listener lost its connection, reconnecting')
+                time.sleep(self.RETRY_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            'backend': 'postgres',
+            'received': self.received,
+            'dropped': self.dropped,
+        }
+
+
+def create_event_bus(config) -> EventBus:
+    """The EventBus selected by PUBSUB_BACKEND."""
+    if config['PUBSUB_BACKEND'] == 'postgres':
+        url = make_url(config['PUBSUB_DATABASE_URL'] or config['SQLALCHEMY_DATABASE_URI'])
+        return PostgresEventBus(url.set(drivername='postgresql').render_as_string(hide_password=False))
+    return EventBus()
+
+
+def get_event_bus() -> EventBus:
+    return current_app.extensions['event_bus']
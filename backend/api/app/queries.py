@@ -0,0 +1,422 @@
+"""
+Hand-written SQL for the hot paths.
+
+These statements do in one round trip what the ORM would need several for.
+They are PostgreSQL-specific (data-modifying CTEs, = ANY(array)).
+"""
+from sqlalchemy import text
+
+
+# Verify a check-in code for a student in a single statement.
+#
+#   candidate  - the code's candidate lectures that are active right now
+#   enrolment  - the one the student is enrolled in (unmarked ones first)
+#   marked     - flips is_attended (and bumps updated_at for /attendance
+#                sync); the NOT is_attended guard makes a concurrent
+#                duplicate check-in a no-op instead of a double streak
+#                increment
+#   streak     - increments the streak. Missed lectures are applied by the
+#                close-out job when they end (CLOSE_ENDED_LECTURES), so a
+#                check-in never has to look back at the previous lecture.
+#   board      - bumps the student's attended count on this course's
+#                leaderboard row and copies the new streak to it (staff are
+#                not ranked)
+#   board_streak - copies the new streak to their other courses' rows
+#
+# Always returns exactly one row. lecture_id is NULL when the student is not
+# enrolled in any active candidate; already_attended is true when the row was
+# already marked; the streak columns are NULL unless this call marked it.
+# affected_courses lists every course whose leaderboard rows changed, for
+# cache invalidation.
+VERIFY_ATTENDANCE = text("""
+WITH candidate AS (
+    SELECT l.id, l.start_time, m.name AS module_name, m.course_code
+    FROM lectures l
+    JOIN modules m ON m.id = l.module_id
+    WHERE l.id = ANY(:lecture_ids)
+      AND l.start_time <= :now
+      AND l.end_time >= :now
+),
+enrolment AS (
+    SELECT c.id AS lecture_id, c.module_name, c.course_code, la.is_attended
+    FROM candidate c
+    JOIN lecture_attendance la ON la.lecture_id = c.id AND la.user_id = :student_id
+    ORDER BY la.is_attended, c.start_time
+    LIMIT 1
+),
+marked AS (
+    UPDATE lecture_attendance la
+    SET is_attended = TRUE,
+        updated_at = now()
+    FROM enrolment e
+    WHERE la.user_id = :student_id
+      AND la.lecture_id = e.lecture_id
+      AND NOT la.is_attended
+    RETURNING la.lecture_id
+),
+streak AS (
+    UPDATE users u
+    SET current_streak = u.current_streak + 1,
+        longest_streak = GREATEST(u.longest_streak, u.current_streak + 1)
+    FROM marked
+    WHERE u.student_id = :student_id
+    RETURNING u.current_streak, u.longest_streak, u."isStaff"
+),
+board AS (
+    INSERT INTO course_leaderboard AS cl (course_code, student_id, attended, streak)
+    SELECT e.course_code, :student_id, 1, s.current_streak
+    FROM enrolment e, streak s
+    WHERE e.course_code IS NOT NULL
+      AND NOT s."isStaff"
+    ON CONFLICT (course_code, student_id)
+    DO UPDATE SET attended = cl.attended + 1, streak = EXCLUDED.streak
+    RETURNING cl.course_code
+),
+board_streak AS (
+    UPDATE course_leaderboard cl
+    SET streak = s.current_streak
+    FROM enrolment e, streak s
+    WHERE cl.student_id = :student_id
+      AND cl.course_code IS DISTINCT FROM e.course_code
+    RETURNING cl.course_code
+)
+SELECT
+    (SELECT count(*) FROM candidate) AS active_lectures,
+    e.lecture_id,
+    e.module_name,
+    e.course_code,
+    (e.lecture_id IS NOT NULL AND m.lecture_id IS NULL) AS already_attended,
+    s.current_streak,
+    s.longest_streak,
+    ARRAY(SELECT course_code FROM board UNION SELECT course_code FROM board_streak) AS affected_courses
+FROM (SELECT 1) AS one
+LEFT JOIN enrolment e ON TRUE
+LEFT JOIN marked m ON TRUE
+LEFT JOIN streak s ON TRUE
+""")
+
+
+
+# Read-only counterpart of VERIFY_ATTENDANCE for the write-behind mode (see
+# app/attendance_log.py): same candidate and enrolment resolution and the same
+# result columns, but nothing is written. already_attended reflects only what
+# has been flushed; the streak columns are the student's current values, and
+# affected_courses is empty (the flush invalidates what it changes).
+CHECK_IN_STATUS = text("""
+WITH candidate AS (
+    SELECT l.id, l.start_time, m.name AS module_name, m.course_code
+    FROM lectures l
+    JOIN modules m ON m.id = l.module_id
+    WHERE l.id = ANY(:lecture_ids)
+      AND l.start_time <= :now
+      AND l.end_time >= :now
+),
+enrolment AS (
+    SELECT c.id AS lecture_id, c.module_name, c.course_code, la.is_attended
+    FROM candidate c
+    JOIN lecture_attendance la ON la.lecture_id = c.id AND la.user_id = :student_id
+    ORDER BY la.is_attended, c.start_time
+    LIMIT 1
+)
+SELECT
+    (SELECT count(*) FROM candidate) AS active_lectures,
+    e.lecture_id,
+    e.module_name,
+    e.course_code,
+    COALESCE(e.is_attended, FALSE) AS already_attended,
+    u.current_streak,
+    u.longest_streak,
+    CAST(ARRAY[] AS text[]) AS affected_courses
+FROM (SELECT 1) AS one
+LEFT JOIN enrolment e ON TRUE
+LEFT JOIN users u ON u.student_id = :student_id
+""")
+
+
+# Apply a batch of buffered check-ins: the multi-row form of VERIFY_ATTENDANCE's
+# writes, for (student_id, lecture_id) pairs already resolved at check-in.
+#
+#   batch      - the pairs, deduplicated
+#   marked     - flips is_attended; the NOT is_attended guard makes replaying
+#                a batch after a crash a no-op
+#   per_user   - lectures marked per student, to add to their streak at once
+#   streak     - increments each student's streak by that count
+#   per_course - lectures marked per student and course
+#   board      - bumps attended counts on those leaderboard rows and copies
+#                the new streak to them (staff are not ranked)
+#   board_streak - copies the new streak to the students' other courses' rows
+#
+# Returns the students and courses the batch changed, for cache invalidation.
+FLUSH_CHECK_INS = text("""
+WITH batch AS (
+    SELECT DISTINCT b.student_id, b.lecture_id
+    FROM unnest(CAST(:student_ids AS text[]), CAST(:lecture_ids AS integer[])) AS b(student_id, lecture_id)
+),
+marked AS (
+    UPDATE lecture_attendance la
+    SET is_attended = TRUE,
+        updated_at = now()
+    FROM batch b
+    WHERE la.user_id = b.student_id
+      AND la.lecture_id = b.lecture_id
+      AND NOT la.is_attended
+    RETURNING la.user_id, la.lecture_id
+),
+per_user AS (
+    SELECT user_id, count(*) AS lectures
+    FROM marked
+    GROUP BY user_id
+),
+streak AS (
+    UPDATE users u
+    SET current_streak = u.current_streak + p.lectures,
+        longest_streak = GREATEST(u.longest_streak, u.current_streak + p.lectures)
+    FROM per_user p
+    WHERE u.student_id = p.user_id
+    RETURNING u.student_id, u.current_streak, u."isStaff"
+),
+per_course AS (
+    SELECT mk.user_id, m.course_code, count(*) AS lectures
+    FROM marked mk
+    JOIN lectures l ON l.id = mk.lecture_id
+    JOIN modules m ON m.id = l.module_id
+    WHERE m.course_code IS NOT NULL
+    GROUP BY mk.user_id, m.course_code
+),
+board AS (
+    INSERT INTO course_leaderboard AS cl (course_code, student_id, attended, streak)
+    SELECT pc.course_code, pc.user_id, pc.lectures, s.current_streak
+    FROM per_course pc
+    JOIN streak s ON s.student_id = pc.user_id
+    WHERE NOT s."isStaff"
+    ON CONFLICT (course_code, student_id)
+    DO UPDATE SET attended = cl.attended + EXCLUDED.attended, streak = EXCLUDED.streak
+    RETURNING cl.course_code
+),
+board_streak AS (
+    UPDATE course_leaderboard cl
+    SET streak = s.current_streak
+    FROM streak s
+    WHERE cl.student_id = s.student_id
+      AND NOT EXISTS (
+          SELECT 1 FROM per_course pc
+          WHERE pc.user_id = cl.student_id AND pc.course_code = cl.course_code
+      )
+    RETURNING cl.course_code
+)
+SELECT
+    (SELECT count(*) FROM marked) AS marked,
+    ARRAY(SELECT user_id FROM per_user) AS affected_users,
+    ARRAY(SELECT course_code FROM board UNION SELECT course_code FROM board_streak) AS affected_courses
+""")
+
+# Close a batch of ended lectures and apply missed-lecture streak breaks.
+#
+#   closed  - claims up to :batch_size unclosed lectures that ended by
+#             :cutoff (now, or earlier in buffered write mode). SKIP LOCKED
+#             keeps a lecture from being closed twice; run it under
+#             CLOSEOUT_LOCK too, see there.
+#   missed  - per student, the latest lecture in the batch they did not attend
+#   reset   - sets each such student's streak to the number of lectures they
+#             attended after that miss (usually 0). Counting rather than
+#             zeroing keeps check-ins that landed before the job ran, e.g.
+#             back-to-back or overlapping lectures.
+#   totals  - adds the closed lectures to each course's total_lectures
+#   board   - copies the reset streaks to the students' leaderboard rows
+#   joined  - adds a leaderboard row for enrolled students who have none
+#             yet, i.e. who have not checked in to the course since they were
+#             enrolled or the last rebuild (staff are not ranked)
+#
+# Also returns every enrolled student the batch touched and every course whose
+# totals or leaderboard rows changed, so their cached responses can be
+# invalidated.
+CLOSE_ENDED_LECTURES = text("""
+WITH closed AS (
+    UPDATE lectures l
+    SET closed_at = :now
+    WHERE l.id IN (
+        SELECT id
+        FROM lectures
+        WHERE closed_at IS NULL
+          AND end_time <= :cutoff
+        ORDER BY end_time
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING l.id, l.module_id, l.start_time
+),
+missed AS (
+    SELECT la.user_id, max(c.start_time) AS missed_start
+    FROM closed c
+    JOIN lecture_attendance la ON la.lecture_id = c.id
+    WHERE NOT la.is_attended
+    GROUP BY la.user_id
+),
+reset AS (
+    UPDATE users u
+    SET current_streak = (
+        SELECT count(*)
+        FROM lecture_attendance a
+        JOIN lectures al ON al.id = a.lecture_id
+        WHERE a.user_id = u.student_id
+          AND a.is_attended
+          AND al.start_time > missed.missed_start
+    )
+    FROM missed
+    WHERE u.student_id = missed.user_id
+    RETURNING u.student_id, u.current_streak
+),
+totals AS (
+    INSERT INTO course_stats AS cs (course_code, total_lectures)
+    SELECT m.course_code, count(*)
+    FROM closed c
+    JOIN modules m ON m.id = c.module_id
+    WHERE m.course_code IS NOT NULL
+    GROUP BY m.course_code
+    ON CONFLICT (course_code)
+    DO UPDATE SET total_lectures = cs.total_lectures + EXCLUDED.total_lectures
+    RETURNING cs.course_code
+),
+board AS (
+    UPDATE course_leaderboard cl
+    SET streak = r.current_streak
+    FROM reset r
+    WHERE cl.student_id = r.student_id
+    RETURNING cl.course_code
+),
+joined AS (
+    INSERT INTO course_leaderboard (course_code, student_id, attended, streak)
+    SELECT m.course_code, u.student_id, count(*) FILTER (WHERE la.is_attended),
+           COALESCE(r.current_streak, u.current_streak)
+    FROM closed c
+    JOIN modules m ON m.id = c.module_id
+    JOIN lecture_attendance la ON la.lecture_id = c.id
+    JOIN users u ON u.student_id = la.user_id
+    LEFT JOIN reset r ON r.student_id = u.student_id
+    WHERE NOT u."isStaff"
+      AND m.course_code IS NOT NULL
+    GROUP BY m.course_code, u.student_id, u.current_streak, r.current_streak
+    ON CONFLICT (course_code, student_id) DO NOTHING
+    RETURNING course_code
+)
+SELECT
+    (SELECT count(*) FROM closed) AS lectures_closed,
+    (SELECT count(*) FROM reset) AS streaks_reset,
+    ARRAY(
+        SELECT DISTINCT la.user_id
+        FROM closed c
+        JOIN lecture_attendance la ON la.lecture_id = c.id
+    ) AS affected_users,
+    ARRAY(
+        SELECT course_code FROM totals
+        UNION SELECT course_code FROM board
+        UNION SELECT course_code FROM joined
+    ) AS affected_courses
+""")
+
+
+# Taken before CLOSE_ENDED_LECTURES in the same transaction, so one batch is
+# closed at a time across every worker. Batches closed side by side would
+# each reset a streak from their own latest miss, and whichever committed last
+# would win: a student who missed a lecture in both could keep the count from
+# the earlier miss. A separate statement, so the batch's snapshot is taken
+# after the previous holder committed. False if another worker holds it.
+CLOSEOUT_LOCK = text("""
+SELECT pg_try_advisory_xact_lock(:key)
+""")
+
+# Advisory lock key of CLOSEOUT_LOCK
+CLOSEOUT_LOCK_KEY = 0x6c6563747572  # 'lectur'
+
+
+# When the next unclosed lecture ends (uses idx_lectures_open_end)
+NEXT_LECTURE_END = text("""
+SELECT min(end_time) FROM lectures WHERE closed_at IS NULL
+""")
+
+
+# Rebuild the leaderboard tables from lecture_attendance and users. Used after
+# imports or data fixes; /verify and the close-out job keep them current after.
+REBUILD_LEADERBOARD = text("""
+WITH fresh AS (
+    SELECT m.course_code,
+           u.student_id,
+           count(*) FILTER (WHERE la.is_attended) AS attended,
+           u.current_streak AS streak
+    FROM lecture_attendance la
+    JOIN lectures l ON l.id = la.lecture_id
+    JOIN modules m ON m.id = l.module_id
+    JOIN users u ON u.student_id = la.user_id
+    WHERE NOT u."isStaff"
+      AND m.course_code IS NOT NULL
+    GROUP BY m.course_code, u.student_id, u.current_streak
+),
+stale AS (
+    DELETE FROM course_leaderboard cl
+    WHERE NOT EXISTS (
+        SELECT 1 FROM fresh f
+        WHERE f.course_code = cl.course_code AND f.student_id = cl.student_id
+    )
+    RETURNING 1
+),
+upserted AS (
+    INSERT INTO course_leaderboard AS cl (course_code, student_id, attended, streak)
+    SELECT course_code, student_id, attended, streak FROM fresh
+    ON CONFLICT (course_code, student_id)
+    DO UPDATE SET attended = EXCLUDED.attended, streak = EXCLUDED.streak
+    RETURNING 1
+),
+totals AS (
+    INSERT INTO course_stats AS cs (course_code, total_lectures)
+    SELECT c.code, count(l.id)
+    FROM courses c
+    LEFT JOIN modules m ON m.course_code = c.code
+    LEFT JOIN lectures l ON l.module_id = m.id AND l.closed_at IS NOT NULL
+    GROUP BY c.code
+    ON CONFLICT (course_code)
+    DO UPDATE SET total_lectures = EXCLUDED.total_lectures
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM upserted) AS rows_written,
+    (SELECT count(*) FROM stale) AS rows_removed,
+    (SELECT count(*) FROM totals) AS courses
+""")
+
+
+# One page of a course leaderboard plus the caller's own row, both ranked.
+#
+# rank() is computed over the whole course so ties share a rank. The page is
+# read with a keyset (streak DESC, student_id) rather than OFFSET, so later
+# pages cost the same as the first. One row more than :limit is fetched to
+# tell whether there is a next page. Every row also carries the course's
+# total_lectures so the caller needs no second query.
+LEADERBOARD_PAGE = text("""
+WITH ranked AS (
+    SELECT cl.student_id, cl.attended, cl.streak,
+           rank() OVER (ORDER BY cl.streak DESC) AS rank
+    FROM course_leaderboard cl
+    WHERE cl.course_code = :course_code
+),
+page AS (
+    SELECT *
+    FROM ranked
+    WHERE CAST(:after_streak AS INTEGER) IS NULL
+       OR streak < :after_streak
+       OR (streak = :after_streak AND student_id > :after_student_id)
+    ORDER BY streak DESC, student_id
+    LIMIT :limit + 1
+),
+caller AS (
+    SELECT * FROM ranked WHERE student_id = :current_user_id
+)
+SELECT x.is_caller, x.student_id, x.attended, x.streak, x.rank, u.first_name, u.last_name,
+       (SELECT cs.total_lectures FROM course_stats cs WHERE cs.course_code = :course_code) AS total_lectures
+FROM (
+    SELECT FALSE AS is_caller, * FROM page
+    UNION ALL
+    SELECT TRUE AS is_caller, * FROM caller
+) x
+JOIN users u ON u.student_id = x.student_id
+ORDER BY x.is_caller, x.streak DESC, x.student_id
+""")
@@ -0,0 +1,106 @@
+"""
+Query budgets and N+1 detection for the main blueprint's routes.
+
+A route declares how many SQL statements one request may run:
+
+    @main.route('/attendance')
+    @query_budget(2)
+    @token_required
+    def attendance(): ...
+
+and every request is checked, using the statements the QueryRecorder of
+app/metrics.py saw, for both its budget and for the same statement running
+more than QUERY_REPEAT_LIMIT times (default 1), the signature of an N+1 lazy
+load in a loop. A route that repeats a statement on purpose can allow it with
+@query_budget(n, repeats=k). Routes without a budget get QUERY_BUDGET_DEFAULT
+(0: no limit) and are still checked for repeats.
+
+QUERY_BUDGET_MODE selects what happens:
+  off    nothing is checked and no statements are kept (the default)
+  log    violations are logged as errors, with the offending statements
+  raise  violations raise QueryBudgetExceeded: a 500 in staging, and an error
+         in the test that made the request when the app is TESTING
+
+Statements run inside exempt_from_budget(), such as the shared reference data
+and token revocation reloads, are not charged to the request that happens to
+trigger them. Streaming responses are checked up to the start of the stream.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from flask import current_app, g, request
+
+from .metrics import current_recorder
+
+# Statements the connection setup repeats per transaction, never an N+1
+IGNORED_PREFIXES = ('SET ',)
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more SQL statements than its route allows."""
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    queries: int
+    repeats: int | None = None
+
+
+def query_budget(queries: int, repeats: int | None = None):
+    """
+    Declare a route's query budget.
+
+    Args:
+        queries: Most statements one request may run (0: no limit)
+        repeats: Times one statement may run per request (default QUERY_REPEAT_LIMIT)
+    """
+    def decorator(f):
+        f.query_budget = QueryBudget(queries, repeats)
+        return f
+    return decorator
+
+
+@contextmanager
+def exempt_from_budget():
+    """Do not charge statements run inside to the current request's budget."""
+    recorder = current_recorder()
+    if recorder is None:
+        yield
+        return
+    recorder.exempt += 1
+    try:
+        yield
+    finally:
+        recorder.exempt -= 1
+
+
+def budget_violations(statements: dict[str, int], budget: QueryBudget) -> list[str]:
+    """What a request's {statement: times run} breaks of a budget, as messages."""
+    violations = []
+    total = sum(statements.values())
+    if budget.queries and total > budget.queries:
+        violations.append(f'{total} SQL statements, budget {budget.queries}')
+    for statement, count in statements.items():
+        if count > budget.repeats and not statement.lstrip().upper().startswith(IGNORED_PREFIXES):
+            violations.append(f'statement ran {count} times (likely N+1): {" ".join(statement.split())[:300]}')
+    return violations
+
+
+def check_query_budget(response):
+    """after_request hook of the main blueprint."""
+    recorder = g.pop('query_recorder', None)
+    if recorder is None or recorder.statements is None:
+        return response
+    config = current_app.config
+    view = current_app.view_functions.get(request.endpoint)
+    declared = getattr(view, 'query_budget', None) or QueryBudget(config['QUERY_BUDGET_DEFAULT'])
+    budget = QueryBudget(declared.queries,
+                         config['QUERY_REPEAT_LIMIT'] if declared.repeats is None else declared.repeats)
+
+    violations = budget_violations(recorder.statements, budget)
+    if violations:
+        message = f'Query budget exceeded by {request.method} {request.path}: ' + '; '.join(violations)
+        if config['QUERY_BUDGET_MODE'] == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.error(message)
+    return response
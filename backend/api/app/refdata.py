@@ -0,0 +1,272 @@
+"""
+In-process cache of reference data: courses, modules and the lectures of
+today and tomorrow.
+
+Course and module names and lecture time slots almost never change, yet the
+hot controllers need them on every request. This keeps a warm copy in each
+worker so they can be resolved from memory instead of extra SELECTs.
+
+Invalidation is version based. Statement-level triggers bump a per-table
+counter in reference_versions whenever courses, modules or lecture schedules
+change (see db/init.sql). A background task reads those counters (one tiny
+query) every REFDATA_REFRESH_SECONDS and reloads only the tables whose
+version moved. Snapshots are immutable and swapped in whole, so readers never
+take a lock.
+
+The lectures are also indexed by time (LectureIndex) so "which lectures is
+this lecturer giving now?" and "is this lecture running?" are answered from
+memory. A schedule change reaches the index within REFDATA_REFRESH_SECONDS.
+
+A miss (an unknown module or course) reloads on the calling thread. Code on
+the asyncio event loop must not block on that, so it calls serve_from_memory()
+and reloads in a worker thread beforehand instead (see aio.py).
+"""
+import time as _time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta, timezone
+from threading import Lock
+from typing import NamedTuple
+
+from flask import current_app, g
+from sqlalchemy import select
+
+from .models import Course, Lecture, Module, ReferenceVersion
+from . import db
+from .query_budget import exempt_from_budget
+
+
+class ModuleInfo(NamedTuple):
+    name: str
+    course_code: str | None
+
+
+class LectureInfo(NamedTuple):
+    id: int
+    module_id: int
+    lecturer_id: str | None
+    start_time: datetime
+    end_time: datetime
+
+    def is_active(self, now: datetime) -> bool:
+        return self.start_time <= now <= self.end_time
+
+
+class LectureIndex:
+    """
+    Lectures sorted by start time, overall and per lecturer.
+
+    A lecture is running at `now` if it started in [now - longest, now] and
+    has not ended, where `longest` is the longest lecture in the index. That
+    is two binary searches plus a scan of the few lectures that started in
+    that window.
+    """
+
+    def __init__(self, lectures):
+        self._starts, self._lectures, self._longest = self._sorted(lectures)
+        by_lecturer: dict[str, list[LectureInfo]] = {}
+        for lecture in lectures:
+            by_lecturer.setdefault(lecture.lecturer_id, []).append(lecture)
+        self._by_lecturer = {lecturer_id: self._sorted(group) for lecturer_id, group in by_lecturer.items()}
+
+    @staticmethod
+    def _sorted(lectures) -> tuple[list[datetime], list[LectureInfo], timedelta]:
+        ordered = sorted(lectures, key=lambda lecture: lecture.start_time)
+        longest = max((lecture.end_time - lecture.start_time for lecture in ordered), default=timedelta(0))
+        return [lecture.start_time for lecture in ordered], ordered, longest
+
+    @staticmethod
+    def _running(starts, lectures, longest, now: datetime) -> list[LectureInfo]:
+        first = bisect_left(starts, now - longest)
+        last = bisect_right(starts, now)
+        return [lecture for lecture in lectures[first:last] if lecture.end_time >= now]
+
+    def running(self, now: datetime) -> list[LectureInfo]:
+        """Every lecture running at `now`."""
+        return self._running(self._starts, self._lectures, self._longest, now)
+
+    def running_for(self, lecturer_id: str, now: datetime) -> list[LectureInfo]:
+        """The lecturer's lectures running at `now`."""
+        group = self._by_lecturer.get(lecturer_id)
+        return self._running(*group, now) if group is not None else []
+
+
+class ReferenceSnapshot(NamedTuple):
+    versions: dict[str, int]
+    courses: dict[str, str]
+    modules: dict[int, ModuleInfo]
+    # Lectures overlapping [lectures_from, lectures_to); None if there were
+    # more than REFDATA_MAX_LECTURES (callers then fall back to the database)
+    lectures: dict[int, LectureInfo] | None
+    lecture_index: LectureIndex | None
+    lectures_from: datetime
+    lectures_to: datetime
+    loaded_at: float
+
+
+# Stands in for a snapshot that is not loaded yet when serving from memory:
+# it knows nothing, so callers fall back to the database
+EMPTY_SNAPSHOT = ReferenceSnapshot(
+    versions={}, courses={}, modules={}, lectures=None, lecture_index=None,
+    lectures_from=datetime.min.replace(tzinfo=timezone.utc),
+    lectures_to=datetime.min.replace(tzinfo=timezone.utc),
+    loaded_at=0.0,
+)
+
+
+def _serving_from_memory() -> bool:
+    return g.get('refdata_memory_only', False)
+
+
+def serve_from_memory() -> None:
+    """
+    Answer this app context's lookups from the current snapshot only: a miss
+    returns None, and an empty snapshot stands in until the first load.
+    """
+    g.refdata_memory_only = True
+
+
+def _lecture_range(now: datetime) -> tuple[datetime, datetime]:
+    """The span of lectures kept in memory: today and tomorrow (UTC)."""
+    start = datetime.combine(now.date(), time.min, timezone.utc)
+    return start, start + timedelta(days=2)
+
+
+class ReferenceData:
+    """Holds the current ReferenceSnapshot and reloads it when versions change."""
+
+    def __init__(self, max_lectures: int = 50000, max_age: float = 300):
+        """
+        Args:
+            max_lectures: Upper bound on lectures held in memory
+            max_age: Reload everything at least this often, in seconds, even
+                     if no version moved (covers databases without triggers)
+        """
+        self.max_lectures = max_lectures
+        self.max_age = max_age
+        self._snapshot: ReferenceSnapshot | None = None
+        self._lock = Lock()
+        self._last_check = 0.0
+
+    def snapshot(self) -> ReferenceSnapshot:
+        """Return the current snapshot, loading it on first use."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = EMPTY_SNAPSHOT if _serving_from_memory() else self.refresh()
+        return snapshot
+
+    def needs_reload(self, module_ids=()) -> bool:
+        """Whether the snapshot is not loaded yet or lacks any of these modules."""
+        snapshot = self._snapshot
+        return snapshot is None or any(module_id not in snapshot.modules for module_id in module_ids)
+
+    def refresh(self, min_interval: float = 0) -> ReferenceSnapshot:
+        """
+        Reload whatever changed since the current snapshot.
+
+        Args:
+            min_interval: Skip the version check if one ran less than this many
+                          seconds ago (used on cache misses to bound DB load)
+        """
+        with self._lock:
+            current = self._snapshot
+            if current is not None and _time.monotonic() - self._last_check < min_interval:
+                return current
+            self._last_check = _time.monotonic()
+
+            # Shared by every request, so not charged to the one that triggers it
+            with exempt_from_budget(), db.engine.connect() as conn:
+                return self._refresh(conn, current)
+
+    def _refresh(self, conn, current: ReferenceSnapshot | None) -> ReferenceSnapshot:
+        versions = dict(conn.execute(select(ReferenceVersion.name, ReferenceVersion.version)).all())
+        now = datetime.now(timezone.utc)
+        lectures_from, lectures_to = _lecture_range(now)
+        expired = current is None or _time.monotonic() - current.loaded_at > self.max_age
+
+        def changed(table):
+            return expired or versions.get(table) != current.versions.get(table)
+
+        reload_lectures = changed('lectures') or current.lectures_from != lectures_from
+        if not (expired or reload_lectures or changed('courses') or changed('modules')):
+            return current
+
+        if reload_lectures:
+            lectures = self._load_lectures(conn, lectures_from, lectures_to)
+            lecture_index = LectureIndex(lectures.values()) if lectures is not None else None
+        else:
+            lectures, lecture_index = current.lectures, current.lecture_index
+
+        self._snapshot = ReferenceSnapshot(
+            versions=versions,
+            courses=self._load_courses(conn) if changed('courses') else current.courses,
+            modules=self._load_modules(conn) if changed('modules') else current.modules,
+            lectures=lectures,
+            lecture_index=lecture_index,
+            lectures_from=lectures_from,
+            lectures_to=lectures_to,
+            loaded_at=_time.monotonic() if expired else current.loaded_at,
+        )
+        return self._snapshot
+
+    @staticmethod
+    def _load_courses(conn) -> dict[str, str]:
+        return dict(conn.execute(select(Course.code, Course.name)).all())
+
+    @staticmethod
+    def _load_modules(conn) -> dict[int, ModuleInfo]:
+        rows = conn.execute(select(Module.id, Module.name, Module.course_code))
+        return {row.id: ModuleInfo(row.name, row.course_code) for row in rows}
+
+    def _load_lectures(self, conn, start: datetime, end: datetime) -> dict[int, LectureInfo] | None:
+        rows = conn.execute(
+            select(Lecture.id, Lecture.module_id, Lecture.lecturer_id, Lecture.start_time, Lecture.end_time)
+            .where(Lecture.start_time < end, Lecture.end_time >= start)
+            .limit(self.max_lectures + 1)
+        ).all()
+        if len(rows) > self.max_lectures:
+            current_app.logger.warning('More than %d lectures today and tomorrow; not caching them',
+                                       self.max_lectures)
+            return None
+        return {row.id: LectureInfo(*row) for row in rows}
+
+    def course_name(self, code: str) -> str | None:
+        """Name of a course, or None if it does not exist."""
+        name = self.snapshot().courses.get(code)
+        if name is None and not _serving_from_memory():
+            # Possibly created since the last refresh
+            name = self.refresh(min_interval=1).courses.get(code)
+        return name
+
+    def module(self, module_id: int) -> ModuleInfo | None:
+        """Name and course of a module, or None if it does not exist."""
+        info = self.snapshot().modules.get(module_id)
+        if info is None and not _serving_from_memory():
+            info = self.refresh(min_interval=1).modules.get(module_id)
+        return info
+
+    def lecture(self, lecture_id: int) -> LectureInfo | None:
+        """A lecture of today or tomorrow by id, or None if it is not cached."""
+        lectures = self.snapshot().lectures
+        return lectures.get(lecture_id) if lectures is not None else None
+
+    def running_lectures(self, lecturer_id: str, now: datetime) -> list[LectureInfo] | None:
+        """
+        The lecturer's lectures running at `now`, from memory.
+
+        Returns:
+            The lectures (possibly none), or None if the snapshot does not
+            cover `now` and the caller has to ask the database
+        """
+        snapshot = self.snapshot()
+        if snapshot.lecture_index is None or not snapshot.lectures_from <= now < snapshot.lectures_to:
+            return None
+        return snapshot.lecture_index.running_for(lecturer_id, now)
+
+
+def get_reference_data() -> ReferenceData:
+    return current_app.extensions['reference_data']
+
+
+def refresh_reference_data() -> None:
+    """Background task body: pick up reference data changes."""
+    get_reference_data().refresh()
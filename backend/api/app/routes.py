@@ -1,22 +1,49 @@
-from flask import Blueprint, jsonify, request, current_app
-from .models import Users, Course, Module, Lecture, LectureAttendance
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from .models import Users, Course, Module, Lecture, LectureAttendance, CourseLeaderboard
 from .controllers import (
+    current_lectures_query,
     get_lecturer_current_lectures,
     verify_student_attendance,
     get_student_attendance,
+    decode_sync_cursor,
     get_course_leaderboard,
     get_student_courses,
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
-from datetime import datetime, timedelta
+from .cache import cached_response, get_response_cache, invalidate_courses, invalidate_users, user_tag, course_tag
+from .auth import get_token_verifier, issue_token, revoke_token, revoke_user_tokens
+from .attendance_log import get_attendance_log
+from .code_stream import code_stream, code_stream_query
+from .live_counts import LECTURE_ENROLMENTS, LiveCounts, live_counts_deadline, live_counts_stream
+from .pubsub import Subscription, get_event_bus, lecture_topic
+from .sse import SSE_HEADERS, get_stream_slots
+from .hashing import HashingBusy, get_password_hasher
+from .metrics import CONTENT_TYPE, finish_request_metrics, render_metrics, start_request_metrics
+from .pool import pool_stats
+from .query_budget import check_query_budget, query_budget
+from .refdata import get_reference_data
+from .utils import code_cache_stats
+from datetime import date, datetime, timezone
+import hmac
+import os
+import time
 from functools import wraps
 
 main = Blueprint('main', __name__)
 
+# Request latency, status and SQL statements per request (app/metrics.py),
+# checked against the route's query budget (app/query_budget.py) after
+# being recorded: after_request hooks run in reverse order. Budgets of
+# authenticated routes leave room for one token revocation lookup.
+main.before_request(start_request_metrics)
+main.after_request(check_query_budget)
+main.after_request(finish_request_metrics)
+
 # Helper function to verify JWT and extract user
 def verify_token():
-    """Verify JWT token from Authorization header. Returns user dict or None."""
+    """
+    Verify JWT token from Authorization header. Returns user dict or None.
+    Tokens that were revoked (logout, account deletion) are rejected.
+    """
     auth_header = request.headers.get('Authorization')
     if not auth_header:
         return None
@@ -28,10 +55,11 @@ def verify_token():
             return None
         
         token = parts[1]
-        secret = current_app.config.get('ATTENDANCE_SECRET_SEED')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
+        payload = get_token_verifier().verify(token)
+        if payload is not None:
+            request.token = token
         return payload
-    except (jwt.InvalidTokenError, jwt.ExpiredSignatureError, IndexError):
+    except IndexError:
         return None
 
 # Decorator to require authentication
@@ -45,6 +73,16 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
+# Response for when the password hashing pool is saturated
+def hashing_busy(e):
+    response = jsonify({"error": "Server busy, please try again shortly"})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+# Response for when this worker serves no more streams (see app/sse.py)
+def streams_unavailable():
+    return jsonify({"error": "Streaming is not available on this server, poll /code instead"}), 503
+
 # Helper to extract student_id from current request's JWT
 def get_student_id():
     """Get student_id from the current request's authenticated user. Returns None if not authenticated."""
@@ -58,11 +96,13 @@ def home():
 
 
 @main.route('/code', methods=['GET'])
+@query_budget(2)
 @token_required
 def get_code():
     """
-    Send code to front end via websockets every 30 seconds
-    Returns a verification code for attendance checking
+    Returns the verification codes of the lecturer's current lectures.
+    Codes rotate every 30 seconds; poll this, or keep /code/stream open to
+    have each new code pushed.
     Requires authentication as a lecturer (is_staff=True).
     """
     try:
@@ -77,7 +117,112 @@ def get_code():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@main.route('/code/stream', methods=['GET'])
+@query_budget(2)
+@token_required
+def stream_code():
+    """
+    Server-Sent Events stream of the lecturer's codes: a `code` event (the
+    /code body plus `valid_until`) at every code rotation. See app/code_stream.py.
+    503 when this worker already holds WSGI_STREAM_LIMIT streams (app/sse.py).
+    Requires authentication as a lecturer (is_staff=True).
+    """
+    from . import db
+    if not request.user.get('is_staff', False):
+        return jsonify({"error": "Only lecturers can access this endpoint"}), 403
+
+    slots = get_stream_slots()
+    if not slots.acquire():
+        return streams_unavailable()
+    try:
+        started = time.time()
+        max_seconds = current_app.config['CODE_STREAM_MAX_SECONDS']
+        query = code_stream_query(get_student_id(), datetime.now(timezone.utc), max_seconds)
+        lectures = db.session.execute(query).all()
+        # Hand the connection back to the pool for the life of the stream
+        db.session.close()
+    except Exception as e:
+        slots.release()
+        return jsonify({"error": str(e)}), 500
+
+    if not lectures:
+        slots.release()
+        return jsonify({
+            'success': False,
+            'message': 'No current lectures found for this lecturer'
+        }), 404
+
+    def events():
+        for event, wait in code_stream(lectures, started + max_seconds):
+            yield event
+            if wait is not None:
+                time.sleep(wait)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # Runs even if the client goes away before the first event
+    response.call_on_close(slots.release)
+    return response
+
+@main.route('/attendance/live', methods=['GET'])
+@query_budget(3)
+@token_required
+def stream_live_counts():
+    """
+    Server-Sent Events stream of check-in counts for the lecturer's current
+    lectures: a `counts` event with attended/enrolled per lecture whenever
+    they change. See app/live_counts.py.
+    503 when this worker already holds WSGI_STREAM_LIMIT streams (app/sse.py).
+    Requires authentication as a lecturer (is_staff=True).
+    """
+    from . import db
+    if not request.user.get('is_staff', False):
+        return jsonify({"error": "Only lecturers can access this endpoint"}), 403
+
+    slots = get_stream_slots()
+    if not slots.acquire():
+        return streams_unavailable()
+    bus = get_event_bus()
+    subscription = Subscription()
+    topics = []
+    try:
+        now = datetime.now(timezone.utc)
+        lectures = get_reference_data().running_lectures(get_student_id(), now)
+        if lectures is None:
+            lectures = db.session.execute(current_lectures_query(get_student_id(), now)).all()
+        if not lectures:
+            db.session.close()
+            slots.release()
+            return jsonify({
+                'success': False,
+                'message': 'No current lectures found for this lecturer'
+            }), 404
+
+        # Subscribe first so no check-in lands between the baseline and the feed
+        topics = [lecture_topic(lecture.id) for lecture in lectures]
+        bus.subscribe(subscription, *topics)
+        lecture_ids = [lecture.id for lecture in lectures]
+        rows = db.session.execute(LECTURE_ENROLMENTS, {'lecture_ids': lecture_ids}).all()
+        db.session.close()
+        counts = LiveCounts(lectures, rows)
+    except Exception as e:
+        bus.unsubscribe(subscription, *topics)
+        slots.release()
+        return jsonify({"error": str(e)}), 500
+
+    deadline = live_counts_deadline(lectures, current_app.config['LIVE_COUNTS_MAX_SECONDS'], time.time())
+
+    def events():
+        try:
+            yield from live_counts_stream(counts, subscription, deadline)
+        finally:
+            bus.unsubscribe(subscription, *topics)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.call_on_close(slots.release)
+    return response
+
 @main.route('/verify', methods=['POST'])
+@query_budget(2)
 @token_required
 def verify_attendance():
     """
@@ -101,7 +246,9 @@ def verify_attendance():
 
 
 @main.route('/user/<student_id>', methods=['GET'])
+@query_budget(2)
 @token_required
+@cached_response(lambda student_id: [user_tag(student_id)])
 def get_user_details(student_id):
     """
     Return student information by student_id including streak data
@@ -124,37 +271,61 @@ def get_user_details(student_id):
 
 
 @main.route('/attendance', methods=['GET'])
+@query_budget(2)
 @token_required
+@cached_response(lambda: [user_tag(get_student_id())])
 def attendance():
     """
-    Get all lecture attendance for the authenticated student, grouped by date.
+    Get lecture attendance for the authenticated student, grouped by date.
     Returns the shape expected by the streaks/calendar view.
+    Query params (all optional):
+      from, to: YYYY-MM-DD, only lectures starting on those days
+      since: the cursor from a previous response, only rows changed after it
     Requires authentication.
     """
     try:
         student_id = get_student_id()
-        return get_student_attendance(student_id)
+        try:
+            date_from = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+            date_to = date.fromisoformat(request.args['to']) if 'to' in request.args else None
+        except ValueError:
+            return jsonify({"error": "from and to must be dates in YYYY-MM-DD format"}), 400
+        try:
+            since = decode_sync_cursor(request.args['since']) if 'since' in request.args else None
+        except (ValueError, OverflowError):
+            return jsonify({"error": "Invalid since cursor"}), 400
+
+        return get_student_attendance(student_id, date_from, date_to, since)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @main.route('/leaderboard/<course_code>', methods=['GET'])
+@query_budget(3)
 @token_required
+@cached_response(lambda course_code: [course_tag(course_code)])
 def leaderboard(course_code):
     """
     Get leaderboard for a specific course — students ranked by streak.
     Returns the shape expected by the leaderboard view.
+    Query params: limit (top N, default 10, max 100), cursor (nextCursor of the previous page)
     Requires authentication.
     """
     try:
         student_id = get_student_id()
-        return get_course_leaderboard(course_code, student_id)
+        limit = request.args.get('limit', 10, type=int)
+        if not 1 <= limit <= 100:
+            return jsonify({"error": "limit must be between 1 and 100"}), 400
+
+        return get_course_leaderboard(course_code, student_id, limit, request.args.get('cursor'))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @main.route('/courses', methods=['GET'])
+@query_budget(2)
 @token_required
+@cached_response(lambda: [user_tag(get_student_id())])
 def courses():
     """
     Get courses the authenticated student is enrolled in.
@@ -168,6 +339,7 @@ def courses():
 
 
 @main.route('/account/register', methods=['POST'])
+@query_budget(3)
 def register():
     """
     Register a new user account
@@ -188,28 +360,24 @@ def register():
         if existing:
             return jsonify({"error": "User already exists"}), 409
 
-        pw_hash = generate_password_hash(password)
+        pw_hash = get_password_hasher().generate(password)
         user = Users(student_id=student_id, username=username, password=pw_hash, is_staff=is_staff)
         from . import db
         db.session.add(user)
         db.session.commit()
 
         # optionally return token
-        secret = current_app.config.get('ATTENDANCE_SECRET_SEED')
-        payload = {
-            'student_id': user.student_id,
-            'username': user.username,
-            'is_staff': user.is_staff,
-            'exp': datetime.utcnow() + timedelta(days=7)
-        }
-        token = jwt.encode(payload, secret, algorithm='HS256')
+        token = issue_token(user)
 
         return jsonify({"message": "User registered successfully", "token": token}), 201
+    except HashingBusy as e:
+        return hashing_busy(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
 @main.route('/account/login', methods=['POST'])
+@query_budget(1)
 def login():
     """
     Login with username and password
@@ -229,37 +397,34 @@ def login():
         if not user:
             return jsonify({"error": "Invalid credentials"}), 401
 
-        if not check_password_hash(user.password, password):
+        if not get_password_hasher().check(user.password, password):
             return jsonify({"error": "Invalid credentials"}), 401
 
-        secret = current_app.config.get('ATTENDANCE_SECRET_SEED')
-        payload = {
-            'student_id': user.student_id,
-            'username': user.username,
-            'is_staff': user.is_staff,
-            'exp': datetime.utcnow() + timedelta(days=7)
-        }
-        token = jwt.encode(payload, secret, algorithm='HS256')
+        token = issue_token(user)
 
         return jsonify({"message": "Login successful", "token": token, "user": {
             "student_id": user.student_id,
             "username": user.username,
             "is_staff": user.is_staff
         }}), 200
+    except HashingBusy as e:
+        return hashing_busy(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @main.route('/account/logout', methods=['POST'])
+@query_budget(2)
 @token_required
 def logout():
     """
     Logout the current user.
-    Since we use stateless JWTs, logout is mainly client-side (discard token).
-    Server accepts the request and confirms successful logout.
+    Revokes the token used for this request, so it stops working on every
+    worker (within AUTH_REVOCATION_REFRESH_SECONDS) even if the client keeps it.
     """
     try:
         user = request.user
+        revoke_token(request.token, user)
         return jsonify({"message": f"Logout successful for {user.get('username')}"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -267,6 +432,7 @@ def logout():
 
 
 @main.route('/account/delete', methods=['DELETE'])
+@query_budget(6)
 @token_required
 def delete_account():
     """
@@ -284,14 +450,67 @@ def delete_account():
         
         # Verify password matches
         db_user = Users.query.filter_by(student_id=student_id).first()
-        if not db_user or not check_password_hash(db_user.password, data.get('password')):
+        if not db_user or not get_password_hasher().check(db_user.password, data.get('password')):
             return jsonify({"error": "Invalid password"}), 401
         
+        # Their leaderboard rows go with the account (ON DELETE CASCADE)
         from . import db
+        course_codes = [code for code, in db.session.query(CourseLeaderboard.course_code)
+                        .filter_by(student_id=student_id)]
         db.session.delete(db_user)
         db.session.commit()
+        revoke_user_tokens(student_id)
+        invalidate_users(student_id)
+        invalidate_courses(*course_codes)
         
         return jsonify({"message": "Account deleted successfully"}), 200
+    except HashingBusy as e:
+        return hashing_busy(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+@main.route('/admin/stats', methods=['GET'])
+@query_budget(1)
+@token_required
+def admin_stats():
+    """
+    Internal counters of this worker process: database connection pool,
+    password hashing pool, token cache, code index, response cache, event bus,
+    open streams and, in buffered write mode, the attendance log.
+    Requires authentication as staff.
+    """
+    if not request.user.get('is_staff', False):
+        return jsonify({"error": "Only staff can access this endpoint"}), 403
+
+    from . import db
+    response_cache = get_response_cache()
+    stats = {
+        "pid": os.getpid(),
+        "db_pool": pool_stats(db.engine),
+        "password_hashing": get_password_hasher().stats(),
+        "tokens": get_token_verifier().stats(),
+        "code_index": code_cache_stats(),
+        "response_cache": {"hits": response_cache.hits, "misses": response_cache.misses},
+        "event_bus": get_event_bus().stats(),
+        "streams": get_stream_slots().stats(),
+    }
+    if current_app.config['ATTENDANCE_WRITE_MODE'] == 'buffered':
+        stats["attendance_log"] = get_attendance_log().stats()
+    return jsonify(stats), 200
+
+
+@main.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics: per-route latency, status codes, SQL statements and
+    database time per request, code index and connection pool counters.
+    No user token; requires METRICS_TOKEN as a bearer token when it is set.
+    """
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    token = current_app.config['METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '').encode()
+    if token and not hmac.compare_digest(supplied, f'Bearer {token}'.encode()):
+        return jsonify({"error": "Invalid metrics token"}), 401
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,72 @@
+"""
+Server-Sent Events formatting, shared by the WSGI and asyncio streams, and
+the cap on streams a WSGI worker holds open.
+
+A WSGI stream keeps its request thread (or greenlet) for up to an hour. On
+gthread workers that is one of GUNICORN_THREADS, so a few dozen open
+lecturer screens would leave none for /verify. WSGI_STREAM_LIMIT caps open
+streams per worker process; beyond it the routes answer 503 and clients poll
+/code instead, or reach the streams on the asyncio server (asgi.py), which
+is not capped.
+"""
+import json
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
+
+# Keep proxies (nginx) from buffering or caching the stream
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+
+def sse_event(data: dict, event: str | None = None, retry_ms: int | None = None) -> str:
+    """
+    One SSE message with a JSON payload.
+
+    Args:
+        data: The payload, sent as a single `data:` line
+        event: Event name the client listens for (default 'message')
+        retry_ms: Reconnection delay for the client's EventSource
+    """
+    lines = []
+    if retry_ms is not None:
+        lines.append(f'retry: {retry_ms}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class StreamSlots:
+    """Bounds the streams a WSGI worker process serves at once."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._slots = BoundedSemaphore(limit) if limit else None
+        self._lock = Lock()
+        self.open = 0
+        self.refused = 0
+
+    def acquire(self) -> bool:
+        """Take a slot for a new stream; False if the worker is at its limit."""
+        if self._slots is None or not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.refused += 1
+            return False
+        with self._lock:
+            self.open += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.open -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {'limit': self.limit, 'open': self.open, 'refused': self.refused}
+
+
+def get_stream_slots() -> StreamSlots:
+    return current_app.extensions['stream_slots']
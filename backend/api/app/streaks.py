@@ -0,0 +1,61 @@
+"""
+Streak maintenance outside the check-in path.
+
+A check-in only ever increments a student's streak. Breaking a streak is done
+here, in bulk, when lectures end: every enrolled student who did not attend
+has their streak reset in one set-based statement, so Users.current_streak
+(and the leaderboard built from it) is correct without waiting for the
+student's next check-in.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from .cache import invalidate_courses, invalidate_users
+from .queries import CLOSE_ENDED_LECTURES, CLOSEOUT_LOCK, CLOSEOUT_LOCK_KEY, NEXT_LECTURE_END
+from . import db
+
+logger = logging.getLogger(__name__)
+
+
+def close_ended_lectures(now: datetime | None = None) -> float:
+    """
+    Close every lecture that has ended and apply missed-lecture streak breaks.
+
+    Works through the backlog in batches of LECTURE_CLOSEOUT_BATCH lectures,
+    committing after each, then looks up when the next lecture ends. Lectures
+    are closed LECTURE_CLOSEOUT_DELAY_SECONDS after they end, which leaves
+    time for buffered check-ins to be flushed (see app/attendance_log.py).
+    Every worker runs this; when another is closing a batch, this one leaves
+    the backlog to it.
+
+    Returns:
+        Seconds until the next unclosed lecture ends, so the background task
+        wakes up exactly then (capped by its own interval).
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    batch_size = current_app.config['LECTURE_CLOSEOUT_BATCH']
+    delay = timedelta(seconds=current_app.config['LECTURE_CLOSEOUT_DELAY_SECONDS'])
+
+    while True:
+        if not db.session.execute(CLOSEOUT_LOCK, {'key': CLOSEOUT_LOCK_KEY}).scalar():
+            db.session.rollback()
+            break
+        result = db.session.execute(
+            CLOSE_ENDED_LECTURES, {'now': now, 'cutoff': now - delay, 'batch_size': batch_size}
+        ).one()
+        db.session.commit()
+        if result.lectures_closed:
+            invalidate_users(*result.affected_users)
+            invalidate_courses(*result.affected_courses)
+            logger.info('Closed %d lectures, reset %d streaks', result.lectures_closed, result.streaks_reset)
+        if result.lectures_closed < batch_size:
+            break
+
+    next_end = db.session.execute(NEXT_LECTURE_END).scalar()
+    db.session.commit()
+    if next_end is None:
+        return current_app.config['LECTURE_CLOSEOUT_SECONDS']
+    return max(0.0, (next_end + delay - datetime.now(timezone.utc)).total_seconds())
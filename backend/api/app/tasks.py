@@ -0,0 +1,90 @@
+"""
+Background tasks that run inside each API worker process.
+
+Tasks are registered on the app in create_app() and started lazily on the
+first request a process serves. Starting them per process (rather than at
+import time) keeps them alive in every worker of a pre-forking server, since
+threads do not survive a fork.
+"""
+import os
+import threading
+
+
+class PeriodicTask:
+    """
+    Run a function on a daemon thread every `interval` seconds.
+
+    The function runs inside an app context. It may return a number of seconds
+    to wait before the next run, which lets a task wake up exactly when its next
+    piece of work is due instead of polling on a fixed interval.
+    """
+
+    def __init__(self, name: str, func, interval: float):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, app) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(app,), name=f'task-{self.name}', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self, app):
+        """Run the task a single time in the calling thread."""
+        with app.app_context():
+            return self.func()
+
+    def _run(self, app) -> None:
+        while not self._stop.is_set():
+            delay = None
+            try:
+                delay = self.run_once(app)
+            except Exception:
+                app.logger.exception('Background task %s failed', self.name)
+            wait = self.interval if delay is None else max(0.0, min(delay, self.interval))
+            self._stop.wait(wait)
+
+
+def register_task(app, name: str, func, interval: float) -> PeriodicTask:
+    """Register a periodic task to be started in every worker process."""
+    task = PeriodicTask(name, func, interval)
+    app.extensions.setdefault('background_tasks', {})[name] = task
+    return task
+
+
+def start_background_tasks(app) -> None:
+    """
+    Start the registered tasks once per process.
+
+    Cheap enough to call from before_request: after the first call in a process
+    it is a single pid comparison.
+    """
+    state = app.extensions.setdefault('background_tasks_state', {'pid': None, 'lock': threading.Lock()})
+    pid = os.getpid()
+    if state['pid'] == pid:
+        return
+    with state['lock']:
+        if state['pid'] == pid:
+            return
+        if app.config.get('BACKGROUND_TASKS', True):
+            for task in app.extensions.get('background_tasks', {}).values():
+                task.start(app)
+        state['pid'] = pid
+
+
+def stop_background_tasks(app, timeout: float | None = None) -> None:
+    """Stop every running task in this process (used on graceful shutdown)."""
+    for task in app.extensions.get('background_tasks', {}).values():
+        task.stop(timeout)
+    state = app.extensions.get('background_tasks_state')
+    if state is not None:
+        state['pid'] = None
@@ -1,12 +1,152 @@
-import pyotp
 import hashlib
-import base64
-from datetime import datetime, timedelta
+import hmac
+import time
+from functools import lru_cache
 from threading import Lock
 
-# In-memory cache for codes: {code: (lecture_id, timestamp)}
-_code_cache = {}
-_cache_lock = Lock()
+# Length of one TOTP window in seconds
+CODE_INTERVAL = 30
+# Number of digits in a lecture code
+CODE_DIGITS = 4
+# Number of per-lecture HMAC keys kept in memory
+KEY_CACHE_SIZE = 16384
+
+
+class CodeIndex:
+    """
+    In-memory index of recently issued lecture codes, bucketed by TOTP window.
+
+    Each 30-second window gets its own {code: {lecture_id, ...}} bucket. A
+    4-digit code space collides quickly once a few hundred lectures run at
+    once, so every bucket keeps all candidate lectures for a code. Expiry drops
+    whole buckets at once instead of scanning every entry, so cleanup cost does
+    not grow with the number of live lectures.
+
+    Lookups never take a lock: the bucket map is replaced (copy-on-write) when
+    a window expires, and single dict reads/writes are atomic under the GIL.
+    Writers and counters are spread across striped locks keyed by code, so
+    concurrent lecturers and students do not queue behind one global lock.
+    """
+
+    def __init__(self, retention_windows: int = 4, stripes: int = 16):
+        """
+        Args:
+            retention_windows: How many windows (current included) a code stays
+                              resolvable for. 4 windows = 2 minutes.
+            stripes: Number of locks used to spread writers and counters
+        """
+        self.retention_windows = retention_windows
+        self._buckets: dict[int, dict[str, frozenset[int]]] = {}
+        self._oldest_window = 0
+        self._rotate_lock = Lock()
+        self._stripes = [Lock() for _ in range(stripes)]
+        # Per-stripe counters: [hits, misses]
+        self._counters = [[0, 0] for _ in range(stripes)]
+        self._evictions = 0
+
+    def _stripe(self, code: str) -> int:
+        return hash(code) % len(self._stripes)
+
+    def _expire(self, window: int) -> None:
+        """Drop buckets that have fallen out of the retention range."""
+        oldest = window - self.retention_windows + 1
+        if oldest <= self._oldest_window:
+            return
+        with self._rotate_lock:
+            if oldest <= self._oldest_window:
+                return
+            kept = {w: bucket for w, bucket in self._buckets.items() if w >= oldest}
+            self._evictions += sum(len(bucket) for w, bucket in self._buckets.items() if w < oldest)
+            self._buckets = kept
+            self._oldest_window = oldest
+
+    def add(self, code: str, lecture_id: int, window: int) -> None:
+        """Record that code was issued for lecture_id in the given window."""
+        self._expire(window)
+        bucket = self._buckets.get(window)
+        if bucket is None:
+            with self._rotate_lock:
+                bucket = self._buckets.get(window)
+                if bucket is None:
+                    bucket = {}
+                    buckets = dict(self._buckets)
+                    buckets[window] = bucket
+                    self._buckets = buckets
+        # Candidate sets are immutable and swapped in whole, so readers never
+        # see a set that is being modified
+        with self._stripes[self._stripe(code)]:
+            candidates = bucket.get(code, frozenset())
+            if lecture_id not in candidates:
+                bucket[code] = candidates | {lecture_id}
+
+    def find(self, code: str, window: int) -> frozenset[int]:
+        """
+        Look up every lecture a code was issued for in the retained windows.
+
+        Args:
+            code: The 4-digit code to look up
+            window: The current TOTP window (unix time // CODE_INTERVAL)
+
+        Returns:
+            The candidate lecture_ids (empty if the code is unknown or expired)
+        """
+        self._expire(window)
+        buckets = self._buckets
+        lecture_ids = frozenset()
+        for w in range(window, window - self.retention_windows, -1):
+            bucket = buckets.get(w)
+            if bucket is not None:
+                lecture_ids |= bucket.get(code, frozenset())
+
+        stripe = self._stripe(code)
+        with self._stripes[stripe]:
+            self._counters[stripe][0 if lecture_ids else 1] += 1
+        return lecture_ids
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters and the current index size."""
+        buckets = self._buckets
+        return {
+            'hits': sum(c[0] for c in self._counters),
+            'misses': sum(c[1] for c in self._counters),
+            'evictions': self._evictions,
+            'windows': len(buckets),
+            'codes': sum(len(bucket) for bucket in buckets.values()),
+        }
+
+
+_code_index = CodeIndex()
+
+
+def current_window(for_time: float | None = None) -> int:
+    """Return the TOTP window number for a unix timestamp (default: now)."""
+    if for_time is None:
+        for_time = time.time()
+    return int(for_time // CODE_INTERVAL)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _lecture_key(lecture_id: int, seed: str) -> bytes:
+    """
+    Derive a lecture's HMAC key, caching it so repeat calls skip the hashing.
+
+    This is the raw form of the base32 TOTP secret used since codes were
+    introduced (SHA-256 of "seed_lectureid"), so codes are unchanged.
+    """
+    return hashlib.sha256(f"{seed}_{lecture_id}".encode()).digest()
+
+
+def _window_message(window: int) -> bytes:
+    """Encode a TOTP window as the 8-byte big-endian HOTP counter."""
+    return window.to_bytes(8, 'big')
+
+
+def _hotp(key: bytes, message: bytes) -> str:
+    """RFC 4226 HOTP: HMAC-SHA1 with dynamic truncation to CODE_DIGITS digits."""
+    digest = hmac.digest(key, message, 'sha1')
+    offset = digest[-1] & 0x0F
+    value = int.from_bytes(digest[offset:offset + 4], 'big') & 0x7FFFFFFF
+    return str(value % 10 ** CODE_DIGITS).zfill(CODE_DIGITS)
 
 
 def generate_lecture_code(lecture_id: int, seed: str) -> str:
@@ -20,47 +160,86 @@ def generate_lecture_code(lecture_id: int, seed: str) -> str:
     Returns:
         A 4-digit time-based code that rotates every 30 seconds
     """
-    # Create a unique secret by combining seed with lecture_id
-    combined_secret = f"{seed}_{lecture_id}"
-    # Hash to get a valid base32 secret
-    hashed = hashlib.sha256(combined_secret.encode()).digest()
-    secret = base64.b32encode(hashed).decode('utf-8')
+    return issue_lecture_codes([lecture_id], seed)[lecture_id]
+
+
+def generate_lecture_code_at(lecture_id: int, seed: str, window: int) -> str:
+    """
+    Compute a lecture's code for a specific TOTP window without recording it.
+
+    Args:
+        lecture_id: The unique lecture identifier
+        seed: The secret seed to use for generation
+        window: The TOTP window number (unix time // CODE_INTERVAL)
+
+    Returns:
+        The 4-digit code for that window
+    """
+    return _hotp(_lecture_key(lecture_id, seed), _window_message(window))
+
+
+def batch_lecture_codes(lecture_ids, seed: str, windows: range) -> dict[int, list[str]]:
+    """
+    Compute the codes of many lectures over a range of windows in one pass.
+
+    Keys come from the per-lecture key cache and each window's counter is
+    encoded once, so the per-code cost is a single one-shot HMAC-SHA1.
+
+    Args:
+        lecture_ids: The lectures to compute codes for
+        seed: The secret seed to use for generation
+        windows: The TOTP windows to compute, e.g. range(w - 1, w + 2)
 
-    # Create TOTP with 30-second interval and 4 digits
-    totp = pyotp.TOTP(secret, interval=30, digits=4)
-    code = totp.now()
+    Returns:
+        {lecture_id: [code for each window, in order]}
+    """
+    messages = [_window_message(w) for w in windows]
+    return {
+        lecture_id: [_hotp(key, message) for message in messages]
+        for lecture_id, key in ((lid, _lecture_key(lid, seed)) for lid in lecture_ids)
+    }
 
-    # Store code in cache with timestamp
-    with _cache_lock:
-        _code_cache[code] = (lecture_id, datetime.utcnow())
-        _clean_old_codes()
 
-    return code
+def issue_lecture_codes(lecture_ids, seed: str) -> dict[int, str]:
+    """
+    Compute the current window's codes for several lectures and record them
+    in the code index so students can be resolved back to the lecture.
 
+    Args:
+        lecture_ids: The lectures to issue codes for
+        seed: The secret seed to use for generation
 
-def _clean_old_codes():
-    """Remove codes older than 2 minutes from cache. Must be called with lock held."""
-    cutoff = datetime.utcnow() - timedelta(minutes=2)
-    expired = [code for code, (_, timestamp) in _code_cache.items() if timestamp < cutoff]
-    for code in expired:
-        del _code_cache[code]
+    Returns:
+        {lecture_id: code}
+    """
+    window = current_window()
+    codes = batch_lecture_codes(lecture_ids, seed, range(window, window + 1))
+    issued = {}
+    for lecture_id, (code,) in codes.items():
+        _code_index.add(code, lecture_id, window)
+        issued[lecture_id] = code
+    return issued
 
 
-def find_lecture_by_code(code: str) -> int:
+def find_lectures_by_code(code: str) -> frozenset[int]:
     """
-    Find a lecture_id by its code from the recent cache.
+    Find every lecture_id a code was recently issued for.
+
+    Several concurrent lectures can share a 4-digit code, so the caller has to
+    decide which candidate applies (e.g. by the student's enrolment).
 
     Args:
         code: The 4-digit code to look up
 
     Returns:
-        The lecture_id if found, None otherwise
+        The candidate lecture_ids, empty if none were found
     """
-    with _cache_lock:
-        _clean_old_codes()
-        if code in _code_cache:
-            return _code_cache[code][0]
-    return None
+    return _code_index.find(code, current_window())
+
+
+def code_cache_stats() -> dict:
+    """Return hit/miss/eviction counters for the lecture code index."""
+    return _code_index.stats()
 
 
 def verify_lecture_code(lecture_id: int, code: str, seed: str, tolerance: int = 1) -> bool:
@@ -77,16 +256,6 @@ def verify_lecture_code(lecture_id: int, code: str, seed: str, tolerance: int =
     Returns:
         True if the code is valid within the time window, False otherwise
     """
-    # Create the same unique secret
-    combined_secret = f"{seed}_{lecture_id}"
-    hashed = hashlib.sha256(combined_secret.encode()).digest()
-    secret = base64.b32encode(hashed).decode('utf-8')
-
-    # Create TOTP with 30-second interval and 4 digits
-    totp = pyotp.TOTP(secret, interval=30, digits=4)
-
-    # Verify with tolerance (±1 interval = ±30 seconds)
-    return totp.verify(code, valid_window=tolerance)
-
-
-
+    window = current_window()
+    codes = batch_lecture_codes([lecture_id], seed, range(window - tolerance, window + tolerance + 1))
+    return any(hmac.compare_digest(code, candidate) for candidate in codes[lecture_id])
@@ -0,0 +1,14 @@
+"""
+ASGI entry point for the asyncio check-in path (/verify and /code).
+
+    uvicorn asgi:app --port 5001 --workers 4
+
+Every other endpoint is served by the WSGI app (wsgi.py).
+"""
+from dotenv import load_dotenv
+from app import create_app
+from app.aio import create_asgi_app
+
+load_dotenv()
+
+app = create_asgi_app(create_app())
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the API hot paths. Run from backend/api, e.g. `python -m bench.totp`,
+or `python -m bench.load` for HTTP load against a seeded database (bench/seed.py).
+"""
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Compare two bench.load result files and flag regressions.
+
+A scenario regresses when its throughput drops, or its p95/p99 latency rises,
+by more than --threshold percent, when it runs more than QUERY_SLACK extra
+queries per request, or when it returns errors the baseline did not. Exits with status 1 if anything
+regressed, so it can gate CI.
+
+Usage (from backend/api):
+    python -m bench.compare bench/results/baseline.json bench/results/latest.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# (label, getter, higher is better)
+METRICS = (
+    ('req/s', lambda r: r['throughput_rps'], True),
+    ('p50 ms', lambda r: r.get('latency_ms', {}).get('p50'), False),
+    ('p95 ms', lambda r: r.get('latency_ms', {}).get('p95'), False),
+    ('p99 ms', lambda r: r.get('latency_ms', {}).get('p99'), False),
+    ('q/req', lambda r: r['queries_per_request'], False),
+)
+
+# Queries per request vary a little with cache hits; an N+1 adds whole queries
+QUERY_SLACK = 0.1
+
+# Only these gate the exit status; p50 is shown for context
+GATED = {'req/s', 'p95 ms', 'p99 ms'}
+
+
+def change(old: float | None, new: float | None) -> float | None:
+    """Relative change in percent, or None if either side is missing or zero."""
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> tuple[list[tuple], list[str]]:
+    """Table rows (scenario, metric, old, new, change) and a list of regressions."""
+    rows, regressions = [], []
+    for name, new in current['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        for label, get, higher_is_better in METRICS:
+            before, after = get(old), get(new)
+            delta = change(before, after)
+            rows.append((name, label, before, after, delta))
+            if label == 'q/req':
+                if before is not None and after is not None and after > before + QUERY_SLACK:
+                    regressions.append(f'{name}: {after:.2f} queries per request, was {before:.2f}')
+            elif label in GATED and delta is not None and (-delta if higher_is_better else delta) > threshold:
+                regressions.append(f'{name}: {label} {before:.1f} -> {after:.1f} ({delta:+.1f}%)')
+        if new['errors'] and not old['errors']:
+            regressions.append(f'{name}: {new["errors"]} errors, baseline had none')
+    return rows, regressions
+
+
+def describe(results: dict) -> str:
+    settings = results['settings']
+    return (f'{results.get("revision") or "?"} {results["started_at"]} {results["server"]}, '
+            f'concurrency {settings["concurrency"]}, {settings["dataset"]["students"]} students')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline', type=Path, help='Results of the reference run')
+    parser.add_argument('current', type=Path, help='Results of the run to check')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Allowed change in percent before flagging (default 10)')
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+    print(f'baseline: {describe(baseline)}')
+    print(f'current:  {describe(current)}')
+    if baseline['settings']['concurrency'] != current['settings']['concurrency'] \
+            or baseline['settings']['dataset'] != current['settings']['dataset']:
+        print('warning: the runs used different concurrency or datasets')
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    print(f'{"scenario":<13}{"metric":<8}{"baseline":>10}{"current":>10}{"change":>9}')
+    for name, label, before, after, delta in rows:
+        print(f'{name:<13}{label:<8}'
+              + ''.join(f'{value:>10.2f}' if value is not None else f'{"-":>10}' for value in (before, after))
+              + (f'{delta:>+8.1f}%' if delta is not None else f'{"-":>9}'))
+
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) beyond {args.threshold:g}%:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('\nno regressions')
+
+
+if __name__ == '__main__':
+    main()
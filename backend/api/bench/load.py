@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Load benchmark of the API hot paths against a local PostgreSQL database.
+
+Seeds a dataset of the given scale (bench/seed.py; the database is wiped),
+then runs each scenario for --duration seconds, after --warmup seconds, with
+--concurrency clients each sending requests back to back over keep-alive:
+
+    code          lecturers polling GET /code for their running lecture
+    leaderboard   students reading GET /leaderboard/<their course>
+    attendance    students reading GET /attendance
+    verify        a check-in surge: every student of the running lectures
+                  POSTs /verify with the current code, then again (duplicates)
+
+By default the app is served in this process (werkzeug, threaded), which lets
+the benchmark count the SQL statements each request runs; the clients share
+its interpreter, so compare such runs with each other rather than with
+production numbers. With --url it drives a server you started on the same
+database and secret (gunicorn, uvicorn) and CODE_LOOKUP_MODE=table; queries
+per request then come from pg_stat_statements when it is installed. The
+verify clients compute the current codes themselves rather than polling /code.
+
+Throughput, latency percentiles, status codes and queries per request are
+printed and saved as JSON (--output, default bench/results/<time>.json) for
+`python -m bench.compare`.
+
+Usage (from backend/api):
+    BENCH_DATABASE_URL=postgresql://... poetry run python -m bench.load --students 5000 --concurrency 32
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from .seed import add_scale_arguments, create_bench_app, load_dataset, scale_from_args, seed
+
+SCENARIOS = ('code', 'leaderboard', 'attendance', 'verify')
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+class Client:
+    """One keep-alive HTTP connection."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method: str, path: str, token: str, body: dict | None = None) -> tuple[int, bytes]:
+        headers = {'Authorization': f'Bearer {token}'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, payload, headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+class CodeBook:
+    """
+    The running lectures' current codes, computed here once per window.
+
+    Asking /code instead would stall every verify client at each window
+    boundary and count its statements against /verify. With record=True the
+    codes are also added to this process's code index, as /code does, for an
+    in-process app in CODE_LOOKUP_MODE=memory; a server driven with --url must
+    resolve codes from the shared table (CODE_LOOKUP_MODE=table).
+    """
+
+    def __init__(self, lecture_ids, seed: str, record: bool = False):
+        self.lecture_ids = list(lecture_ids)
+        self.seed = seed
+        self.record = record
+        self.lock = threading.Lock()
+        self.window = None
+        self.codes: dict[int, str] = {}
+
+    def code(self, lecture_id: int) -> str:
+        from app.utils import batch_lecture_codes, current_window, issue_lecture_codes
+
+        window = current_window()
+        with self.lock:
+            if window != self.window:
+                if self.record:
+                    self.codes = issue_lecture_codes(self.lecture_ids, self.seed)
+                else:
+                    codes = batch_lecture_codes(self.lecture_ids, self.seed, range(window, window + 1))
+                    self.codes = {lecture_id: code for lecture_id, (code,) in codes.items()}
+                self.window = window
+            return self.codes.get(lecture_id, '0000')
+
+
+def build_scenarios(dataset, tokens: dict[str, str], codebook: CodeBook) -> dict:
+    """Scenario name -> function returning the next (method, path, token, body); safe across threads."""
+    students = sorted(dataset.students)
+    running_courses = {course: lecture_id for lecture_id, (_, course) in dataset.running.items()}
+    lecturers = sorted({lecturer for lecturer, _ in dataset.running.values()})
+    surge = [(student, running_courses[course]) for student, course in sorted(dataset.students.items())
+             if course in running_courses]
+    random.Random(2).shuffle(surge)
+    surge_order = itertools.cycle(surge)
+    surge_lock = threading.Lock()
+
+    def code(rng):
+        return 'GET', '/code', tokens[rng.choice(lecturers)], None
+
+    def leaderboard(rng):
+        student = rng.choice(students)
+        return 'GET', f'/leaderboard/{dataset.students[student]}', tokens[student], None
+
+    def attendance(rng):
+        return 'GET', '/attendance', tokens[rng.choice(students)], None
+
+    def verify(rng):
+        with surge_lock:
+            student, lecture_id = next(surge_order)
+        return 'POST', '/verify', tokens[student], {'code': codebook.code(lecture_id)}
+
+    scenarios = {'code': code, 'leaderboard': leaderboard, 'attendance': attendance, 'verify': verify}
+    if not lecturers or not surge:
+        del scenarios['code'], scenarios['verify']
+    return scenarios
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_scenario(next_request, address, concurrency: int, warmup: float, duration: float,
+                 query_count) -> dict:
+    """Drive one scenario with `concurrency` threads and summarise the measured window."""
+    start = time.perf_counter() + warmup
+    end = start + duration
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    statuses: list[dict] = [{} for _ in range(concurrency)]
+    ready = threading.Barrier(concurrency + 1)
+    marks = {}
+
+    def worker(n):
+        rng = random.Random(n)
+        client = Client(*address)
+        ready.wait()
+        try:
+            while (now := time.perf_counter()) < end:
+                method, path, token, body = next_request(rng)
+                sent = time.perf_counter()
+                try:
+                    status, _ = client.request(method, path, token, body)
+                except (OSError, http.client.HTTPException):
+                    status = 'error'
+                if now >= start:
+                    latencies[n].append(time.perf_counter() - sent)
+                    statuses[n][status] = statuses[n].get(status, 0) + 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    time.sleep(max(0.0, start - time.perf_counter()))
+    marks['queries'] = query_count()
+    time.sleep(max(0.0, end - time.perf_counter()))
+    queries = query_count()
+    for thread in threads:
+        thread.join()
+
+    measured = sorted(itertools.chain.from_iterable(latencies))
+    codes = {}
+    for counts in statuses:
+        for status, count in counts.items():
+            codes[str(status)] = codes.get(str(status), 0) + count
+    requests = len(measured)
+    result = {
+        'requests': requests,
+        'throughput_rps': requests / duration,
+        'statuses': dict(sorted(codes.items())),
+        'errors': sum(count for status, count in codes.items() if not status.startswith(('2', '3'))),
+        'queries_per_request': None,
+    }
+    if requests:
+        result['latency_ms'] = {
+            'mean': sum(measured) / requests * 1000,
+            'p50': percentile(measured, 50) * 1000,
+            'p95': percentile(measured, 95) * 1000,
+            'p99': percentile(measured, 99) * 1000,
+            'max': measured[-1] * 1000,
+        }
+        if queries is not None and marks['queries'] is not None:
+            result['queries_per_request'] = (queries - marks['queries']) / requests
+    return result
+
+
+class StatementCounter:
+    """Counts the SQL statements an in-process app runs."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self.lock:
+            self.count += 1
+
+    def __call__(self) -> int:
+        return self.count
+
+
+def pg_stat_statements_counter(app):
+    """Statement count of the benchmark database from pg_stat_statements, or None without it."""
+    from sqlalchemy import text
+    from app import db
+
+    query = text("""
+        SELECT coalesce(sum(calls), 0) FROM pg_stat_statements
+        WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+          AND query NOT LIKE '%pg_stat_statements%'
+    """)
+
+    def count():
+        with app.app_context():
+            try:
+                value = db.session.execute(query).scalar()
+                db.session.commit()
+                return int(value)
+            except Exception:
+                db.session.rollback()
+                return None
+
+    return count if count() is not None else (lambda: None)
+
+
+def start_server(app):
+    """Serve the app from a background thread; returns (server, (host, port))."""
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, ('127.0.0.1', server.server_port)
+
+
+def reset_check_ins(app, dataset) -> None:
+    """Unmark the running lectures so each verify run starts with a full surge."""
+    from sqlalchemy import text
+    from app import db
+
+    with app.app_context():
+        db.session.execute(text("UPDATE lecture_attendance SET is_attended = FALSE WHERE lecture_id = ANY(:ids)"),
+                           {'ids': list(dataset.running)})
+        db.session.commit()
+
+
+def mint_tokens(app, dataset) -> dict[str, str]:
+    from types import SimpleNamespace
+    from app.auth import issue_token
+
+    with app.app_context():
+        tokens = {student: issue_token(SimpleNamespace(student_id=student, username=student, is_staff=False))
+                  for student in dataset.students}
+        tokens.update((lecturer, issue_token(SimpleNamespace(student_id=lecturer, username=lecturer,
+                                                             is_staff=True)))
+                      for lecturer in dataset.lecturers)
+    return tokens
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict) -> None:
+    print(f'{"scenario":<13}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"q/req":>8}{"errors":>8}')
+    for name, result in results['scenarios'].items():
+        latency = result.get('latency_ms', {})
+        qpr = result['queries_per_request']
+        print(f'{name:<13}{result["throughput_rps"]:>9.0f}'
+              + ''.join(f'{latency.get(p, float("nan")):>9.1f}' for p in ('p50', 'p95', 'p99'))
+              + (f'{qpr:>8.2f}' if qpr is not None else f'{"-":>8}')
+              + f'{result["errors"]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help='Disposable database to seed and query (default $BENCH_DATABASE_URL)')
+    parser.add_argument('--url', help='Benchmark a running server instead of serving the app in-process')
+    parser.add_argument('--no-seed', action='store_true', help='Reuse the dataset already in the database')
+    add_scale_arguments(parser)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma-separated scenarios to run (default {",".join(SCENARIOS)})')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients (default 16)')
+    parser.add_argument('--duration', type=float, default=10, help='Measured seconds per scenario (default 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds first (default 2)')
+    parser.add_argument('--output', type=Path, help='Results file (default bench/results/<time>.json)')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or BENCH_DATABASE_URL is required')
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    from app import db
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            dataset = load_dataset(conn) if args.no_seed else seed(conn, scale_from_args(args))
+        finally:
+            conn.close()
+    tokens = mint_tokens(app, dataset)
+
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        address = (parts.hostname, parts.port or 80)
+        query_count = pg_stat_statements_counter(app)
+    else:
+        server, address = start_server(app)
+        with app.app_context():
+            query_count = StatementCounter(db.engine)
+
+    codebook = CodeBook(dataset.running, app.config['ATTENDANCE_SECRET_SEED'],
+                        record=server is not None and app.config['CODE_LOOKUP_MODE'] == 'memory')
+    scenarios = build_scenarios(dataset, tokens, codebook)
+    results = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'server': args.url or 'in-process',
+        'settings': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'dataset': {'students': len(dataset.students), 'lecturers': len(dataset.lecturers),
+                        'running_lectures': len(dataset.running)},
+            'scale': None if args.no_seed else vars(scale_from_args(args)),
+            'config': {key: app.config.get(key) for key in (
+                'ATTENDANCE_WRITE_MODE', 'CODE_LOOKUP_MODE', 'RESPONSE_CACHE_ENABLED', 'DB_POOL_SIZE', 'DB_MAX_OVERFLOW',
+            )},
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenarios.split(','):
+            if name not in scenarios:
+                print(f'{name}: skipped, no running lectures in the dataset')
+                continue
+            if name == 'verify':
+                reset_check_ins(app, dataset)
+            print(f'{name}: {args.warmup:g}s warmup + {args.duration:g}s at concurrency {args.concurrency}')
+            results['scenarios'][name] = run_scenario(
+                scenarios[name], address, args.concurrency, args.warmup, args.duration, query_count
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print_results(results)
+    output = args.output or RESULTS_DIR / f'{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + '\n')
+    print(f'results saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
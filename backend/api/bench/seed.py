@@ -0,0 +1,104 @@
+"""
+Benchmark dataset of configurable scale.
+
+Wipes the database it is given and fills it through the bulk generator
+(app/datagen.py): `courses` courses of `modules` modules each, one lecturer per
+module, and `students` students spread evenly over the courses and enrolled in
+every lecture of their course. Each course has `lectures_per_day` hourly
+lectures on weekdays from `weeks` weeks ago to tomorrow, plus one lecture
+running now for the check-in scenarios.
+
+Run on its own (from backend/api) to keep a dataset around between runs:
+    BENCH_DATABASE_URL=postgresql://... python -m bench.seed --students 2000
+"""
+import argparse
+import os
+
+from app.datagen import Generated, Scale, generate
+
+# Smaller than the generator's default so a benchmark run starts quickly
+DEFAULT_STUDENTS = 2000
+
+
+def seed(conn, scale: Scale) -> Generated:
+    """Replace the contents of the database behind a psycopg2 connection with a benchmark dataset."""
+    return generate(conn, scale)
+
+
+def load_dataset(conn) -> Generated:
+    """What an already generated database holds (for runs with --no-seed)."""
+    dataset = Generated()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (la.user_id) la.user_id, m.course_code
+            FROM lecture_attendance la
+            JOIN lectures l ON l.id = la.lecture_id
+            JOIN modules m ON m.id = l.module_id
+            WHERE la.user_id LIKE 'gen\\_s%'
+            ORDER BY la.user_id
+        """)
+        dataset.students = dict(cur.fetchall())
+        cur.execute("""SELECT student_id FROM users WHERE "isStaff" AND student_id LIKE 'gen\\_l%'""")
+        dataset.lecturers = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            SELECT l.id, l.lecturer_id, m.course_code
+            FROM lectures l JOIN modules m ON m.id = l.module_id
+            WHERE l.start_time <= now() AND l.end_time > now() AND l.lecturer_id LIKE 'gen\\_l%'
+        """)
+        dataset.running = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+    conn.rollback()
+    return dataset
+
+
+def add_scale_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Scale()
+    parser.add_argument('--students', type=int, default=DEFAULT_STUDENTS,
+                        help=f'Students (default {DEFAULT_STUDENTS})')
+    parser.add_argument('--courses', type=int, default=defaults.courses,
+                        help=f'Courses (default {defaults.courses})')
+    parser.add_argument('--modules', type=int, default=defaults.modules,
+                        help=f'Modules per course (default {defaults.modules})')
+    parser.add_argument('--weeks', type=int, default=defaults.weeks,
+                        help=f'Weeks of past lectures (default {defaults.weeks})')
+    parser.add_argument('--lectures-per-day', type=int, default=defaults.lectures_per_day,
+                        help=f'Lectures per course per weekday (default {defaults.lectures_per_day})')
+    parser.add_argument('--attendance-rate', type=float, default=defaults.attendance_rate,
+                        help=f'Share of past lectures attended (default {defaults.attendance_rate})')
+
+
+def scale_from_args(args) -> Scale:
+    return Scale(students=args.students, courses=args.courses, modules=args.modules, weeks=args.weeks,
+                 lectures_per_day=args.lectures_per_day, attendance_rate=args.attendance_rate)
+
+
+def create_bench_app(database_url: str):
+    """The Flask app on the benchmark database, without background tasks."""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['BACKGROUND_TASKS'] = 'false'
+    from app import create_app
+
+    return create_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help='Database to wipe and fill (default $BENCH_DATABASE_URL)')
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or BENCH_DATABASE_URL is required')
+
+    from app import db
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            seed(conn, scale_from_args(args))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
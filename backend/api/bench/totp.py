@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-call pyotp code generation vs the batch HMAC engine.
+
+The per-call path is what generate_lecture_code/verify_lecture_code did before
+the key cache: SHA-256 of "seed_lectureid", base32-encode, build a pyotp.TOTP
+and generate one code, for every lecture on every call.
+
+Usage (from backend/api):
+    poetry run python -m bench.totp --lectures 10000 --windows 4
+"""
+import argparse
+import base64
+import hashlib
+import time
+
+import pyotp
+
+from app.utils import CODE_INTERVAL, _lecture_key, batch_lecture_codes, current_window
+
+
+def per_call_code(lecture_id: int, seed: str, window: int) -> str:
+    """The original per-call code path, kept here as the baseline."""
+    combined_secret = f"{seed}_{lecture_id}"
+    hashed = hashlib.sha256(combined_secret.encode()).digest()
+    secret = base64.b32encode(hashed).decode('utf-8')
+    totp = pyotp.TOTP(secret, interval=CODE_INTERVAL, digits=4)
+    return totp.generate_otp(window)
+
+
+def best_of(repeat: int, func) -> float:
+    """Run func `repeat` times and return the fastest wall-clock time in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lectures', type=int, default=10_000, help='Number of lectures (default 10000)')
+    parser.add_argument('--windows', type=int, default=4, help='Windows per lecture (default 4)')
+    parser.add_argument('--repeat', type=int, default=5, help='Take the best of N runs (default 5)')
+    args = parser.parse_args()
+
+    seed = 'bench-seed'
+    lecture_ids = range(1, args.lectures + 1)
+    first = current_window()
+    windows = range(first, first + args.windows)
+    total = args.lectures * args.windows
+
+    # Sanity check: both paths must agree before timing them
+    batch = batch_lecture_codes(lecture_ids, seed, windows)
+    assert all(batch[lid][0] == per_call_code(lid, seed, first) for lid in lecture_ids)
+
+    def run_per_call():
+        for lid in lecture_ids:
+            for w in windows:
+                per_call_code(lid, seed, w)
+
+    def run_batch_cold():
+        _lecture_key.cache_clear()
+        batch_lecture_codes(lecture_ids, seed, windows)
+
+    def run_batch_warm():
+        batch_lecture_codes(lecture_ids, seed, windows)
+
+    results = [
+        ('per-call pyotp', best_of(args.repeat, run_per_call)),
+        ('batch (cold key cache)', best_of(args.repeat, run_batch_cold)),
+        ('batch (warm key cache)', best_of(args.repeat, run_batch_warm)),
+    ]
+
+    baseline = results[0][1]
+    print(f'{args.lectures} lectures x {args.windows} windows = {total} codes, best of {args.repeat}')
+    print(f'{"path":<26}{"total ms":>10}{"us/code":>10}{"speedup":>10}')
+    for name, seconds in results:
+        print(f'{name:<26}{seconds * 1000:>10.1f}{seconds / total * 1e6:>10.2f}{baseline / seconds:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
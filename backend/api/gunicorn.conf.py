@@ -0,0 +1,71 @@
+"""
+gunicorn settings for the API (run from backend/api: `gunicorn -c gunicorn.conf.py`).
+
+Everything can be overridden from the environment:
+
+  PORT                         Port to listen on (default 5000)
+  WEB_CONCURRENCY              Worker processes (default: CPU count)
+  GUNICORN_WORKER_CLASS        'gthread' (sync threads, default) or 'gevent' (cooperative)
+  GUNICORN_THREADS             Threads per gthread worker (default 8)
+  GUNICORN_WORKER_CONNECTIONS  Concurrent requests per gevent worker (default 500)
+  GUNICORN_TIMEOUT             Seconds before a stuck worker is killed and replaced (default 30)
+  GUNICORN_GRACEFUL_TIMEOUT    Seconds a worker gets to drain in-flight requests on restart/shutdown (default 30)
+  GUNICORN_MAX_REQUESTS        Recycle a worker after this many requests, 0 to disable (default 10000)
+
+The app is preloaded in the master and workers are forked from it. Send HUP
+to reload workers gracefully or TERM to drain and stop.
+
+A stream (/code/stream, /attendance/live) would hold a gthread thread for up
+to an hour, so gthread workers answer them with 503 unless WSGI_STREAM_LIMIT
+is set; serve them from asgi.py instead (see app/sse.py).
+"""
+import multiprocessing
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, so every lock, socket and thread it
+    # creates is cooperative, and make psycopg2 yield while waiting on Postgres
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))
+
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+# Spread recycling so workers do not all restart at once
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Start metrics from zero: drop snapshots (app/metrics.py) left by a previous run."""
+    from pathlib import Path
+
+    directory = os.getenv('METRICS_DIR')
+    if directory:
+        for path in Path(directory).glob('*.json'):
+            path.unlink(missing_ok=True)
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master; each worker opens its own."""
+    from wsgi import app
+    from app import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -1,13 +1,15 @@
+"""
+Development server. Production uses gunicorn (see gunicorn.conf.py).
+
+Create the schema first with `flask --app wsgi init-db`.
+"""
 import os
 from dotenv import load_dotenv
-from app import create_app, db
+from app import create_app
 
 load_dotenv()
 
 app = create_app()
 
-with app.app_context():
-    db.create_all()  # create tables
-
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true', host='0.0.0.0', port=5000)
@@ -0,0 +1,809 @@
+"""
+Behaviour tests for the check-in path (/code, /code/stream, /attendance/live
+and /verify), run against both the WSGI app and the asyncio app (app/aio.py).
+
+Most need a disposable PostgreSQL database and are skipped without one:
+    TEST_DATABASE_URL=postgresql://... python -m pytest test_checkin.py
+The schema is applied from db/init.sql and the test rows are removed after.
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+LECTURER = 'test_lecturer'
+ENROLLED = 'test_student_a'
+NOT_ENROLLED = 'test_student_b'
+INIT_SQL = Path(__file__).resolve().parent.parent / 'db' / 'init.sql'
+
+
+@pytest.fixture(scope='module')
+def flask_app():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL not set')
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    os.environ['BACKGROUND_TASKS'] = 'false'
+    os.environ['HASH_POOL_WORKERS'] = '0'
+    os.environ['WSGI_STREAM_LIMIT'] = '1'
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+    # A route over its query budget fails the test that made the request
+    os.environ['QUERY_BUDGET_MODE'] = 'raise'
+    os.environ['METRICS_TOKEN'] = 'test-metrics-token'
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    app.testing = True
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        with conn.cursor() as cur:
+            cur.execute(INIT_SQL.read_text())
+        conn.commit()
+        conn.close()
+
+        now = datetime.now(timezone.utc)
+        db.session.execute(text("""
+            INSERT INTO users (student_id, username, password, "isStaff")
+            VALUES (:lecturer, :lecturer, '-', TRUE), (:a, :a, '-', FALSE), (:b, :b, '-', FALSE)
+        """), {'lecturer': LECTURER, 'a': ENROLLED, 'b': NOT_ENROLLED})
+        db.session.execute(text(
+            "INSERT INTO courses (code, name) VALUES ('TEST', 'Test Course'), ('TEST2', 'Other Test Course')"
+        ))
+        module_id = db.session.execute(text(
+            "INSERT INTO modules (name, course_code) VALUES ('Test Module', 'TEST') RETURNING id"
+        )).scalar()
+        lecture_id = db.session.execute(text("""
+            INSERT INTO lectures (module_id, lecturer_id, start_time, end_time)
+            VALUES (:module_id, :lecturer, :start, :end) RETURNING id
+        """), {'module_id': module_id, 'lecturer': LECTURER,
+               'start': now - timedelta(minutes=10), 'end': now + timedelta(minutes=50)}).scalar()
+        db.session.execute(text("INSERT INTO lecture_attendance (user_id, lecture_id) VALUES (:a, :lecture_id)"),
+                           {'a': ENROLLED, 'lecture_id': lecture_id})
+        db.session.commit()
+        app.config['TEST_LECTURE_ID'] = lecture_id
+
+    yield app
+
+    with app.app_context():
+        for statement in (
+            "DELETE FROM course_leaderboard WHERE course_code IN ('TEST', 'TEST2')",
+            "DELETE FROM course_stats WHERE course_code IN ('TEST', 'TEST2')",
+            "DELETE FROM lecture_attendance WHERE user_id IN (:lecturer, :a, :b)",
+            "DELETE FROM lectures WHERE lecturer_id = :lecturer",
+            "DELETE FROM modules WHERE course_code = 'TEST'",
+            "DELETE FROM courses WHERE code IN ('TEST', 'TEST2')",
+            "DELETE FROM users WHERE student_id IN (:lecturer, :a, :b)",
+        ):
+            db.session.execute(text(statement), {'lecturer': LECTURER, 'a': ENROLLED, 'b': NOT_ENROLLED})
+        db.session.commit()
+
+
+class SyncClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, token=None, json=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.client.open(path, method=method, headers=headers, json=json)
+        return response.status_code, response.get_json()
+
+    def stream(self, path, token):
+        response = self.client.get(path, headers={'Authorization': f'Bearer {token}'})
+        text = response.get_data(as_text=True)
+        response.close()
+        return response.status_code, text
+
+
+class AsyncClient:
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, path, token=None, json=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.client.request(method, path, headers=headers, json=json)
+        return response.status_code, response.json()
+
+    def stream(self, path, token):
+        response = self.client.get(path, headers={'Authorization': f'Bearer {token}'})
+        return response.status_code, response.text
+
+
+@pytest.fixture(params=['sync', 'async'])
+def client(request, flask_app):
+    from sqlalchemy import text
+    from app import db
+
+    # Every test starts from an unmarked lecture and zero streaks
+    with flask_app.app_context():
+        db.session.execute(text(
+            "UPDATE lecture_attendance SET is_attended = FALSE WHERE user_id = :a"
+        ), {'a': ENROLLED})
+        db.session.execute(text(
+            "UPDATE users SET current_streak = 0, longest_streak = 0 WHERE student_id = :a"
+        ), {'a': ENROLLED})
+        db.session.commit()
+
+    if request.param == 'sync':
+        yield SyncClient(flask_app)
+    else:
+        from starlette.testclient import TestClient
+        from app.aio import create_asgi_app
+
+        with TestClient(create_asgi_app(flask_app)) as test_client:
+            yield AsyncClient(test_client)
+
+
+@pytest.fixture(scope='module')
+def tokens(flask_app):
+    from app import db
+    from app.auth import issue_token
+    from app.models import Users
+
+    with flask_app.app_context():
+        return {
+            student_id: issue_token(db.session.get(Users, student_id))
+            for student_id in (LECTURER, ENROLLED, NOT_ENROLLED)
+        }
+
+
+def current_code(client, tokens, flask_app):
+    status, body = client.request('GET', '/code', tokens[LECTURER])
+    assert status == 200
+    lecture = next(l for l in body['lectures'] if l['lecture_id'] == flask_app.config['TEST_LECTURE_ID'])
+    return lecture['code']
+
+
+def test_requires_authentication(client):
+    assert client.request('GET', '/code')[0] == 401
+    assert client.request('POST', '/verify', json={'code': '1234'})[0] == 401
+    assert client.request('POST', '/verify', 'not-a-token', json={'code': '1234'})[0] == 401
+
+
+def test_code_is_for_staff_only(client, tokens):
+    status, body = client.request('GET', '/code', tokens[ENROLLED])
+    assert status == 403
+    assert body == {'error': 'Only lecturers can access this endpoint'}
+
+
+def test_code_lists_current_lectures(client, tokens, flask_app):
+    status, body = client.request('GET', '/code', tokens[LECTURER])
+    assert status == 200
+    assert body['success'] is True
+    lecture = next(l for l in body['lectures'] if l['lecture_id'] == flask_app.config['TEST_LECTURE_ID'])
+    assert lecture['module_name'] == 'Test Module'
+    assert len(lecture['code']) == 4 and lecture['code'].isdigit()
+
+
+def test_code_stream_pushes_codes(client, tokens, flask_app, monkeypatch):
+    import json
+
+    # End the stream after its first event
+    monkeypatch.setitem(flask_app.config, 'CODE_STREAM_MAX_SECONDS', 0.001)
+    code = current_code(client, tokens, flask_app)
+
+    status, text = client.stream('/code/stream', tokens[LECTURER])
+    assert status == 200
+    fields = dict(line.split(': ', 1) for line in text.strip().splitlines())
+    assert fields['retry'] == '1000'
+    assert fields['event'] == 'code'
+    body = json.loads(fields['data'])
+    lecture = next(l for l in body['lectures'] if l['lecture_id'] == flask_app.config['TEST_LECTURE_ID'])
+    valid_until = datetime.fromisoformat(body['valid_until']).timestamp()
+    assert valid_until % 30 == 0
+    if valid_until - datetime.now(timezone.utc).timestamp() > 1:
+        assert lecture['code'] == code
+
+    assert client.stream('/code/stream', tokens[ENROLLED])[0] == 403
+
+
+def test_live_counts_follow_check_ins(client, tokens, flask_app, monkeypatch):
+    import json
+    import threading
+    from app import db
+    from app.live_counts import RECOUNT_ATTENDANCE
+
+    monkeypatch.setitem(flask_app.config, 'LIVE_COUNTS_MAX_SECONDS', 1.5)
+    lecture_id = flask_app.config['TEST_LECTURE_ID']
+    code = current_code(client, tokens, flask_app)
+
+    def check_in():
+        time.sleep(0.5)
+        client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})
+
+    checker = threading.Thread(target=check_in)
+    checker.start()
+    status, text = client.stream('/attendance/live', tokens[LECTURER])
+    checker.join()
+    assert status == 200
+
+    counts = [
+        next(l for l in json.loads(line[len('data: '):])['lectures'] if l['lecture_id'] == lecture_id)
+        for line in text.splitlines() if line.startswith('data: ')
+    ]
+    assert [(c['attended'], c['enrolled']) for c in counts] == [(0, 1), (1, 1)]
+    with flask_app.app_context():
+        recount = db.session.execute(RECOUNT_ATTENDANCE, {'lecture_ids': [lecture_id]}).one()
+        db.session.commit()
+    assert (recount.attended, recount.enrolled) == (1, 1)
+
+
+def test_wsgi_streams_are_capped_per_worker(tokens, flask_app, monkeypatch):
+    from app.sse import StreamSlots
+
+    slots = StreamSlots(1)
+    monkeypatch.setitem(flask_app.extensions, 'stream_slots', slots)
+    client = flask_app.test_client()
+    headers = {'Authorization': f'Bearer {tokens[LECTURER]}'}
+
+    held = client.get('/code/stream', headers=headers, buffered=False)
+    assert held.status_code == 200
+    for path in ('/code/stream', '/attendance/live'):
+        refused = client.get(path, headers=headers)
+        assert refused.status_code == 503
+        assert 'poll /code' in refused.get_json()['error']
+    assert slots.stats() == {'limit': 1, 'open': 1, 'refused': 2}
+
+    # Closing the stream frees its slot, even before any event was sent
+    held.close()
+    assert slots.stats()['open'] == 0
+    live = client.get('/attendance/live', headers=headers, buffered=False)
+    assert live.status_code == 200
+    live.close()
+
+    # gthread workers serve no streams by default
+    monkeypatch.setitem(flask_app.extensions, 'stream_slots', StreamSlots(0))
+    assert client.get('/code/stream', headers=headers).status_code == 503
+
+
+def test_async_reference_data_reloads_off_the_event_loop(tokens, flask_app, monkeypatch):
+    import asyncio
+    from starlette.testclient import TestClient
+    from app.aio import create_asgi_app
+    from app.refdata import ReferenceData
+
+    reloads = []
+    refresh = ReferenceData.refresh
+
+    def recording_refresh(self, *args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            reloads.append('event loop')
+        except RuntimeError:
+            reloads.append('thread')
+        return refresh(self, *args, **kwargs)
+
+    monkeypatch.setattr(ReferenceData, 'refresh', recording_refresh)
+    with TestClient(create_asgi_app(flask_app)) as test_client:
+        # A module created since the last reload
+        refdata = flask_app.extensions['reference_data']
+        refdata._snapshot = refdata._snapshot._replace(modules={}, versions={})
+        refdata._last_check = 0
+        status, body = AsyncClient(test_client).request('GET', '/code', tokens[LECTURER])
+
+    assert status == 200
+    lecture = next(l for l in body['lectures'] if l['lecture_id'] == flask_app.config['TEST_LECTURE_ID'])
+    assert lecture['module_name'] == 'Test Module'
+    assert reloads and 'event loop' not in reloads
+
+def test_verify_marks_attendance_once(client, tokens, flask_app):
+    code = current_code(client, tokens, flask_app)
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})
+    assert status == 200
+    assert body['already_attended'] is False
+    assert body['lecture_id'] == flask_app.config['TEST_LECTURE_ID']
+    assert body['module_name'] == 'Test Module'
+    assert (body['current_streak'], body['longest_streak']) == (1, 1)
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})
+    assert status == 200
+    assert body['already_attended'] is True
+    assert body['message'] == 'Attendance already marked'
+
+
+def test_staff_check_ins_stay_off_the_leaderboard(client, tokens, flask_app):
+    from sqlalchemy import text
+    from app import db
+
+    params = {'lecturer': LECTURER, 'lecture_id': flask_app.config['TEST_LECTURE_ID']}
+    with flask_app.app_context():
+        db.session.execute(text(
+            "INSERT INTO lecture_attendance (user_id, lecture_id) VALUES (:lecturer, :lecture_id)"
+        ), params)
+        db.session.commit()
+    try:
+        code = current_code(client, tokens, flask_app)
+        status, body = client.request('POST', '/verify', tokens[LECTURER], json={'code': code})
+        assert status == 200
+        assert body['already_attended'] is False
+        with flask_app.app_context():
+            rows = db.session.execute(text(
+                "SELECT count(*) FROM course_leaderboard WHERE student_id = :lecturer"
+            ), params).scalar()
+            db.session.commit()
+        assert rows == 0
+    finally:
+        with flask_app.app_context():
+            db.session.execute(text(
+                "DELETE FROM lecture_attendance WHERE user_id = :lecturer AND lecture_id = :lecture_id"
+            ), params)
+            db.session.execute(text(
+                "UPDATE users SET current_streak = 0, longest_streak = 0 WHERE student_id = :lecturer"
+            ), params)
+            db.session.commit()
+
+def test_verify_rejects_students_not_enrolled(client, tokens, flask_app):
+    code = current_code(client, tokens, flask_app)
+    status, body = client.request('POST', '/verify', tokens[NOT_ENROLLED], json={'code': code})
+    assert status == 404
+    assert body['message'] == 'Student is not enrolled in this lecture'
+
+
+def test_verify_rejects_bad_codes(client, tokens, flask_app):
+    code = current_code(client, tokens, flask_app)
+    wrong = '0000' if code != '0000' else '0001'
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': wrong})
+    assert status == 400
+    assert body['message'] == 'Invalid or expired code'
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': '12'})
+    assert status == 400
+    assert body['message'] == 'Invalid code format. Code must be 4 digits.'
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={})
+    assert status == 400
+    assert body['message'] == 'No data provided'
+
+
+def cached_get(flask_app, path, token, etag=None):
+    headers = {'Authorization': f'Bearer {token}'}
+    if etag:
+        headers['If-None-Match'] = f'"{etag}"'
+    return flask_app.test_client().get(path, headers=headers)
+
+
+def test_cached_reads_revalidate_with_etags(tokens, flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'RESPONSE_CACHE_ENABLED', True)
+
+    first = cached_get(flask_app, '/courses', tokens[ENROLLED])
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.get_etag()[0]
+
+    again = cached_get(flask_app, '/courses', tokens[ENROLLED], etag)
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.get_etag()[0] == etag
+
+    stale = cached_get(flask_app, '/courses', tokens[ENROLLED], 'not-the-etag')
+    assert stale.status_code == 200
+    assert stale.get_json() == first.get_json()
+
+
+def test_cached_reads_are_per_caller(tokens, flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'RESPONSE_CACHE_ENABLED', True)
+
+    mine = cached_get(flask_app, '/leaderboard/TEST', tokens[ENROLLED])
+    assert mine.status_code == 200
+    assert mine.get_json()['currentUserId'] == ENROLLED
+
+    # Same path, another caller: neither the body nor the ETag carries over
+    theirs = cached_get(flask_app, '/leaderboard/TEST', tokens[NOT_ENROLLED], mine.get_etag()[0])
+    assert theirs.status_code == 200
+    assert theirs.get_json()['currentUserId'] == NOT_ENROLLED
+
+
+def test_check_in_invalidates_cached_reads(client, tokens, flask_app, monkeypatch):
+    from sqlalchemy import text
+    from app import db
+    from app.cache import CACHE_TOPIC, ResponseCache, course_tag, invalidate_courses, invalidate_users, user_tag
+    from app.pubsub import BUS_CONNECTED, get_event_bus
+
+    monkeypatch.setitem(flask_app.config, 'RESPONSE_CACHE_ENABLED', True)
+    with flask_app.app_context():
+        # The student is also on another course's leaderboard
+        db.session.execute(text("DELETE FROM course_leaderboard WHERE student_id = :a"), {'a': ENROLLED})
+        db.session.execute(text(
+            "INSERT INTO course_leaderboard (course_code, student_id, attended, streak) VALUES ('TEST2', :a, 0, 0)"
+        ), {'a': ENROLLED})
+        db.session.commit()
+        # The fixtures reset rows behind the cache's back
+        invalidate_users(ENROLLED)
+        invalidate_courses('TEST', 'TEST2')
+
+    def streaks():
+        user = cached_get(flask_app, f'/user/{ENROLLED}', tokens[ENROLLED]).get_json()
+        other = cached_get(flask_app, '/leaderboard/TEST2', tokens[ENROLLED]).get_json()
+        return user['current_streak'], other['currentUser']['streak']
+
+    # Another worker's cache on the same event bus
+    with flask_app.app_context():
+        bus = get_event_bus()
+    other_worker = ResponseCache()
+    other_worker.listen(bus)
+    tags = [user_tag(ENROLLED), course_tag('TEST2')]
+    before = other_worker.versions(tags)
+
+    try:
+        assert streaks() == (0, 0)
+        code = current_code(client, tokens, flask_app)
+        assert client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})[0] == 200
+        assert streaks() == (1, 1)
+        assert all(after > was for after, was in zip(other_worker.versions(tags), before))
+    finally:
+        bus.unsubscribe(other_worker, CACHE_TOPIC, BUS_CONNECTED)
+
+
+def test_invalidations_reach_every_worker():
+    from app.cache import CACHE_TOPIC, ResponseCache, user_tag
+    from app.pubsub import BUS_CONNECTED, EventBus
+
+    bus = EventBus()
+    this_worker, other_worker = ResponseCache(), ResponseCache()
+    this_worker.listen(bus)
+    other_worker.listen(bus)
+    tags = [user_tag(ENROLLED)]
+    other_worker.put('/attendance', b'{}', other_worker.versions(tags))
+    this_worker.put('/attendance', b'{}', this_worker.versions(tags))
+
+    this_worker.invalidate(*tags)
+    bus.publish(CACHE_TOPIC, {'origin': this_worker.origin, 'tags': [list(tag) for tag in tags]})
+    assert other_worker.get('/attendance', tags) is None
+    # Its own message comes back on the bus without bumping the version again
+    assert this_worker.versions(tags) == other_worker.versions(tags) == (1,)
+
+    # Invalidations missed while the listener was disconnected
+    other_worker.put('/attendance', b'{}', other_worker.versions(tags))
+    bus.publish(BUS_CONNECTED, {})
+    assert other_worker.get('/attendance', tags) is None
+
+
+def test_buffered_check_in_is_flushed(client, tokens, flask_app, tmp_path, monkeypatch):
+    from sqlalchemy import text
+    from app import db
+    from app.attendance_log import flush_attendance_log, get_attendance_log
+
+    monkeypatch.setitem(flask_app.config, 'ATTENDANCE_WRITE_MODE', 'buffered')
+    monkeypatch.setitem(flask_app.config, 'ATTENDANCE_LOG_PATH', str(tmp_path / 'attendance.sqlite3'))
+    monkeypatch.delitem(flask_app.extensions, 'attendance_log', raising=False)
+    code = current_code(client, tokens, flask_app)
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})
+    assert status == 200
+    assert body['already_attended'] is False
+    assert (body['current_streak'], body['longest_streak']) == (1, 1)
+
+    status, body = client.request('POST', '/verify', tokens[ENROLLED], json={'code': code})
+    assert status == 200
+    assert body['already_attended'] is True
+
+    attendance = text("""
+        SELECT la.is_attended, u.current_streak
+        FROM lecture_attendance la JOIN users u ON u.student_id = la.user_id
+        WHERE la.user_id = :a AND la.lecture_id = :lecture_id
+    """)
+    params = {'a': ENROLLED, 'lecture_id': flask_app.config['TEST_LECTURE_ID']}
+    with flask_app.app_context():
+        assert tuple(db.session.execute(attendance, params).one()) == (False, 0)
+        db.session.commit()
+
+        flush_attendance_log()
+        assert tuple(db.session.execute(attendance, params).one()) == (True, 1)
+        assert get_attendance_log().stats()['pending'] == 0
+
+
+def test_close_out_ranks_students_who_never_checked_in(tokens, flask_app):
+    from sqlalchemy import text
+    from app import db
+    from app.streaks import close_ended_lectures
+
+    now = datetime.now(timezone.utc)
+    with flask_app.app_context():
+        lecture_id = db.session.execute(text("""
+            INSERT INTO lectures (module_id, lecturer_id, start_time, end_time)
+            SELECT module_id, lecturer_id, :start, :end FROM lectures WHERE id = :current
+            RETURNING id
+        """), {'current': flask_app.config['TEST_LECTURE_ID'],
+               'start': now - timedelta(hours=2), 'end': now - timedelta(hours=1)}).scalar()
+        db.session.execute(text("INSERT INTO lecture_attendance (user_id, lecture_id) VALUES (:b, :lecture_id)"),
+                           {'b': NOT_ENROLLED, 'lecture_id': lecture_id})
+        db.session.commit()
+        close_ended_lectures(now)
+
+    status, body = SyncClient(flask_app).request('GET', '/leaderboard/TEST', tokens[NOT_ENROLLED])
+    assert status == 200
+    assert body['totalLectures'] == 1
+    assert body['currentUser']['id'] == NOT_ENROLLED
+    assert body['currentUser']['attended'] == 0
+
+
+def test_close_out_waits_for_a_batch_in_flight(flask_app):
+    from sqlalchemy import text
+    from app import db
+    from app.queries import CLOSEOUT_LOCK, CLOSEOUT_LOCK_KEY
+    from app.streaks import close_ended_lectures
+
+    now = datetime.now(timezone.utc)
+    closed_at = text("SELECT closed_at FROM lectures WHERE id = :id")
+    with flask_app.app_context():
+        lecture_id = db.session.execute(text("""
+            INSERT INTO lectures (module_id, lecturer_id, start_time, end_time)
+            SELECT module_id, lecturer_id, :start, :end FROM lectures WHERE id = :current
+            RETURNING id
+        """), {'current': flask_app.config['TEST_LECTURE_ID'],
+               'start': now - timedelta(hours=4), 'end': now - timedelta(hours=3)}).scalar()
+        db.session.commit()
+
+        # Another worker is closing a batch
+        with db.engine.connect() as other, other.begin():
+            assert other.execute(CLOSEOUT_LOCK, {'key': CLOSEOUT_LOCK_KEY}).scalar()
+            close_ended_lectures(now)
+            assert db.session.execute(closed_at, {'id': lecture_id}).scalar() is None
+            db.session.commit()
+
+        close_ended_lectures(now)
+        assert db.session.execute(closed_at, {'id': lecture_id}).scalar() is not None
+        db.session.commit()
+
+
+def test_buffered_check_in_racing_a_flush_is_a_duplicate(tmp_path):
+    from app.attendance_log import AttendanceLog, CheckInResult, buffer_check_in
+
+    log = AttendanceLog(str(tmp_path / 'attendance.sqlite3'))
+    # Both requests read CHECK_IN_STATUS before the flush committed
+    status = CheckInResult(1, 42, 'Test Module', 'TEST', False, 0, 0, [])
+
+    assert buffer_check_in(log, ENROLLED, status).already_attended is False
+    (last_id, _, _), = log.pending(10)
+    log.discard(last_id)
+
+    result = buffer_check_in(log, ENROLLED, status)
+    assert result.already_attended is True
+    assert log.stats()['pending'] == 0
+    assert buffer_check_in(log, NOT_ENROLLED, status).already_attended is False
+
+
+def test_metrics_count_requests_and_queries(tokens, flask_app):
+    client = SyncClient(flask_app)
+    assert client.request('GET', '/code', tokens[LECTURER])[0] == 200
+
+    assert flask_app.test_client().get('/metrics').status_code == 401
+    response = flask_app.test_client().get('/metrics', headers={'Authorization': 'Bearer test-metrics-token'})
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    lines = response.get_data(as_text=True).splitlines()
+    assert any(line.startswith('registreak_http_requests_total{route="/code",method="GET",status="200"} ')
+               for line in lines)
+    count = next(line for line in lines
+                 if line.startswith('registreak_db_queries_per_request_count{route="/code",method="GET"}'))
+    assert float(count.split()[-1]) >= 1
+    assert any(line.startswith('registreak_db_pool_checked_out{pid=') for line in lines)
+
+
+def test_query_budget_catches_repeated_statements(tokens, flask_app, monkeypatch):
+    from flask import jsonify
+    from sqlalchemy import text
+    from app import db, routes
+    from app.query_budget import QueryBudgetExceeded
+
+    def lazy_loads(lecturer_id):
+        for lecture_id in (1, 2):
+            db.session.execute(text('SELECT module_id FROM lectures WHERE id = :id'), {'id': lecture_id}).all()
+        return jsonify(success=True)
+
+    monkeypatch.setattr(routes, 'get_lecturer_current_lectures', lazy_loads)
+    with pytest.raises(QueryBudgetExceeded, match='ran 2 times'):
+        SyncClient(flask_app).request('GET', '/code', tokens[LECTURER])
+
+
+def test_leaderboard_budget_covers_its_fallback_and_a_revocation_check(flask_app):
+    from sqlalchemy import text
+    from app import db
+    from app.auth import issue_token, revoke_user_tokens
+    from app.models import Users
+
+    student = 'test_student_c'
+    with flask_app.app_context():
+        db.session.execute(text("""
+            INSERT INTO users (student_id, username, password) VALUES (:c, :c, '-')
+        """), {'c': student})
+        # An empty board reads the lecture total with a second query
+        db.session.execute(text("DELETE FROM course_leaderboard WHERE course_code = 'TEST'"))
+        db.session.commit()
+        revoke_user_tokens(student)
+    try:
+        # Issued after the revocation (iat has whole seconds), so the filter
+        # suspects it and the revocation query clears it
+        time.sleep(1.1)
+        with flask_app.app_context():
+            token = issue_token(db.session.get(Users, student))
+        status, body = SyncClient(flask_app).request('GET', '/leaderboard/TEST', token)
+        assert status == 200
+        assert body['students'] == []
+    finally:
+        with flask_app.app_context():
+            db.session.execute(text("DELETE FROM revoked_tokens WHERE key = :key"), {'key': f'user:{student}'})
+            db.session.execute(text("DELETE FROM users WHERE student_id = :c"), {'c': student})
+            db.session.commit()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    from app.auth import BloomFilter
+
+    bloom = BloomFilter(1000, error_rate=0.01)
+    added = [f'token:{i}' for i in range(1000)]
+    for key in added:
+        bloom.add(key)
+
+    assert all(key in bloom for key in added)
+    assert bloom.count == 1000
+    false_positives = sum(f'user:{i}' in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_token_verifier_settles_revocations(monkeypatch):
+    from types import SimpleNamespace
+    import jwt
+    from app import auth
+
+    now = datetime.now(timezone.utc)
+    # Stands in for revoked_tokens, which stamps each row with the revocation time
+    revoked_at = now - timedelta(seconds=30)
+    table = {}
+    session = SimpleNamespace(
+        execute=lambda statement, params: table.__setitem__(params['key'], revoked_at),
+        commit=lambda: None,
+    )
+    monkeypatch.setattr(auth, 'db', SimpleNamespace(session=session))
+    verifier = auth.TokenVerifier('test-secret', revocation_capacity=100)
+
+    def issue(student_id, issued_at):
+        payload = {'student_id': student_id, 'iat': issued_at, 'exp': now + timedelta(hours=1)}
+        return jwt.encode(payload, 'test-secret', algorithm='HS256')
+
+    def suspects(token):
+        digest, entry = verifier.lookup(token)
+        return verifier.revocation_suspects(digest, entry)[0]
+
+    def revoked(token):
+        """What verify() decides, with REVOCATION_QUERY answered from the table."""
+        digest, entry = verifier.lookup(token)
+        keys, generation = verifier.revocation_suspects(digest, entry)
+        rows = [SimpleNamespace(key=key, revoked_at=table[key]) for key in keys if key in table]
+        return bool(keys) and verifier.settle_revocation(entry, generation, rows)
+
+    logged_out = issue(NOT_ENROLLED, now - timedelta(minutes=1))
+    other_device = issue(NOT_ENROLLED, now - timedelta(minutes=2))
+    before_deletion = issue(ENROLLED, now - timedelta(minutes=1))
+    after_deletion = issue(ENROLLED, now)
+    assert not any(revoked(token) for token in (logged_out, other_device, before_deletion, after_deletion))
+
+    monkeypatch.setattr(auth, 'get_token_verifier', lambda: verifier)
+    auth.revoke_token(logged_out, jwt.decode(logged_out, 'test-secret', algorithms=['HS256']))
+    verifier.revoke(auth.user_key(ENROLLED), now + timedelta(hours=1))
+
+    assert revoked(logged_out)
+    assert not revoked(other_device)
+    assert revoked(before_deletion)
+    # Issued after the user-wide revocation: suspected by the filter, cleared
+    # by the query, and not queried again until the filter changes
+    assert suspects(after_deletion) == [auth.user_key(ENROLLED)]
+    assert not revoked(after_deletion)
+    assert suspects(after_deletion) == []
+
+
+@pytest.fixture
+def account(flask_app):
+    """A freshly registered student, removed after the test with its revocations."""
+    from sqlalchemy import text
+    from app import db
+    from app.auth import token_digest, token_key, user_key
+
+    student = 'test_student_d'
+    status, body = SyncClient(flask_app).request(
+        'POST', '/account/register', json={'username': student, 'password': 'correct horse'},
+    )
+    assert status == 201
+    yield student, body['token']
+
+    with flask_app.app_context():
+        db.session.execute(text("DELETE FROM revoked_tokens WHERE key = ANY(:keys)"),
+                           {'keys': [user_key(student), token_key(token_digest(body['token']))]})
+        db.session.execute(text("DELETE FROM users WHERE student_id = :d"), {'d': student})
+        db.session.commit()
+
+
+def test_logout_revokes_the_token(client, account, flask_app):
+    student, token = account
+    assert client.request('POST', '/verify', token, json={'code': '12'})[0] == 400
+
+    status, body = SyncClient(flask_app).request('POST', '/account/logout', token)
+    assert status == 200
+    assert client.request('POST', '/verify', token, json={'code': '12'})[0] == 401
+    assert SyncClient(flask_app).request('GET', f'/user/{student}', token)[0] == 401
+
+
+def test_account_deletion_revokes_every_token(client, account, flask_app):
+    student, token = account
+    sync = SyncClient(flask_app)
+
+    status, body = sync.request('DELETE', '/account/delete', token, json={'password': 'correct horse'})
+    assert status == 200
+    assert client.request('POST', '/verify', token, json={'code': '12'})[0] == 401
+
+    # Registering the same id again (iat has whole seconds) gets a working token
+    time.sleep(1.1)
+    status, body = sync.request('POST', '/account/register', json={'username': student, 'password': 'correct horse'})
+    assert status == 201
+    assert client.request('POST', '/verify', body['token'], json={'code': '12'})[0] == 400
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_hashing_pool_rejects_beyond_its_queue():
+    from threading import Thread
+    from app.hashing import HashingBusy, PasswordHasher
+
+    hasher = PasswordHasher(workers=1, queue_depth=1, retry_after=3)
+    pw_hash = hasher.generate('correct horse')
+    # One job running and one waiting take every slot
+    holders = [Thread(target=hasher._run, args=(time.sleep, 1)) for _ in range(2)]
+    for thread in holders:
+        thread.start()
+    wait_for(lambda: hasher.in_flight == 2)
+
+    with pytest.raises(HashingBusy) as busy:
+        hasher.check(pw_hash, 'correct horse')
+    assert busy.value.retry_after == 3
+    assert hasher.stats()['rejected'] == 1
+
+    for thread in holders:
+        thread.join()
+    wait_for(lambda: hasher.in_flight == 0)
+    assert hasher.check(pw_hash, 'correct horse')
+
+
+def test_hashing_runs_inline_without_workers():
+    from app.hashing import PasswordHasher
+
+    hasher = PasswordHasher(workers=0)
+    pw_hash = hasher.generate('correct horse')
+    assert hasher.check(pw_hash, 'correct horse')
+    assert not hasher.check(pw_hash, 'wrong horse')
+
+    stats = hasher.stats()
+    assert stats['latency']['count'] == 3
+    assert stats['rejected'] == 0
+    assert stats['in_flight'] == 0
+    assert hasher._pool is None
+
+
+def test_login_answers_503_while_hashing_is_saturated(flask_app, monkeypatch):
+    from threading import Thread
+    from app.hashing import PasswordHasher
+
+    hasher = PasswordHasher(workers=1, queue_depth=0, retry_after=3)
+    monkeypatch.setitem(flask_app.extensions, 'password_hasher', hasher)
+    holder = Thread(target=hasher._run, args=(time.sleep, 1))
+    holder.start()
+    wait_for(lambda: hasher.in_flight == 1)
+
+    client = flask_app.test_client()
+    credentials = {'username': ENROLLED, 'password': 'correct horse'}
+    response = client.post('/account/login', json=credentials)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+
+    holder.join()
+    wait_for(lambda: hasher.in_flight == 0)
+    assert client.post('/account/login', json=credentials).status_code == 401
@@ -4,9 +4,20 @@ Test script for the attendance verification API.
 This demonstrates the TOTP code generation and verification.
 """
 
+import base64
+import hashlib
 import sys
 import time
-from app.utils import generate_lecture_code, verify_lecture_code
+
+import pyotp
+
+from app.utils import (
+    CodeIndex,
+    batch_lecture_codes,
+    generate_lecture_code,
+    generate_lecture_code_at,
+    verify_lecture_code,
+)
 
 
 def test_totp_generation():
@@ -96,6 +107,75 @@ def test_different_lectures():
     print("\n" + "=" * 60)
 
 
+def test_code_index_expiry():
+    """Test that codes resolve for their retention windows and then expire by bucket."""
+    print("\n" + "=" * 60)
+    print("Testing Code Index Window Expiry")
+    print("=" * 60)
+
+    index = CodeIndex(retention_windows=4)
+    index.add("1234", 7, window=100)
+    index.add("5678", 8, window=101)
+
+    assert index.find("1234", window=100) == {7}
+    assert index.find("1234", window=103) == {7}
+    assert not index.find("0000", window=103)
+
+    # Window 104 drops bucket 100 but keeps bucket 101
+    assert not index.find("1234", window=104)
+    assert index.find("5678", window=104) == {8}
+
+    stats = index.stats()
+    print(f"\nIndex stats: {stats}")
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    print("✓ Codes expire a whole window at a time")
+
+    print("\n" + "=" * 60)
+
+
+def test_code_index_collisions():
+    """Test that lectures sharing a code are all kept as candidates."""
+    print("\n" + "=" * 60)
+    print("Testing Code Collisions Between Concurrent Lectures")
+    print("=" * 60)
+
+    index = CodeIndex()
+    index.add("4321", 1, window=200)
+    index.add("4321", 2, window=200)
+    index.add("4321", 3, window=201)
+
+    candidates = index.find("4321", window=201)
+    print(f"\nCandidates for 4321: {sorted(candidates)}")
+    assert candidates == {1, 2, 3}
+    print("✓ A later lecture does not overwrite an earlier one")
+
+    print("\n" + "=" * 60)
+
+
+def test_batch_matches_pyotp():
+    """Test that the raw-HMAC batch engine produces the same codes as pyotp."""
+    print("\n" + "=" * 60)
+    print("Testing Batch Codes Against pyotp")
+    print("=" * 60)
+
+    seed = "test-seed-demo"
+    windows = range(58_000_000, 58_000_005)
+    codes = batch_lecture_codes(range(1, 51), seed, windows)
+
+    for lecture_id, lecture_codes in codes.items():
+        secret = base64.b32encode(hashlib.sha256(f"{seed}_{lecture_id}".encode()).digest()).decode('utf-8')
+        totp = pyotp.TOTP(secret, interval=30, digits=4)
+        expected = [totp.generate_otp(w) for w in windows]
+        assert lecture_codes == expected, lecture_id
+        assert generate_lecture_code_at(lecture_id, seed, windows[0]) == expected[0]
+
+    print(f"\n✓ {len(codes) * len(windows)} codes match pyotp")
+
+    print("\n" + "=" * 60)
+
+
 if __name__ == "__main__":
     print("\n🎓 Lucky Cat Attendance Verification System")
     print("TOTP Code Generation Test Suite\n")
@@ -104,6 +184,9 @@ if __name__ == "__main__":
         # Run all tests
         test_different_lectures()
         test_tolerance_window()
+        test_code_index_expiry()
+        test_code_index_collisions()
+        test_batch_matches_pyotp()
 
         # Ask if user wants to run the time-based test
         print("\n" + "=" * 60)
@@ -0,0 +1,14 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py
+
+gunicorn.conf.py preloads this module in the master, so create_app() runs
+once and every worker is forked with the app already built.
+"""
+from dotenv import load_dotenv
+from app import create_app
+
+load_dotenv()
+
+app = create_app()
@@ -31,7 +31,9 @@ CREATE TABLE IF NOT EXISTS lectures (
     module_id INTEGER NOT NULL REFERENCES modules(id),
     lecturer_id TEXT REFERENCES users(student_id),
     start_time TIMESTAMP(0) WITH TIME ZONE NOT NULL,
-    end_time TIMESTAMP(0) WITH TIME ZONE NOT NULL
+    end_time TIMESTAMP(0) WITH TIME ZONE NOT NULL,
+    -- Set by the close-out job once the lecture has ended and missed streaks were applied
+    closed_at TIMESTAMP WITH TIME ZONE
 );
 
 -- Lecture attendance table
@@ -39,6 +41,8 @@ CREATE TABLE IF NOT EXISTS lecture_attendance (
     user_id TEXT NOT NULL REFERENCES users(student_id),
     lecture_id INTEGER NOT NULL REFERENCES lectures(id),
     is_attended BOOLEAN DEFAULT FALSE NOT NULL,
+    -- Bumped whenever the row changes, for incremental /attendance sync
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
     PRIMARY KEY (user_id, lecture_id)
 );
 
@@ -46,7 +50,14 @@ CREATE TABLE IF NOT EXISTS lecture_attendance (
 CREATE INDEX IF NOT EXISTS fki_fk_course ON modules(course_code);
 CREATE INDEX IF NOT EXISTS fki_fk_lecture ON lecture_attendance(lecture_id);
 CREATE INDEX IF NOT EXISTS fki_fk_user ON lecture_attendance(user_id);
-CREATE INDEX IF NOT EXISTS idx_lecturer_lectures ON lectures(lecturer_id);
+
+-- Index for "a lecturer's lectures running now" (/code, /attendance/live) when
+-- the in-process lecture index cannot answer; replaces the plain lecturer_id index
+CREATE INDEX IF NOT EXISTS idx_lectures_lecturer_time ON lectures(lecturer_id, start_time, end_time);
+DROP INDEX IF EXISTS idx_lecturer_lectures;
+
+-- Index for incremental /attendance sync ("rows changed since cursor")
+CREATE INDEX IF NOT EXISTS idx_attendance_user_updated ON lecture_attendance(user_id, updated_at);
 
 -- Index for efficient "find previous lecture by time" queries (streak calculation)
 CREATE INDEX IF NOT EXISTS idx_lecture_start_desc ON lectures(start_time DESC, id);
@@ -54,3 +65,68 @@ CREATE INDEX IF NOT EXISTS idx_lecture_start_desc ON lectures(start_time DESC, i
 -- Index for efficient module → lectures joins (leaderboard, attendance queries)
 CREATE INDEX IF NOT EXISTS idx_lectures_module_id ON lectures(module_id);
 
+-- Index for the close-out job: lectures that have not been closed yet, by end time
+CREATE INDEX IF NOT EXISTS idx_lectures_open_end ON lectures(end_time) WHERE closed_at IS NULL;
+
+-- Precomputed per-course leaderboard, maintained incrementally by /verify and
+-- the lecture close-out job (rebuild with `flask rebuild-leaderboard`)
+CREATE TABLE IF NOT EXISTS course_leaderboard (
+    course_code TEXT NOT NULL REFERENCES courses(code) ON DELETE CASCADE,
+    student_id TEXT NOT NULL REFERENCES users(student_id) ON DELETE CASCADE,
+    attended INTEGER DEFAULT 0 NOT NULL,
+    streak INTEGER DEFAULT 0 NOT NULL,
+    PRIMARY KEY (course_code, student_id)
+);
+
+-- Index for reading a course's leaderboard already in rank order
+CREATE INDEX IF NOT EXISTS idx_course_leaderboard_rank ON course_leaderboard(course_code, streak DESC, student_id);
+
+-- Number of closed (ended) lectures per course
+CREATE TABLE IF NOT EXISTS course_stats (
+    course_code TEXT PRIMARY KEY REFERENCES courses(code) ON DELETE CASCADE,
+    total_lectures INTEGER DEFAULT 0 NOT NULL
+);
+
+-- Change counters for the API's in-process reference data cache
+-- (courses, modules, lecture schedules). Statement-level triggers bump them;
+-- workers poll this table and reload only what moved.
+CREATE TABLE IF NOT EXISTS reference_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT DEFAULT 0 NOT NULL
+);
+
+INSERT INTO reference_versions (name) VALUES ('courses'), ('modules'), ('lectures')
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE reference_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER courses_reference_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON courses
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+CREATE OR REPLACE TRIGGER modules_reference_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON modules
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+-- Only schedule columns: the close-out job's closed_at updates do not count
+CREATE OR REPLACE TRIGGER lectures_reference_version
+    AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF module_id, lecturer_id, start_time, end_time ON lectures
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+-- Server-side JWT revocations: key is 'token:<sha256 hex>' for one token
+-- (logout) or 'user:<student_id>' for every token issued before revoked_at
+-- (account deletion). Rows are purged once every token they cover has expired.
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    key TEXT NOT NULL,
+    revoked_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_key ON revoked_tokens(key);
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens(revoked_at);
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Add the lecture_attendance change timestamp and its index if they do not exist.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_attendance_updated_at.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+Existing rows get the time the column was added. No backfill is needed:
+clients start with a full /attendance fetch, which returns their first cursor.
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            "ALTER TABLE lecture_attendance ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL;",
+            "CREATE INDEX IF NOT EXISTS idx_attendance_user_updated ON lecture_attendance(user_id, updated_at);",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
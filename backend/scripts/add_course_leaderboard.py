@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Create the precomputed course leaderboard tables if they do not exist.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_course_leaderboard.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+The tables start empty. Fill them once afterwards from backend/api with:
+    poetry run flask --app run rebuild-leaderboard
+From then on /verify and the lecture close-out job keep them current.
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            """CREATE TABLE IF NOT EXISTS course_leaderboard (
+                course_code TEXT NOT NULL REFERENCES courses(code) ON DELETE CASCADE,
+                student_id TEXT NOT NULL REFERENCES users(student_id) ON DELETE CASCADE,
+                attended INTEGER DEFAULT 0 NOT NULL,
+                streak INTEGER DEFAULT 0 NOT NULL,
+                PRIMARY KEY (course_code, student_id)
+            );""",
+            "CREATE INDEX IF NOT EXISTS idx_course_leaderboard_rank ON course_leaderboard(course_code, streak DESC, student_id);",
+            """CREATE TABLE IF NOT EXISTS course_stats (
+                course_code TEXT PRIMARY KEY REFERENCES courses(code) ON DELETE CASCADE,
+                total_lectures INTEGER DEFAULT 0 NOT NULL
+            );""",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Add the lecture close-out column and index if they do not exist.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_lecture_closeout.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+Existing lectures are left unclosed: the API's close-out job closes every
+ended lecture on its first run (oldest first, in batches), which also brings
+current_streak up to date for students who missed their last lecture.
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            "ALTER TABLE lectures ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP WITH TIME ZONE;",
+            "CREATE INDEX IF NOT EXISTS idx_lectures_open_end ON lectures(end_time) WHERE closed_at IS NULL;",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Replace the lecturer_id index on lectures with (lecturer_id, start_time, end_time).
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_lecture_lecturer_time_index.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+The composite index answers "this lecturer's lectures running now" with a
+range scan; its leading column still serves everything the old index did.
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            "CREATE INDEX IF NOT EXISTS idx_lectures_lecturer_time ON lectures(lecturer_id, start_time, end_time);",
+            "DROP INDEX IF EXISTS idx_lecturer_lectures;",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
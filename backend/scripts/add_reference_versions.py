@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Create the reference_versions table and the triggers that bump it.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_reference_versions.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+The API keeps courses, modules and today's lectures in memory and reloads them
+when these counters change. Without this table every worker fails to load that
+cache. Requires PostgreSQL 14+ (CREATE OR REPLACE TRIGGER).
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            """CREATE TABLE IF NOT EXISTS reference_versions (
+                name TEXT PRIMARY KEY,
+                version BIGINT DEFAULT 0 NOT NULL
+            );""",
+            """INSERT INTO reference_versions (name) VALUES ('courses'), ('modules'), ('lectures')
+            ON CONFLICT (name) DO NOTHING;""",
+            """CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE reference_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;""",
+            """CREATE OR REPLACE TRIGGER courses_reference_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON courses
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();""",
+            """CREATE OR REPLACE TRIGGER modules_reference_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON modules
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();""",
+            """CREATE OR REPLACE TRIGGER lectures_reference_version
+                AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF module_id, lecturer_id, start_time, end_time ON lectures
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();""",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
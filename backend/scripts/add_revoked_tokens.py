@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Create the revoked_tokens table used for server-side JWT revocation.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/add_revoked_tokens.py
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+This script is idempotent and safe to run multiple times.
+"""
+import os
+import sys
+
+try:
+    import psycopg2
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+
+    conn = None
+    try:
+        if db_url:
+            conn = psycopg2.connect(db_url)
+        else:
+            # Connect using environment or defaults (host, user, password, dbname)
+            conn = psycopg2.connect()
+
+        cur = conn.cursor()
+
+        queries = [
+            """CREATE TABLE IF NOT EXISTS revoked_tokens (
+                id BIGSERIAL PRIMARY KEY,
+                key TEXT NOT NULL,
+                revoked_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+                expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+            );""",
+            "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_key ON revoked_tokens(key);",
+            "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens(revoked_at);",
+        ]
+
+        for q in queries:
+            print('Executing:', q)
+            cur.execute(q)
+
+        conn.commit()
+        cur.close()
+        print('DB update complete.')
+
+    except Exception as exc:
+        print('Error updating DB:', exc)
+        sys.exit(2)
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Recompute current_streak and longest_streak for every user from lecture_attendance.
+
+Usage: run with the project's Poetry environment so dependencies are available:
+    poetry run python scripts/rebuild_streaks.py [--chunk-size 5000] [--dry-run]
+
+It reads DB connection info from environment variables:
+  - DATABASE_URL (optional, falls back to psycopg2 defaults)
+
+Run it after data fixes, imports or schema scripts such as add_streak_columns.py.
+
+Both streaks come out of one gaps-and-islands query: within each student's
+lectures (ordered by start time), consecutive attended lectures share the same
+difference between their overall row number and their row number among
+attended lectures. Grouping by that difference gives every run ("island") of
+attended lectures; the longest island is longest_streak and the island that
+ends on the student's latest lecture is current_streak.
+
+Lectures count once they have ended, or straight away if attended, which
+matches the API: a check-in increments the streak immediately and a miss
+breaks it when the lecture ends.
+
+Results are streamed from a server-side cursor and written back in chunks with
+multi-row UPDATEs, so memory stays bounded however many attendance rows exist.
+The new streaks are then copied to the precomputed course leaderboard.
+This script is idempotent and safe to run multiple times.
+"""
+import argparse
+import os
+import sys
+import time
+
+try:
+    import psycopg2
+    from psycopg2.extras import execute_values
+except Exception as e:
+    print("Missing dependency psycopg2. Install with `poetry add psycopg2-binary` and run via `poetry run python`.")
+    raise
+
+STREAKS_QUERY = """
+WITH ordered AS (
+    SELECT la.user_id,
+           la.is_attended,
+           row_number() OVER (PARTITION BY la.user_id ORDER BY l.start_time, l.id) AS rn,
+           row_number() OVER (PARTITION BY la.user_id, la.is_attended ORDER BY l.start_time, l.id) AS rn_by_state
+    FROM lecture_attendance la
+    JOIN lectures l ON l.id = la.lecture_id
+    WHERE l.end_time <= now() OR la.is_attended
+),
+islands AS (
+    SELECT user_id, count(*) AS length, max(rn) AS last_rn
+    FROM ordered
+    WHERE is_attended
+    GROUP BY user_id, rn - rn_by_state
+),
+totals AS (
+    SELECT user_id, max(rn) AS lectures
+    FROM ordered
+    GROUP BY user_id
+)
+SELECT u.student_id,
+       COALESCE(max(i.length) FILTER (WHERE i.last_rn = t.lectures), 0) AS current_streak,
+       COALESCE(max(i.length), 0) AS longest_streak,
+       COALESCE(max(t.lectures), 0) AS lectures
+FROM users u
+LEFT JOIN totals t ON t.user_id = u.student_id
+LEFT JOIN islands i ON i.user_id = u.student_id
+GROUP BY u.student_id
+ORDER BY u.student_id
+"""
+
+UPDATE_QUERY = """
+UPDATE users AS u
+SET current_streak = v.current_streak,
+    longest_streak = v.longest_streak
+FROM (VALUES %s) AS v(student_id, current_streak, longest_streak)
+WHERE u.student_id = v.student_id
+  AND (u.current_streak, u.longest_streak) IS DISTINCT FROM (v.current_streak, v.longest_streak)
+"""
+
+
+# Keep the precomputed leaderboard's streak column in step (skipped if the
+# table has not been created yet)
+SYNC_LEADERBOARD_QUERY = """
+UPDATE course_leaderboard cl
+SET streak = u.current_streak
+FROM users u
+WHERE u.student_id = cl.student_id
+  AND cl.streak <> u.current_streak
+"""
+
+
+def connect():
+    db_url = os.environ.get('DATABASE_URL')
+    if db_url:
+        return psycopg2.connect(db_url)
+    # Connect using environment or defaults (host, user, password, dbname)
+    return psycopg2.connect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute every user\'s streaks from lecture_attendance.')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Users per UPDATE batch (default 5000)')
+    parser.add_argument('--dry-run', action='store_true', help='Compute streaks but do not write them')
+    args = parser.parse_args()
+
+    read_conn = write_conn = None
+    try:
+        read_conn = connect()
+        write_conn = connect()
+
+        # Named cursor = server-side cursor: rows arrive chunk by chunk
+        cur = read_conn.cursor(name='rebuild_streaks')
+        cur.itersize = args.chunk_size
+        write_cur = write_conn.cursor()
+
+        started = time.monotonic()
+        cur.execute(STREAKS_QUERY)
+
+        users = attendance_rows = changed = 0
+        while True:
+            chunk = cur.fetchmany(args.chunk_size)
+            if not chunk:
+                break
+            users += len(chunk)
+            attendance_rows += sum(row[3] for row in chunk)
+
+            if not args.dry_run:
+                execute_values(write_cur, UPDATE_QUERY, [row[:3] for row in chunk], page_size=args.chunk_size)
+                changed += write_cur.rowcount
+                write_conn.commit()
+
+            elapsed = max(time.monotonic() - started, 1e-9)
+            print(f'{users} users, {attendance_rows} attendance rows, '
+                  f'{attendance_rows / elapsed:,.0f} rows/s', flush=True)
+
+        cur.close()
+        read_conn.commit()
+
+        if not args.dry_run:
+            write_cur.execute("SELECT to_regclass('course_leaderboard') IS NOT NULL")
+            if write_cur.fetchone()[0]:
+                write_cur.execute(SYNC_LEADERBOARD_QUERY)
+                print(f'{write_cur.rowcount} leaderboard rows updated.')
+                write_conn.commit()
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        action = 'would be checked' if args.dry_run else f'checked, {changed} updated'
+        print(f'Done: {users} users {action} from {attendance_rows} attendance rows '
+              f'in {elapsed:.1f}s ({attendance_rows / elapsed:,.0f} rows/s).')
+
+    except Exception as exc:
+        print('Error rebuilding streaks:', exc)
+        sys.exit(2)
+    finally:
+        for conn in (read_conn, write_conn):
+            if conn:
+                conn.close()
+
+if __name__ == '__main__':
+    main()
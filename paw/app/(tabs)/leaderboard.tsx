@@ -11,6 +11,7 @@ interface Student {
   name: string;
   attended: number;
   streak: number;
+  rank: number;
 }
 
 interface LeaderboardData {
@@ -18,6 +19,7 @@ interface LeaderboardData {
   courseName: string;
   totalLectures: number;
   currentUserId: string;
+  currentUser: Student | null;
   showTop: number;
   students: Student[];
 }
@@ -30,33 +32,25 @@ interface DisplayItem {
 }
 
 function buildLeaderboardDisplay(data: LeaderboardData): DisplayItem[] {
-  const { students, currentUserId, showTop } = data;
-  const sorted = [...students].sort((a, b) => b.streak - a.streak);
-  const currentUserIndex = sorted.findIndex((s) => s.id === currentUserId);
-  const items: DisplayItem[] = [];
-
-  const topCount = Math.min(showTop, sorted.length);
-  for (let i = 0; i < topCount; i++) {
-    items.push({
-      type: "student",
-      rank: i + 1,
-      student: sorted[i],
-      isCurrentUser: sorted[i].id === currentUserId,
-    });
-  }
+  // The server sends only the top students, already ranked, plus the current user's own row
+  const { students, currentUserId, currentUser, showTop } = data;
+  const items: DisplayItem[] = students.slice(0, showTop).map((s) => ({
+    type: "student",
+    rank: s.rank,
+    student: s,
+    isCurrentUser: s.id === currentUserId,
+  }));
 
   // If user is already in the top list, we're done
-  if (currentUserIndex < showTop) return items;
+  if (!currentUser || items.some((i) => i.isCurrentUser)) return items;
 
   // Otherwise add just the current user at their actual rank
-  if (currentUserIndex >= 0) {
-    items.push({
-      type: "student",
-      rank: currentUserIndex + 1,
-      student: sorted[currentUserIndex],
-      isCurrentUser: true,
-    });
-  }
+  items.push({
+    type: "student",
+    rank: currentUser.rank,
+    student: currentUser,
+    isCurrentUser: true,
+  });
 
   return items;
 }
@@ -116,20 +116,30 @@ class APIService {
     });
   }
 
-  async getAttendance() {
-    return this.request<{ attendance: Record<string, { lectures: any[] }> }>("/attendance");
+  // Pass `since` (a previous response's cursor) to fetch only rows changed since then
+  async getAttendance(params: { from?: string; to?: string; since?: string } = {}) {
+    const query = new URLSearchParams(
+      Object.entries(params).filter((entry): entry is [string, string] => entry[1] !== undefined),
+    ).toString();
+    return this.request<{ attendance: Record<string, { lectures: any[] }>; cursor: string }>(
+      query ? `/attendance?${query}` : "/attendance",
+    );
   }
 
   // Leaderboard endpoints
-  async getLeaderboard(courseCode: string) {
+  async getLeaderboard(courseCode: string, limit = 10, cursor?: string) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
     return this.request<{
       courseCode: string;
       courseName: string;
       totalLectures: number;
       currentUserId: string;
+      currentUser: { id: string; name: string; attended: number; streak: number; rank: number } | null;
       showTop: number;
-      students: { id: string; name: string; attended: number; streak: number }[];
-    }>(`/leaderboard/${courseCode}`);
+      students: { id: string; name: string; attended: number; streak: number; rank: number }[];
+      nextCursor: string | null;
+    }>(`/leaderboard/${courseCode}?${params}`);
   }
 
   // Course endpoints